@@ -1,12 +1,15 @@
 from __future__ import absolute_import
-from .mtp_msg import msg_from_buff, response_from_command
-from .mtp_proto import ContainerTypes, ResponseCodes
+from .mtp_msg import msg_from_buff, MtpResponsePool
+from .mtp_proto import ContainerTypes, ResponseCodes, MtpDataPhase
 from .mtp_exception import MtpProtocolException
 
 
 class MtpTransaction(object):
 
     def __init__(self):
+        self.clear()
+
+    def clear(self):
         self.tid = None
         self.operation = None
         self.command = None
@@ -23,15 +26,37 @@ class MtpApi(object):
     STATE_HANDLE = 3
     STATE_RESPOND = 4
 
-    def __init__(self, device):
+    def __init__(self, device, zero_copy=False):
+        '''
+        Chunked output is opt-in: by default, handle_payload returns every message as a single
+        bytes object, so the whole payload of a data phase (e.g. GetObject of a large file) is
+        built in memory. With zero_copy, the transport streams data phases with
+        MtpDataPhase.chunks, in constant memory. MtpTransport and MtpAsyncDriver turn it on.
+
+        :type device: MtpDevice
+        :param device: the device that handles the transactions
+        :param zero_copy:
+            if True, data phases of the responder are returned as MtpDataPhase objects,
+            which the transport should send chunk by chunk (see MtpDataPhase.chunks).
+            Otherwise they are packed into a single bytes object (default: False)
+        '''
         self.device = device
+        self.zero_copy = zero_copy
         self.state = None
         self.transaction = None
+        self.responses = MtpResponsePool()
         self.reset()
 
     def reset(self):
+        ir_data = self.transaction.ir_data if self.transaction else None
+        # not has_got_all_data(), which raises if more data than declared arrived
+        if ir_data and (ir_data.length != ir_data.received + 0xc):
+            ir_data.discard()
         self.state = MtpApi.STATE_WAIT_CMD
-        self.transaction = MtpTransaction()
+        if self.transaction:
+            self.transaction.clear()
+        else:
+            self.transaction = MtpTransaction()
 
     def handle_payload(self, payload):
         messages = []
@@ -39,10 +64,15 @@ class MtpApi(object):
         if self.state == MtpApi.STATE_HANDLE:
             self.state_handle()
         if self.state == MtpApi.STATE_RESPOND:
-            if self.transaction.ri_data:
-                messages.append(self.transaction.ri_data)
-            messages.append(self.transaction.response.pack())
+            ri_data = self.transaction.ri_data
+            if ri_data:
+                if isinstance(ri_data, MtpDataPhase) and not self.zero_copy:
+                    ri_data = ri_data.pack()
+                messages.append(ri_data)
+            response = self.transaction.response
+            messages.append(response.pack())
             self.reset()
+            self.responses.put(response)
         return messages
 
     def process_input(self, payload):
@@ -63,7 +93,7 @@ class MtpApi(object):
         self.state = MtpApi.STATE_RESPOND
 
     def state_wait_more_data(self, payload):
-        self.transaction.ir_data.data += payload
+        self.transaction.ir_data.add_data(payload)
         if self.transaction.ir_data.has_got_all_data():
             self.state = MtpApi.STATE_HANDLE
         else:
@@ -73,6 +103,9 @@ class MtpApi(object):
         msg = msg_from_buff(payload, permissive=True)
         if msg.ctype == ContainerTypes.Data:
             self.transaction.ir_data = msg
+            sink = self.device.get_ir_data_sink(self.transaction.command)
+            if sink:
+                msg.set_sink(sink)
             if msg.has_got_all_data():
                 self.state = MtpApi.STATE_HANDLE
             else:
@@ -85,7 +118,7 @@ class MtpApi(object):
         if msg.ctype == ContainerTypes.Command:
             self.transaction.command = msg
             self.transaction.tid = msg.tid
-            self.transaction.response = response_from_command(msg, ResponseCodes.OK)
+            self.transaction.response = self.responses.get(msg, ResponseCodes.OK)
             if msg.code not in self.device.operations:
                 self.transaction.response.code = ResponseCodes.OPERATION_NOT_SUPPORTED
                 self.state = MtpApi.STATE_RESPOND
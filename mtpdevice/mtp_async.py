@@ -0,0 +1,180 @@
+'''
+asyncio front-end that drives MtpApi over the bulk and interrupt endpoints (python 3.7+)
+'''
+from __future__ import absolute_import
+import asyncio
+import logging
+from .mtp_exception import MtpProtocolException
+from .mtp_msg import event_from_params
+from .mtp_proto import MtpDataPhase
+
+
+class MtpAsyncQueueEndpoint(object):
+    '''
+    In-memory endpoint, one queue item per transfer.
+    Writes wait while the queue is full, like a USB endpoint that the host does not read.
+    Used as a loopback stand-in for real endpoints, e.g. in tests.
+    '''
+
+    def __init__(self, maxsize=0):
+        '''
+        :param maxsize: maximal number of transfers waiting to be read (default: 0, unlimited)
+        '''
+        self.queue = asyncio.Queue(maxsize)
+
+    async def read(self):
+        '''
+        :return: the next transfer, b'' once the endpoint was closed
+        '''
+        return await self.queue.get()
+
+    async def write(self, data):
+        '''
+        :param data: a transfer to queue (copied)
+        '''
+        await self.queue.put(bytes(data))
+
+    def close(self):
+        self.queue.put_nowait(b'')
+
+
+class MtpAsyncDriver(object):
+    '''
+    Drives MtpApi from three tasks:
+
+    - the reader reads transfers from the bulk-out endpoint and hands them to MtpApi in the executor
+    - the writer writes the data phases and responses to the bulk-in endpoint
+    - the event writer writes the events from send_event to the interrupt endpoint
+
+    The reader queues at most max_pending messages for the writer, and stops reading
+    while the queue is full, so a slow host slows the reader down instead of filling the memory.
+    Data phases are written chunk by chunk: the next chunk is produced in the executor
+    (reading mapped files or calling the producer of a streamed payload) while the
+    current chunk is written, so a slow storage does not stall the loop,
+    and events can be sent in the middle of a transaction.
+    The handlers of MtpApi run in the executor as well, as they may access the storage
+    (e.g. stat a file, or write the data of SendObject).
+
+    An endpoint is any object with the coroutines read() (the next transfer, b'' at the end)
+    and write(data), see MtpAsyncQueueEndpoint.
+    '''
+
+    def __init__(
+        self, api, bulk_out, bulk_in, interrupt=None,
+        executor=None, max_pending=4, chunk_size=0x10000, logger=None
+    ):
+        '''
+        :type api: MtpApi
+        :param api: the api to drive, switched to zero copy mode
+        :param bulk_out: endpoint to read commands and I->R data from
+        :param bulk_in: endpoint to write R->I data and responses to
+        :param interrupt: endpoint to write events to (default: None, no events)
+        :param executor: executor to run the handlers and produce data phase chunks in (default: None, the loop's default)
+        :param max_pending: maximal number of messages waiting to be written (default: 4)
+        :param chunk_size: maximal size of a data phase chunk (default: 0x10000)
+        :param logger: logger (default: None, logger of the api's device)
+        '''
+        self.api = api
+        self.api.zero_copy = True
+        self.bulk_out = bulk_out
+        self.bulk_in = bulk_in
+        self.interrupt = interrupt
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.logger = logger or api.device.logger
+        self.pending = asyncio.Queue(max_pending)
+        self.events = asyncio.Queue()
+
+    async def run(self):
+        '''
+        Run until the bulk-out endpoint ends, and everything that was queued was written
+        '''
+        reader = asyncio.ensure_future(self.read_loop())
+        writer = asyncio.ensure_future(self.write_loop())
+        events = asyncio.ensure_future(self.event_loop()) if self.interrupt else None
+        tasks = [reader, writer]
+        try:
+            # if one of them fails (e.g. the host is gone), the other one would wait forever
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            await writer
+        finally:
+            for task in tasks + ([events] if events else []):
+                task.cancel()
+
+    async def read_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            payload = await self.bulk_out.read()
+            if not payload:
+                break
+            try:
+                messages = await loop.run_in_executor(self.executor, self.api.handle_payload, payload)
+            except MtpProtocolException as ex:
+                self.logger.error('[MtpAsyncDriver] dropping transaction: %s', ex)
+                self.api.reset()
+                continue
+            for message in messages:
+                await self.pending.put(message)
+        await self.pending.put(None)
+
+    async def write_loop(self):
+        while True:
+            message = await self.pending.get()
+            if message is None:
+                break
+            if isinstance(message, MtpDataPhase):
+                await self.write_data_phase(message)
+            else:
+                await self.bulk_in.write(message)
+
+    async def write_data_phase(self, data_phase):
+        '''
+        Write a data phase, producing each chunk while the previous one is written
+
+        :type data_phase: MtpDataPhase
+        :param data_phase: the data phase
+        '''
+        loop = asyncio.get_event_loop()
+        chunks = data_phase.chunks(self.chunk_size)
+        produce = loop.run_in_executor(self.executor, self.produce_chunk, chunks)
+        try:
+            while True:
+                chunk = await produce
+                if chunk is None:
+                    break
+                produce = loop.run_in_executor(self.executor, self.produce_chunk, chunks)
+                await self.bulk_in.write(chunk)
+        finally:
+            produce.cancel()
+
+    @staticmethod
+    def produce_chunk(chunks):
+        '''
+        :return: the next chunk as bytes (so a mapped file is read here, not in the loop), None at the end
+        '''
+        chunk = next(chunks, None)
+        if isinstance(chunk, memoryview):
+            chunk = chunk.tobytes()
+        return chunk
+
+    async def event_loop(self):
+        while True:
+            event = await self.events.get()
+            await self.interrupt.write(event)
+
+    def send_event(self, code, params=(), tid=0):
+        '''
+        Queue an event for the interrupt endpoint, it is sent even in the middle of a transaction
+
+        :param code: event code
+        :param params: up to three event parameters (default: no parameters)
+        :param tid: id of the transaction that the event relates to (default: 0)
+        '''
+        if self.interrupt is None:
+            raise Exception('no interrupt endpoint to send events on')
+        event = event_from_params(code, tid, params)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('[MtpAsyncDriver] queueing event %#x', code)
+        self.events.put_nowait(event.pack())
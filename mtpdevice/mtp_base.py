@@ -5,19 +5,51 @@ class IdFactory(object):
 
     def reset(self):
         self.counter = 0
+        # uids of the objects that are registered in a storage, see register
+        self.registered = set()
 
     def uid(self):
         self.counter += 1
         return self.counter
 
+    def reserve(self, uid):
+        '''
+        Make sure that uid is never returned by uid(), for objects that restore their uid
+
+        :param uid: a uid that is in use
+        '''
+        if uid > self.counter:
+            self.counter = uid
+
+    def register(self, uid):
+        '''
+        Mark a uid as used by a registered object, so restored objects do not take it
+
+        :param uid: uid of an object that was registered
+        '''
+        self.registered.add(uid)
+
+    def unregister(self, uid):
+        '''
+        :param uid: uid of an object that was unregistered
+        '''
+        self.registered.discard(uid)
+
 
 ID_FACTORY = IdFactory()
 
 
 class MtpBaseObject(object):
 
-    def __init__(self):
-        self.uid = ID_FACTORY.uid()
+    def __init__(self, uid=None):
+        '''
+        :param uid: uid to restore (default: None, get a new one)
+        '''
+        if uid is None:
+            uid = ID_FACTORY.uid()
+        else:
+            ID_FACTORY.reserve(uid)
+        self.uid = uid
 
     def get_uid(self):
         return self.uid
@@ -0,0 +1,257 @@
+'''
+Persistent catalog of the objects that were imported from the file system
+'''
+from __future__ import absolute_import
+import os
+import sqlite3
+import stat
+from .mtp_base import ID_FACTORY
+from .mtp_fs import MtpFsImporter, MtpFsSync, is_entry_of
+from .mtp_object import MtpObject, MtpObjectInfo, Formats
+from .mtp_object_data import MtpFileData
+
+
+class MtpCatalog(object):
+    '''
+    Keeps trees of objects that were imported from the file system in an sqlite database,
+    one row per object with its info fields, parent, handle, unique id
+    and the (mode, inode, size, mtime) of its real_path.
+
+    Loading a tree from the catalog creates the objects straight from the rows,
+    without listing or stat-ing the file system, and restores their handles and
+    PersistantUniqueObjectIdentifier, so the initiator sees the same handles across runs
+    (unless a handle is already taken in this process, see load).
+    load_tree then revalidates the loaded tree against the file system (see MtpFsSync),
+    and only writes the rows of the objects that changed.
+
+    Only objects that were imported from the file system are kept, objects that were
+    sent by the initiator into a tree are left out, together with everything below them.
+    '''
+
+    info_fields = (
+        'object_format', 'protection',
+        'thumb_format', 'thumb_compressed_size', 'thumb_pix_width', 'thumb_pix_height',
+        'image_pix_width', 'image_pix_height', 'image_bit_depth',
+        'assoc_type', 'assoc_desc', 'seq_num',
+        'filename', 'ctime', 'mtime', 'keywords', 'name',
+    )
+    # fields that are kept as plain data types, not as properties
+    plain_fields = (
+        'thumb_format', 'thumb_compressed_size', 'thumb_pix_width', 'thumb_pix_height',
+        'image_pix_width', 'image_pix_height', 'image_bit_depth', 'seq_num',
+    )
+    state_fields = ('mode', 'ino', 'size', 'st_mtime')
+    columns = ('tree', 'handle', 'parent', 'real_path', 'unique_id') + state_fields + info_fields
+
+    def __init__(self, path):
+        '''
+        :param path: path of the database file, created if it does not exist
+        '''
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS objects (%s, PRIMARY KEY (tree, handle))' %
+            ', '.join(MtpCatalog.columns)
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def has_tree(self, path):
+        '''
+        :param path: real_path of the root of a tree
+        :return: True if the catalog has the tree
+        '''
+        cursor = self.db.execute('SELECT 1 FROM objects WHERE tree = ? LIMIT 1', (path,))
+        return cursor.fetchone() is not None
+
+    def save(self, root):
+        '''
+        Replace the rows of a tree in the catalog
+
+        :type root: MtpObject
+        :param root: root object of the tree, with a real_path
+        '''
+        tree = root.real_path
+        rows = [self.row(tree, root, 0)]
+        stack = [root]
+        while stack:
+            obj = stack.pop()
+            dir_path = os.path.normpath(obj.real_path)
+            children = [child for child in obj.objects if is_entry_of(child, dir_path)]
+            rows.extend(self.row(tree, child, obj.get_uid()) for child in children)
+            stack.extend(reversed(children))
+        with self.db:
+            self.db.execute('DELETE FROM objects WHERE tree = ?', (tree,))
+            self.db.executemany(
+                'INSERT INTO objects VALUES (%s)' % ', '.join('?' * len(MtpCatalog.columns)),
+                rows
+            )
+
+    def update(self, root, changed, removed):
+        '''
+        Write only the rows of objects that changed since the tree was saved or loaded
+
+        :type root: MtpObject
+        :param root: root object of the tree
+        :param changed: objects that were added or changed, parents before children
+        :param removed: objects that were removed
+        '''
+        tree = root.real_path
+        placeholders = ', '.join('?' * len(MtpCatalog.columns))
+        assignments = ', '.join('%s = ?' % column for column in MtpCatalog.columns[2:])
+        with self.db:
+            self.db.executemany(
+                'DELETE FROM objects WHERE tree = ? AND handle = ?',
+                [(tree, obj.get_uid()) for obj in removed]
+            )
+            for obj in changed:
+                parent = obj.parent.get_uid() if (obj is not root) and obj.parent else 0
+                row = self.row(tree, obj, parent)
+                # an update keeps the rowid, so rows stay ordered parents first
+                cursor = self.db.execute(
+                    'UPDATE objects SET %s WHERE tree = ? AND handle = ?' % assignments,
+                    row[2:] + row[:2]
+                )
+                if not cursor.rowcount:
+                    self.db.execute('INSERT INTO objects VALUES (%s)' % placeholders, row)
+
+    def row(self, tree, obj, parent):
+        info = obj.info
+        values = [tree, obj.get_uid(), parent, obj.real_path, '%x' % info.get_field('unique_id'), self.mode(obj)]
+        values.extend(obj.fs_state or (None, None, None))
+        for name in MtpCatalog.info_fields:
+            if name in MtpCatalog.plain_fields:
+                values.append(getattr(info, name).value)
+            else:
+                values.append(info.get_field(name))
+        return values
+
+    def mode(self, obj):
+        if obj.get_format() == Formats.Association:
+            return stat.S_IFDIR
+        if isinstance(obj.data, MtpFileData):
+            return stat.S_IFREG
+        return 0
+
+    def load(self, path, handles=None):
+        '''
+        Create the objects of a tree from the catalog, without accessing the file system.
+        Objects whose handle is taken get a new handle, which is written back to the catalog.
+        Regular files without a known size (no fs_state) are loaded as stale,
+        with an empty size, and their directory is marked for a rescan (see MtpFsSync).
+
+        :param path: real_path of the root of the tree
+        :param handles:
+            handles that are already in use, e.g. device.handles
+            (default: None, the handles of all the objects that are registered in a storage)
+        :return: root MtpObject of the tree, or None if the catalog does not have the tree
+        '''
+        cursor = self.db.execute(
+            'SELECT %s FROM objects WHERE tree = ? ORDER BY rowid' % ', '.join(MtpCatalog.columns[1:]),
+            (path,)
+        )
+        if handles is None:
+            handles = ID_FACTORY.registered
+        # new handles must not take the handle of a row that is loaded later
+        ID_FACTORY.reserve(self.max_handle())
+        objs = {}
+        moved = []
+        root = None
+        for row in cursor:
+            handle, parent, real_path, unique_id, mode, ino, size, st_mtime = row[:8]
+            (
+                object_format, protection,
+                thumb_format, thumb_compressed_size, thumb_pix_width, thumb_pix_height,
+                image_pix_width, image_pix_height, image_bit_depth,
+                assoc_type, assoc_desc, seq_num,
+                filename, ctime, mtime, keywords, name
+            ) = row[8:]
+            info = MtpObjectInfo(
+                0, object_format, protection, 0,
+                thumb_format, thumb_compressed_size, thumb_pix_width, thumb_pix_height,
+                image_pix_width, image_pix_height, image_bit_depth,
+                0, assoc_type, assoc_desc, seq_num,
+                filename, ctime, mtime, keywords
+            )
+            if name != filename:
+                info.set_field('name', name)
+            stale = stat.S_ISREG(mode) and (size is None)
+            if stat.S_ISREG(mode):
+                # the file may be gone, so the size of a stale row is not taken from it
+                data = MtpFileData(real_path, 0 if stale else size)
+            else:
+                data = b''
+            obj = MtpObject(data, info, None if handle in handles else handle)
+            if obj.get_uid() != handle:
+                moved.append((handle, obj.get_uid()))
+            info.set_field('unique_id', int(unique_id, 16))
+            obj.real_path = real_path
+            if stale:
+                # the inode is unknown, so the sync updates the object instead of replacing it
+                obj.fs_state = (None, None, None)
+            elif ino is not None:
+                obj.fs_state = (ino, size, st_mtime)
+            objs[handle] = obj
+            if root is None:
+                root = obj
+            else:
+                # rows are saved parents first
+                objs[parent].add_object(obj)
+                if stale:
+                    # even sync_changed_dirs rescans the directory
+                    objs[parent].fs_state = None
+        if moved:
+            self.move(path, moved)
+        return root
+
+    def move(self, tree, moved):
+        '''
+        Change the handles of rows, and the parent of their children
+
+        :param tree: real_path of the root of the tree
+        :param moved: list of (old handle, new handle), new handles are not used by the tree
+        '''
+        with self.db:
+            self.db.executemany(
+                'UPDATE objects SET handle = ? WHERE tree = ? AND handle = ?',
+                [(new, tree, old) for (old, new) in moved]
+            )
+            self.db.executemany(
+                'UPDATE objects SET parent = ? WHERE tree = ? AND parent = ?',
+                [(new, tree, old) for (old, new) in moved]
+            )
+
+    def load_tree(self, path, handles=None, workers=None, full=False):
+        '''
+        Get a tree from the catalog, or import it from the file system if it is not in the catalog.
+        A tree from the catalog is revalidated against the file system,
+        and the rows of the objects that changed are written back to the catalog.
+
+        :param path: path of a directory
+        :param handles: handles that are already in use (default: None, see load)
+        :param workers: number of threads to import directories with (default: None)
+        :param full:
+            rescan every directory (MtpFsSync.sync) instead of only the directories
+            whose mtime changed (MtpFsSync.sync_changed_dirs), which misses files that were
+            rewritten in place (default: False)
+        :return: tuple of (root MtpObject of the tree, counts of the sync or None if the tree was imported)
+        '''
+        root = self.load(path, handles)
+        if root is None:
+            root = MtpFsImporter(workers).import_tree(path)
+            self.save(root)
+            return root, None
+        sync = MtpFsSync(root, workers=workers)
+        counts = sync.sync() if full else sync.sync_changed_dirs()
+        if sync.changed or sync.removed:
+            self.update(root, sync.changed, sync.removed)
+        return root, counts
+
+    def max_handle(self):
+        '''
+        :return: the largest handle in the catalog, over all trees
+        '''
+        value = self.db.execute('SELECT MAX(handle) FROM objects').fetchone()[0]
+        return value or 0
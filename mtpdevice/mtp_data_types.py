@@ -1,5 +1,9 @@
-from struct import calcsize, pack, unpack
+from struct import calcsize, pack, pack_into, unpack_from
+from codecs import utf_16_le_decode
+from array import array
+import sys
 import datetime
+import time
 
 
 class SimpleDataTypes(object):
@@ -28,6 +32,9 @@ class SimpleDataTypes(object):
 
 class MtpDataType(object):
 
+    # there are a few of these for every object, so they don't get a __dict__
+    __slots__ = ('dtype', 'size', 'value', 'packed')
+
     def __init__(self, dtype, value):
         self.dtype = dtype
         self.size = None
@@ -42,14 +49,57 @@ class MtpDataType(object):
             self.packed = self._pack()
         return self.packed
 
+    def packed_size(self):
+        '''
+        :return: size of the packed value, without packing it
+        '''
+        if self.packed is not None:
+            return len(self.packed)
+        return self._packed_size()
+
+    def pack_into(self, buff, offset):
+        '''
+        Pack the value into a writable buffer, without creating a bytes object for it
+
+        :param buff: the buffer (e.g. a bytearray), with at least packed_size() bytes from offset
+        :param offset: offset in the buffer
+        :return: offset after the value
+        '''
+        if self.packed is not None:
+            end = offset + len(self.packed)
+            buff[offset:end] = self.packed
+            return end
+        return self._pack_into(buff, offset)
+
+    def _packed_size(self):
+        return len(self._pack())
+
+    def _pack_into(self, buff, offset):
+        packed = self._pack()
+        end = offset + len(packed)
+        buff[offset:end] = packed
+        return end
+
     def unpack(self, buff):
-        res = self._unpack(buff)
+        res = self._unpack_from(buff, 0)
         self.set_value(res)
         return (res, buff[self.size:])
 
+    def unpack_from(self, buff, offset=0):
+        '''
+        Unpack the value at an offset of a buffer, without slicing the buffer
+
+        :return: tuple of (value, offset after the value)
+        '''
+        res = self._unpack_from(buff, offset)
+        self.set_value(res)
+        return (res, offset + self.size)
+
 
 class MtpIntType(MtpDataType):
 
+    __slots__ = ('fmt',)
+
     def __init__(self, fmt, dtype, value):
         self.fmt = fmt
         super(MtpIntType, self).__init__(dtype, value)
@@ -58,8 +108,15 @@ class MtpIntType(MtpDataType):
     def _pack(self):
         return pack(self.fmt, self.value)
 
-    def _unpack(self, buff):
-        return unpack(self.fmt, buff[:self.size])[0]
+    def _packed_size(self):
+        return self.size
+
+    def _pack_into(self, buff, offset):
+        pack_into(self.fmt, buff, offset, self.value)
+        return offset + self.size
+
+    def _unpack_from(self, buff, offset):
+        return unpack_from(self.fmt, buff, offset)[0]
 
 
 def Int8(value=0):
@@ -96,11 +153,17 @@ def UInt64(value=0):
 
 class I128(MtpIntType):
 
+    __slots__ = ()
+
     def _pack(self):
         return pack(self.fmt, (self.value & 0xffffffffffffffff), ((self.value >> 64) & 0xffffffffffffffff))
 
-    def _unpack(self, buff):
-        part1, part2 = unpack(self.fmt, buff[:self.size])
+    def _pack_into(self, buff, offset):
+        pack_into(self.fmt, buff, offset, (self.value & 0xffffffffffffffff), ((self.value >> 64) & 0xffffffffffffffff))
+        return offset + self.size
+
+    def _unpack_from(self, buff, offset):
+        part1, part2 = unpack_from(self.fmt, buff, offset)
         res = part1 | (part2 << 64)
         return res
 
@@ -114,66 +177,151 @@ def UInt128(value=0):
 
 
 class MArray(MtpDataType):
+    '''
+    Array of integers, kept in an array.array when the element type has
+    a matching typecode (all but the 128 bit types), so it is packed and unpacked
+    in one call. The values may be any iterable of ints, or a NumPy array.
+    '''
+
+    __slots__ = ('pseudo', 'ftype', 'length', 'typecode')
 
     def __init__(self, ftype, values, ltype=None):
         if ltype is None:
             ltype = UInt32
         self.pseudo = ftype(0)
         self.ftype = ftype
-        self.value = []
         self.length = ltype(0)
+        self.typecode = _array_typecode(self.pseudo)
         super(MArray, self).__init__(self.pseudo.dtype | 0x4000, values)
 
     def set_value(self, value):
-        for v in value:
-            self.add_value(self.ftype(v))
+        if self.typecode is None:
+            value = list(value)
+        elif not (isinstance(value, array) and (value.typecode == self.typecode)):
+            if hasattr(value, 'dtype') and hasattr(value, 'astype'):
+                # NumPy array, convert in bulk
+                value = _array_from_bytes(self.typecode, value.astype(self.pseudo.fmt[0] + _numpy_kinds[self.typecode]).tobytes())
+            else:
+                value = array(self.typecode, value)
+        self.value = value
         self.packed = None
 
     def add_value(self, value):
+        if isinstance(value, MtpDataType):
+            value = value.value
         self.value.append(value)
         self.packed = None
-        self.length.set_value(self.length.value + 1)
 
     def _pack(self):
-        packed = self.length.pack()
-        for v in self.value:
-            packed += v.pack()
-        return packed
-
-    def _unpack(self, buff):
-        (length, rest) = self.length.unpack(buff)
-        values = []
-        for i in range(length):
-            (v, rest) = self.pseudo.unpack(rest)
-            values.append(v)
-        self.set_value(values)
+        self.length.set_value(len(self.value))
+        if self.typecode is None:
+            return self.length.pack() + b''.join(self.ftype(v).pack() for v in self.value)
+        return self.length.pack() + _array_to_bytes(self.value)
+
+    def _unpack_from(self, buff, offset):
+        (length, offset) = self.length.unpack_from(buff, offset)
+        end = offset + (length * self.pseudo.size)
+        if end > len(buff):
+            raise ValueError('array length (%#x) exceeds the buffer' % length)
+        if self.typecode is None:
+            values = []
+            for i in range(length):
+                (v, offset) = self.pseudo.unpack_from(buff, offset)
+                values.append(v)
+        else:
+            values = _array_from_bytes(self.typecode, memoryview(buff)[offset:end])
         self.size = self.length.size + (length * self.pseudo.size)
         return values
 
 
+# struct format character to array typecode and NumPy kind of the same size
+_array_typecodes = {
+    'b': 'b', 'B': 'B', 'h': 'h', 'H': 'H', 'i': 'i', 'I': 'I', 'q': 'q', 'Q': 'Q',
+}
+_numpy_kinds = {
+    'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4', 'q': 'i8', 'Q': 'u8',
+}
+
+
+def _array_typecode(pseudo):
+    '''
+    :return: array typecode for the elements of type pseudo, or None if there is no such typecode
+    '''
+    typecode = _array_typecodes.get(pseudo.fmt[1:])
+    if typecode is None:
+        return None
+    try:
+        if array(typecode).itemsize != pseudo.size:
+            return None
+    except ValueError:
+        # 'q' and 'Q' are missing in python 2
+        return None
+    return typecode
+
+
+def _array_from_bytes(typecode, data):
+    values = array(typecode)
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        # bytes() of a memoryview is its repr in python 2
+        values.fromstring(memoryview(data).tobytes())
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def _array_to_bytes(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+
 def MEnum(ftype, values):
     return MArray(ftype, values, UInt16)
 
 
 class MStr(MtpDataType):
 
+    __slots__ = ()
+
     def __init__(self, value=''):
         super(MStr, self).__init__(0xffff, value)
 
-    def _pack(self):
+    def _encode(self):
+        '''
+        :return: tuple of (number of characters with the terminating null, the encoded string)
+        '''
         s = self.value
-        if len(self.value):
-            s += '\x00'
-            encoded = s.encode('utf-16le')
-        else:
-            encoded = b''
-        return pack('B', len(s)) + encoded
+        if not len(s):
+            return 0, b''
+        s += '\x00'
+        return len(s), s.encode('utf-16le')
 
-    def _unpack(self, buff):
-        strlen = unpack('B', buff[0:1])[0]
+    def _pack(self):
+        strlen, encoded = self._encode()
+        return pack('B', strlen) + encoded
+
+    def _packed_size(self):
+        return 1 + len(self._encode()[1])
+
+    def _pack_into(self, buff, offset):
+        strlen, encoded = self._encode()
+        pack_into('B', buff, offset, strlen)
+        offset += 1
+        buff[offset:offset + len(encoded)] = encoded
+        return offset + len(encoded)
+
+    def _unpack_from(self, buff, offset):
+        strlen = unpack_from('B', buff, offset)[0]
         encodedlen = (strlen * 2)
-        encoded = buff[1:encodedlen + 1]
-        decoded = encoded.decode('utf-16le')
+        offset += 1
+        if offset + encodedlen > len(buff):
+            raise ValueError('string length (%#x) exceeds the buffer' % strlen)
+        decoded = utf_16_le_decode(memoryview(buff)[offset:offset + encodedlen])[0]
         resstr = decoded[:-1]
         self.size = encodedlen + 1
         self.value = resstr
@@ -182,18 +330,18 @@ class MStr(MtpDataType):
 
 class MDateTime(MStr):
 
-    def _pack(self):
-        intval = self.value
-        dt = datetime.datetime.fromtimestamp(intval)
-        self.value = dt.strftime('%Y%m%dT%H%M%S')
-        packed = super(MDateTime, self)._pack()
-        self.value = intval
-        return packed
-
-    def _unpack(self, buff):
-        super(MDateTime, self)._unpack(buff)
+    __slots__ = ()
+
+    def _encode(self):
+        s = datetime.datetime.fromtimestamp(self.value).strftime('%Y%m%dT%H%M%S') + '\x00'
+        return len(s), s.encode('utf-16le')
+
+    def _unpack_from(self, buff, offset):
+        super(MDateTime, self)._unpack_from(buff, offset)
         if len(self.value):
-            self.value = int(datetime.datetime.strptime(self.value, '%Y%m%dT%H%M%S'))
+            # ignore tenths of seconds and time zone, if present
+            dt = datetime.datetime.strptime(self.value[:15], '%Y%m%dT%H%M%S')
+            self.value = int(time.mktime(dt.timetuple()))
         else:
             self.value = 0
         return self.value
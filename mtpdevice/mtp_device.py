@@ -1,7 +1,8 @@
 from __future__ import absolute_import
 from .mtp_data_types import UInt16, UInt32, MStr, MArray
-from .mtp_proto import OperationDataCodes, ResponseCodes, mtp_data, ContainerTypes
+from .mtp_proto import OperationDataCodes, ResponseCodes, mtp_data, MtpDataPhase, ContainerTypes
 from .mtp_object import MtpObjectInfo, MtpObject
+from .mtp_object_data import MtpFileData
 from .mtp_exception import MtpProtocolException
 from binascii import hexlify, unhexlify
 import struct
@@ -9,12 +10,99 @@ import logging
 
 
 operations = {}
+# ObjectHandle, ObjectPropertyCode and Datatype of an element of ObjectPropList
+prop_list_element = struct.Struct('<IHH')
+# MArray of the keys of operations, shared by all devices
+_operations_array = None
+
+
+def supported_operations():
+    '''
+    :return: MArray of the codes of all defined operations, shared between devices, do not modify it
+    '''
+    global _operations_array
+    if (_operations_array is None) or (len(_operations_array.value) != len(operations)):
+        _operations_array = MArray(UInt16, operations.keys())
+    return _operations_array
 
 
 class Operation(object):
-    def __init__(self, handler, ir_data=False):
-        self.handler = handler
-        self.ir_data = ir_data
+    '''
+    Specification of an operation, see the operation decorator
+    '''
+
+    def __init__(self, func, opcode, name, num_params=None, session_required=True, ir_data_required=False):
+        if (num_params is not None) and not (0 <= num_params <= 5):
+            raise Exception('operation %#x (%s): invalid number of parameters: %s' % (opcode, name, num_params))
+        self.func = func
+        self.opcode = opcode
+        self.name = name
+        self.num_params = num_params
+        self.session_required = session_required
+        self.ir_data = ir_data_required
+
+    def bind(self, device):
+        '''
+        :type device: MtpDevice
+        :param device: the device to handle the operation
+        :return: callable(command, response, ir_data) that validates the command and calls the handler
+        '''
+        func = self.func
+        name = self.name
+        num_params = self.num_params
+        check_params = num_params is not None
+        session_required = self.session_required
+        ir_data_required = self.ir_data
+
+        def handler(command, response, ir_data):
+            try:
+                if check_params:
+                    if command.ctype != ContainerTypes.Command:
+                        raise MtpProtocolException(ResponseCodes.INVALID_CODE_FORMAT)
+                    if command.num_params() < num_params:
+                        raise MtpProtocolException(ResponseCodes.PARAMETER_NOT_SUPPORTED)
+                if session_required and (device.session_id is None):
+                    raise MtpProtocolException(ResponseCodes.SESSION_NOT_OPEN)
+                if ir_data_required and (ir_data is None):
+                    raise MtpProtocolException(ResponseCodes.INVALID_DATASET)
+                return func(device, command, response, ir_data)
+            except MtpProtocolException as ex:
+                response.code = ex.response
+                return None
+
+        fuzzer = device.fuzzer
+
+        def fuzzed(command, response, ir_data):
+            res = fuzzer.get_mutation(
+                stage=name,
+                data={
+                    'command': struct.pack('<H', command.code),
+                    'transaction_id': struct.pack('<I', command.tid)
+                })
+            if res is not None:
+                device.logger.info('[MtpDevice] got mutation from fuzzer')
+                return res
+            return handler(command, response, ir_data)
+
+        quiet = fuzzed if fuzzer else handler
+
+        def dispatch(command, response, ir_data):
+            logger = device.logger
+            if not logger.isEnabledFor(logging.INFO):
+                return quiet(command, response, ir_data)
+            logger.info('[MtpDevice] --------------------------------------------------')
+            logger.info('[MtpDevice] handling command: %#x (%s)', command.code, name)
+            logger.info('[MtpDevice] params: %s', ' '.join('%#x' % command.get_param(i) for i in range(command.num_params())))
+            if ir_data:
+                logger.info('[MtpDevice] I->R data (%s): %s', len(ir_data.data), hexlify(ir_data.data[12:60]))
+            res = quiet(command, response, ir_data)
+            if res and len(res) > 12:
+                pad = '...' if len(res) > 60 else ''
+                logger.info('[MtpDevice] R->I data(%s): %s %s', len(res), hexlify(res[12:60]), pad)
+            logger.info('[MtpDevice] response: %#x', response.code)
+            return res
+
+        return dispatch
 
 
 def operation(opcode, name, num_params=None, session_required=True, ir_data_required=False):
@@ -30,46 +118,11 @@ def operation(opcode, name, num_params=None, session_required=True, ir_data_requ
 
     def decorator(func):
         def wrapper(self, command, response, ir_data):
-            self.logger.info('[MtpDevice] --------------------------------------------------')
-            self.logger.info('[MtpDevice] handling command: %#x (%s)' % (command.code, name))
-            self.logger.info('[MtpDevice] params: %s' % (' '.join('%#x' % command.get_param(i) for i in range(command.num_params()))))
-            if ir_data:
-                self.logger.info('[MtpDevice] I->R data (%s): %s' % (len(ir_data.data), hexlify(ir_data.data[12:60])))
-            res = None
-            if self.fuzzer:
-                res = self.fuzzer.get_mutation(
-                    stage=name,
-                    data={
-                        'command': struct.pack('<H', command.code),
-                        'transaction_id': struct.pack('<I', command.tid)
-                    })
-            if res is not None:
-                self.logger.info('[MtpDevice] got mutation from fuzzer')
-            else:
-                try:
-                    if num_params is not None:
-                        if command.ctype != ContainerTypes.Command:
-                            raise MtpProtocolException(ResponseCodes.INVALID_CODE_FORMAT)
-                        if command.num_params() < num_params:
-                            raise MtpProtocolException(ResponseCodes.PARAMETER_NOT_SUPPORTED)
-                    if session_required and (self.session_id is None):
-                        raise MtpProtocolException(ResponseCodes.SESSION_NOT_OPEN)
-                    if ir_data_required and (ir_data is None):
-                        raise MtpProtocolException(ResponseCodes.INVALID_DATASET)
-                    res = func(self, command, response, ir_data)
-                except MtpProtocolException as ex:
-                    response.code = ex.response
-                    res = None
-            if res and len(res) > 12:
-                pad = '...' if len(res) > 60 else ''
-                self.logger.info('[MtpDevice] R->I data(%s): %s %s' % (len(res), hexlify(res[12:60]), pad))
-                # self.logger.info('[MtpDevice] R->I data(%s): %s' % (len(res), hexlify(res)))
-            self.logger.info('[MtpDevice] response: %#x' % response.code)
-            return res
+            return self.dispatch[opcode](command, response, ir_data)
 
         if opcode in operations:
             raise Exception('operation %#x already defined', opcode)
-        operations[opcode] = Operation(wrapper, ir_data_required)
+        operations[opcode] = Operation(func, opcode, name, num_params, session_required, ir_data_required)
         return wrapper
 
     return decorator
@@ -86,12 +139,11 @@ class MtpDevice(object):
         self.info = info
         self.info.set_device(self)
         self.stores = {}
+        self.handles = {}
         self.operations = operations
-        for op in self.operations:
-            self.info.operations_supported.add_value(UInt16(op))
+        self.info.set_operations(supported_operations())
         self.events = {}
-        for event in self.events:
-            self.info.events_supported.add_value(UInt16(event))
+        self.info.set_events(self.events.keys())
         self.session_id = None
         self.last_obj = None
         self.properties = {}
@@ -100,14 +152,35 @@ class MtpDevice(object):
         for prop in properties:
             self.add_property(prop)
         self.captures = {}
+        # packed payloads of GetObjectPropDesc, by (property code, format code)
+        # and of GetObjectPropsSupported, by format code
+        self.prop_desc_cache = {}
+        self.props_supported_cache = {}
         self.fuzzer = None
+        self.dispatch = {}
+        self.build_dispatch()
 
     def set_fuzzer(self, fuzzer):
         self.fuzzer = fuzzer
+        self.build_dispatch()
+
+    def build_dispatch(self):
+        '''
+        Bind all operations to the device, in a table of opcode to handler
+        '''
+        self.dispatch = dict((opcode, op.bind(self)) for (opcode, op) in self.operations.items())
+
+    # the format code is chosen by the initiator, so the caches are bounded
+    max_cached_payloads = 1024
+
+    def cache_payload(self, cache, key, payload):
+        if len(cache) >= self.max_cached_payloads:
+            cache.clear()
+        cache[key] = payload
 
     def add_property(self, prop):
         self.properties[prop.get_code()] = prop
-        self.info.properties.add_value(UInt16(prop.get_code()))
+        self.info.add_property(prop.get_code())
 
     def get_info(self):
         return self.info.pack()
@@ -120,18 +193,42 @@ class MtpDevice(object):
         self.stores[storage.get_uid()] = storage
         storage.set_device(self)
 
+    def register_object(self, obj):
+        '''
+        :type obj: MtpObject
+        :param obj: object to add to the device-wide handle registry
+        '''
+        self.handles[obj.get_uid()] = obj
+
+    def unregister_object(self, obj):
+        '''
+        :type obj: MtpObject
+        :param obj: object to remove from the device-wide handle registry
+        '''
+        self.handles.pop(obj.get_uid(), None)
+
+    def get_ir_data_sink(self, command):
+        '''
+        :param command: the command whose I->R data phase is starting
+        :return: sink to stream the data into, or None to keep the data in memory
+        '''
+        if (command.code == OperationDataCodes.SendObject) and self.last_obj and self.last_obj.storage:
+            return self.last_obj.storage.new_data_sink(self.last_obj)
+        return None
+
     def handle_transaction(self, command, response, ir_data):
         ccode = command.code
-        if ccode in operations:
-            if self.last_obj and (ccode != OperationDataCodes.SendObject):
-                self.last_obj.delete(0xffffffff)
-                self.last_obj = None
-            return self.operations[ccode].handler(self, command, response, ir_data)
-        return None
+        dispatch = self.dispatch.get(ccode)
+        if dispatch is None:
+            return None
+        if self.last_obj and (ccode != OperationDataCodes.SendObject):
+            self.last_obj.delete(0xffffffff)
+            self.last_obj = None
+        return dispatch(command, response, ir_data)
 
     @operation(OperationDataCodes.GetDeviceInfo, 'GetDeviceInfo', num_params=0, session_required=False)
     def GetDeviceInfo(self, command, response, ir_data):
-        return mtp_data(command, self.get_info())
+        return MtpDataPhase(command, self.get_info())
 
     @operation(OperationDataCodes.OpenSession, 'OpenSession', num_params=1, session_required=False)
     def OpenSession(self, command, response, ir_data):
@@ -159,8 +256,8 @@ class MtpDevice(object):
         store_id = command.get_param(0)
         obj_fmt_code = command.get_param(1)
         assoc_handle = command.get_param(2)
-        objs = self.get_objects(store_id=store_id, obj_fmt_code=obj_fmt_code, association=assoc_handle)
-        return mtp_data(command, UInt32(len(objs)).pack())
+        num_objs = self.count_objects(store_id=store_id, obj_fmt_code=obj_fmt_code, association=assoc_handle)
+        return mtp_data(command, UInt32(num_objs).pack())
 
     @operation(OperationDataCodes.GetObjectHandles, 'GetObjectHandles', num_params=1)
     def GetObjectHandles(self, command, response, ir_data):
@@ -174,13 +271,14 @@ class MtpDevice(object):
     def GetObjectInfo(self, command, response, ir_data):
         handle = command.get_param(0)
         obj = self.get_object(handle)
-        return mtp_data(command, obj.get_info())
+        return MtpDataPhase(command, obj.get_info())
 
     @operation(OperationDataCodes.GetObject, 'GetObject', num_params=1)
     def GetObject(self, command, response, ir_data):
         handle = command.get_param(0)
         obj = self.get_object(handle)
-        return mtp_data(command, obj.data)
+        payload, length = obj.get_data_payload()
+        return MtpDataPhase(command, payload, length)
 
     @operation(OperationDataCodes.GetThumb, 'GetThumb', num_params=1)
     def GetThumb(self, command, response, ir_data):
@@ -207,12 +305,8 @@ class MtpDevice(object):
         parent_handle = command.get_param(1)
         if store_id:
             store = self.get_store(store_id)
-            if parent_handle:
-                parent = store.get_object(parent_handle)
-                parent_uid = parent.get_uid()
-            else:
-                parent = store
-                parent_uid = 0
+            parent = self.get_parent(store, parent_handle)
+            parent_uid = parent.get_uid() if parent_handle else 0
             if store.can_write():
                 obj_info = MtpObjectInfo.from_buff(ir_data.data)
                 obj = MtpObject(None, obj_info)
@@ -234,7 +328,16 @@ class MtpDevice(object):
     def SendObject(self, command, response, ir_data):
         if not self.last_obj:
             raise MtpProtocolException(ResponseCodes.NO_VALID_OBJECT_INFO)
-        self.last_obj.set_data(ir_data.data, adhere_size=True)
+        if (ir_data.sink is not None) and ir_data.sink.exceeded:
+            # more than the declared size or the free space, the sink already removed the file
+            raise MtpProtocolException(ResponseCodes.STORE_FULL)
+        try:
+            self.last_obj.set_data(ir_data.data, adhere_size=True)
+        except MtpProtocolException:
+            ir_data.discard()
+            raise
+        if isinstance(ir_data.data, MtpFileData):
+            self.last_obj.real_path = ir_data.data.path
         self.last_obj = None
 
     # @operation(OperationDataCodes.InitiateCapture, 'InitiateCapture', num_params=0)
@@ -324,14 +427,11 @@ class MtpDevice(object):
         parent_handle = command.get_param(2)
         obj = self.get_object(obj_handle)
         store = self.get_store(store_id)
-        if parent_handle:
-            parent = self.get_objects(parent_handle)
-        else:
-            parent = store
+        parent = self.get_parent(store, parent_handle)
         if not store.can_write():
             raise MtpProtocolException(ResponseCodes.STORE_READ_ONLY)
         obj.delete_self(0xffffffff)
-        parent.add(obj)
+        parent.add_object(obj)
 
     @operation(OperationDataCodes.CopyObject, 'CopyObject', num_params=3)
     def CopyObject(self, command, response, ir_data):
@@ -340,14 +440,11 @@ class MtpDevice(object):
         parent_handle = command.get_param(2)
         obj = self.get_object(obj_handle)
         store = self.get_store(store_id)
-        if parent_handle:
-            parent = self.get_objects(parent_handle)
-        else:
-            parent = store
+        parent = self.get_parent(store, parent_handle)
         if not store.can_write():
             raise MtpProtocolException(ResponseCodes.STORE_READ_ONLY)
         new_obj = obj.copy()
-        parent.add(new_obj)
+        parent.add_object(new_obj)
         response.add_param(new_obj.get_uid())
 
     @operation(OperationDataCodes.GetPartialObject, 'GetPartialObject', num_params=3)
@@ -356,9 +453,9 @@ class MtpDevice(object):
         offset = command.get_param(1)
         max_bytes = command.get_param(2)
         obj = self.get_object(handle)
-        data = obj.data[offset:offset + max_bytes]
-        response.add_param(len(data))
-        return mtp_data(command, data)
+        payload, length = obj.get_data_payload(offset, max_bytes)
+        response.add_param(length)
+        return MtpDataPhase(command, payload, length)
 
     # @operation(OperationDataCodes.InitiateOpenCapture, 'InitiateOpenCapture', num_params=0)
     def InitiateOpenCapture(self, command, response, ir_data):
@@ -367,23 +464,31 @@ class MtpDevice(object):
     @operation(OperationDataCodes.GetObjectPropsSupported, 'GetObjectPropsSupported', num_params=1)
     def GetObjectPropsSupported(self, command, response, ir_data):
         obj_fmt_code = command.get_param(0)
-        props_supported = MtpObject.get_supported_props(obj_fmt_code)
-        return mtp_data(command, MArray(UInt16, props_supported).pack())
+        payload = self.props_supported_cache.get(obj_fmt_code)
+        if payload is None:
+            props_supported = MtpObject.get_supported_props(obj_fmt_code)
+            payload = MArray(UInt16, props_supported).pack()
+            self.cache_payload(self.props_supported_cache, obj_fmt_code, payload)
+        return mtp_data(command, payload)
 
     @operation(OperationDataCodes.GetObjectPropDesc, 'GetObjectPropDesc', num_params=2)
     def GetObjectPropDesc(self, command, response, ir_data):
         obj_prop_code = command.get_param(0)
         obj_fmt_code = command.get_param(1)
-        obj_prop_desc = MtpObject.get_obj_prop_desc(obj_prop_code, obj_fmt_code)
-        return mtp_data(command, obj_prop_desc.pack())
+        key = (obj_prop_code, obj_fmt_code)
+        payload = self.prop_desc_cache.get(key)
+        if payload is None:
+            obj_prop_desc = MtpObject.get_obj_prop_desc(obj_prop_code, obj_fmt_code)
+            payload = obj_prop_desc.pack()
+            self.cache_payload(self.prop_desc_cache, key, payload)
+        return mtp_data(command, payload)
 
     @operation(OperationDataCodes.GetObjectPropValue, 'GetObjectPropValue', num_params=2)
     def GetObjectPropValue(self, command, response, ir_data):
         obj_handle = command.get_param(0)
         obj_prop_code = command.get_param(1)
         obj = self.get_object(obj_handle)
-        obj_prop = obj.get_property(obj_prop_code)
-        return mtp_data(command, obj_prop.pack())
+        return mtp_data(command, obj.get_property_value(obj_prop_code))
 
     @operation(OperationDataCodes.SetObjectPropValue, 'SetObjectPropValue', num_params=2, ir_data_required=True)
     def SetObjectPropValue(self, command, response, ir_data):
@@ -395,27 +500,73 @@ class MtpDevice(object):
 
     @operation(OperationDataCodes.GetObjectPropList, 'GetObjectPropList', num_params=5)
     def GetObjectPropList(self, command, response, ir_data):
-        '''
-        .. todo:: real implementation
-        '''
         obj_handle = command.get_param(0)
-        # obj_fmt_code = command.get_param(1)
+        obj_fmt_code = command.get_param(1)
         obj_prop_code = command.get_param(2)
-        # obj_prop_group_code = command.get_param(3)
-        # depth = command.get_param(4)
-        obj = self.get_object(obj_handle)
-        if obj_prop_code == 0xffffffff:
-            props = obj.info.props.values()
+        obj_prop_group_code = command.get_param(3)
+        depth = command.get_param(4)
+        objs = self.get_prop_list_objects(obj_handle, depth)
+        if obj_fmt_code:
+            objs = [obj for obj in objs if obj.format_matches(obj_fmt_code)]
+        props = self.get_prop_list_props(obj_fmt_code, obj_prop_code, obj_prop_group_code)
+        # size the dataset first, then pack every value straight into it
+        count = len(objs) * len(props)
+        size = 4 + (prop_list_element.size * count)
+        for obj in objs:
+            for (prop_code, dtype) in props:
+                size += obj.get_property_size(prop_code)
+        data = bytearray(size)
+        struct.pack_into('<I', data, 0, count)
+        offset = 4
+        for obj in objs:
+            handle = obj.get_uid()
+            for (prop_code, dtype) in props:
+                prop_list_element.pack_into(data, offset, handle, prop_code, dtype)
+                offset = obj.pack_property_into(prop_code, data, offset + prop_list_element.size)
+        return MtpDataPhase(command, data)
+
+    def get_prop_list_objects(self, handle, depth):
+        '''
+        :param handle: handle of an object, 0 for the root, 0xffffffff for all objects
+        :param depth:
+            0 for the object itself, 1 for its children,
+            0xffffffff for all objects below it (ignored if handle is 0xffffffff)
+        :raises: MtpProtocolException if the handle is invalid or the depth is not supported
+        :return: list of the objects that GetObjectPropList should describe
+        '''
+        if handle == 0xffffffff:
+            return list(self.handles.values())
+        if depth == 0:
+            return [self.get_object(handle)] if handle else []
+        if depth == 1:
+            return self.get_objects(association=handle)
+        if depth == 0xffffffff:
+            if not handle:
+                return list(self.handles.values())
+            return self.get_object(handle).get_objects()
+        raise MtpProtocolException(ResponseCodes.SPECIFICATION_BY_DEPTH_UNSUPPORTED)
+
+    def get_prop_list_props(self, obj_fmt_code, prop_code, group_code):
+        '''
+        :param prop_code: code of a property, 0xffffffff for all properties, 0 to select by group_code
+        :param group_code: property group code (used only if prop_code is 0)
+        :raises: MtpProtocolException if the property is not supported
+        :return: list of (property code, data type) that GetObjectPropList should describe,
+            empty if no property is in the group
+        '''
+        supported = MtpObject.get_supported_props(obj_fmt_code)
+        if prop_code == 0xffffffff:
+            codes = supported
+        elif prop_code == 0:
+            codes = [
+                code for code in supported
+                if MtpObject.get_obj_prop_desc(code, obj_fmt_code).group_code.value == group_code
+            ]
+        elif prop_code in supported:
+            codes = [prop_code]
         else:
-            props = [obj.get_property(obj_prop_code)]
-        num_elems = len(props)
-        data = UInt32(num_elems).pack()
-        for v in props:
-            data += UInt32(obj_handle).pack()
-            data += v.desc.code.pack()
-            data += v.desc.dtype.pack()
-            data += v.pack()
-        return mtp_data(command, data)
+            raise MtpProtocolException(ResponseCodes.OBJECT_PROP_NOT_SUPPORTED)
+        return [(code, MtpObject.get_obj_prop_desc(code, obj_fmt_code).dtype.value) for code in codes]
 
     @operation(OperationDataCodes.GetObjectReferences, 'GetObjectReferences', num_params=1)
     def GetObjectReferences(self, command, response, ir_data):
@@ -461,19 +612,41 @@ class MtpDevice(object):
 
     def get_objects(self, store_id=None, obj_fmt_code=None, association=None):
         stores = self.get_stores(store_id)
+        parent = self.get_parent_handle(association)
         objs = []
         for store in stores:
-            objs.extend(store.get_objects())
-        if obj_fmt_code is not None:
-            objs = [obj for obj in objs if obj.format_matches(obj_fmt_code)]
-        if association is not None:
-            if association and (association != 0xffffffff):
-                parent = self.get_object(association)
-            else:
-                parent = None
-            objs = [obj for obj in objs if obj.parent == parent]
+            objs.extend(store.get_objects(obj_fmt_code, parent))
         return objs
 
+    def count_objects(self, store_id=None, obj_fmt_code=None, association=None):
+        '''
+        Count the objects that get_objects would return, without building the list
+        '''
+        stores = self.get_stores(store_id)
+        parent = self.get_parent_handle(association)
+        return sum(store.num_objects(obj_fmt_code, parent) for store in stores)
+
+    def get_parent_handle(self, association):
+        '''
+        :param association: association parameter of GetObjectHandles/GetNumObjects
+        :raises: MtpProtocolException if there is no object with given handle
+        :return: None for any parent, 0 for the storage root, or handle of the parent object
+        '''
+        if association is None:
+            return None
+        parent = self.get_association(association)
+        return parent.get_uid() if parent else 0
+
+    def get_association(self, association):
+        '''
+        :param association: handle of the parent object (0 or 0xffffffff for the storage root)
+        :raises: MtpProtocolException if there is no object with given handle
+        :return: MtpObject, or None for the storage root
+        '''
+        if association and (association != 0xffffffff):
+            return self.get_object(association)
+        return None
+
     def get_handles(self, store_id=None, obj_fmt_code=None, association=None):
         objs = self.get_objects(store_id, obj_fmt_code, association)
         return [obj.get_uid() for obj in objs]
@@ -484,15 +657,25 @@ class MtpDevice(object):
         :raises: MtpProtocolException if there is no object with given handle
         :return: MtpObject
         '''
-        obj = None
-        for store in self.stores.values():
-            obj = store.get_object(handle)
-            if obj:
-                break
-        if not obj:
+        obj = self.handles.get(handle)
+        if obj is None:
             raise MtpProtocolException(ResponseCodes.INVALID_OBJECT_HANDLE)
         return obj
 
+    def get_parent(self, store, parent_handle):
+        '''
+        :param store: the storage the parent should be in
+        :param parent_handle: handle of the parent object (0 for the storage root)
+        :raises: MtpProtocolException if the parent is not an object in the storage
+        :return: MtpObject or MtpStorage
+        '''
+        if not parent_handle:
+            return store
+        parent = store.get_object(parent_handle)
+        if parent is None:
+            raise MtpProtocolException(ResponseCodes.INVALID_PARENT_OBJECT)
+        return parent
+
     def get_stores(self, store_id=None):
         if (store_id is None) or (store_id == 0xffffffff):
             return self.stores.values()
@@ -557,24 +740,50 @@ class MtpDeviceInfo(object):
         self.device_version = MStr(device_version)
         self.serial_number = MStr(serial_number)
         self.device = None
+        # the packed dataset, dropped by the methods below
+        self.packed = None
 
     def set_device(self, device):
         self.device = device
 
+    def set_operations(self, ops):
+        '''
+        :type ops: MArray
+        :param ops: array of the supported operation codes
+        '''
+        self.operations_supported = ops
+        self.packed = None
+
+    def set_events(self, events):
+        '''
+        :param events: codes of the supported events
+        '''
+        self.events_supported = MArray(UInt16, events)
+        self.packed = None
+
+    def add_property(self, code):
+        '''
+        :param code: code of a supported device property
+        '''
+        self.properties.add_value(code)
+        self.packed = None
+
     def pack(self):
-        return (
-            self.std_version.pack() +
-            self.mtp_vendor_ext_id.pack() +
-            self.mtp_version.pack() +
-            self.mtp_extensions.pack() +
-            self.functional_mode.pack() +
-            self.operations_supported.pack() +
-            self.events_supported.pack() +
-            self.properties.pack() +
-            self.capture_formats.pack() +
-            self.playback_formats.pack() +
-            self.manufacturer.pack() +
-            self.model.pack() +
-            self.device_version.pack() +
-            self.serial_number.pack()
-        )
+        if self.packed is None:
+            self.packed = b''.join([
+                self.std_version.pack(),
+                self.mtp_vendor_ext_id.pack(),
+                self.mtp_version.pack(),
+                self.mtp_extensions.pack(),
+                self.functional_mode.pack(),
+                self.operations_supported.pack(),
+                self.events_supported.pack(),
+                self.properties.pack(),
+                self.capture_formats.pack(),
+                self.playback_formats.pack(),
+                self.manufacturer.pack(),
+                self.model.pack(),
+                self.device_version.pack(),
+                self.serial_number.pack(),
+            ])
+        return self.packed
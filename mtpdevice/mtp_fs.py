@@ -0,0 +1,416 @@
+'''
+Import of a directory tree from the file system as MTP objects
+'''
+from __future__ import absolute_import
+import errno
+import os
+import select
+import stat
+import struct
+import time
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+from .mtp_object import MtpObject, Formats
+from .mtp_object_data import MtpFileData
+
+
+def _scandir(path):
+    '''
+    :return: list of (name, stat result) of the entries of a directory, sorted by name
+    '''
+    entries = []
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(path):
+            try:
+                entries.append((entry.name, entry.stat()))
+            except OSError:
+                # vanished, or a broken link
+                pass
+    else:
+        for name in os.listdir(path):
+            try:
+                entries.append((name, os.stat(os.path.join(path, name))))
+            except OSError:
+                pass
+    entries.sort(key=lambda entry: entry[0])
+    return entries
+
+
+def is_entry_of(obj, dir_path):
+    '''
+    :type obj: MtpObject
+    :param obj: an object
+    :param dir_path: normalized path of a directory
+    :return: True if the object was imported from an entry of the directory
+        (objects sent by the initiator have no real_path, or a path in the storage root)
+    '''
+    return bool(obj.real_path) and (os.path.normpath(os.path.dirname(obj.real_path)) == dir_path)
+
+
+class MtpFsNode(object):
+    '''
+    A file or directory found by the scan phase of MtpFsImporter
+    '''
+
+    __slots__ = ('path', 'st', 'children')
+
+    def __init__(self, path, st):
+        self.path = path
+        self.st = st
+        self.children = [] if stat.S_ISDIR(st.st_mode) else None
+
+
+class MtpFsImporter(object):
+    '''
+    Builds a tree of MtpObject from a directory tree.
+
+    The import has two phases: the scan lists the directories, one level at a time,
+    optionally listing the directories of a level in parallel, and keeps the stat
+    results of the entries. The build then creates the objects from those stat results,
+    parents before children and entries of a directory sorted by name,
+    so the same tree always gets handles in the same order.
+    The duration of each phase is kept in self.timings.
+    '''
+
+    def __init__(self, workers=None, watch=None):
+        '''
+        :param workers:
+            number of threads to list directories with (default: None, list them serially).
+            Helps mostly with network file systems, where listing is dominated by latency.
+        :param watch:
+            called with the path of each directory before it is listed, e.g. to add an inotify watch,
+            so nothing that is created after the listing is missed (default: None)
+        '''
+        self.workers = workers
+        self.watch = watch
+        self.timings = {}
+
+    def import_tree(self, path):
+        '''
+        :param path: path of a file or a directory
+        :return: MtpObject of the path, with objects for everything below it
+        '''
+        start = time.time()
+        root = self.scan(path)
+        scanned = time.time()
+        obj = self.build(root)
+        built = time.time()
+        self.timings = {
+            'scan': scanned - start,
+            'build': built - scanned,
+            'total': built - start,
+        }
+        return obj
+
+    def scan(self, path):
+        '''
+        :param path: path of a file or a directory
+        :return: MtpFsNode of the path, with nodes for everything below it
+        '''
+        if not os.path.exists(path):
+            raise Exception('there is no file/dir at %s' % os.path.abspath(path))
+        root = MtpFsNode(path, os.stat(path))
+        level = [root] if root.children is not None else []
+        pool = None
+        if self.workers and ThreadPoolExecutor:
+            pool = ThreadPoolExecutor(self.workers)
+        try:
+            while level:
+                paths = [node.path for node in level]
+                if self.watch:
+                    for dir_path in paths:
+                        self.watch(dir_path)
+                if pool and (len(level) > 1):
+                    listings = pool.map(_scandir, paths)
+                else:
+                    listings = map(_scandir, paths)
+                next_level = []
+                for node, entries in zip(level, listings):
+                    for name, st in entries:
+                        child = MtpFsNode(os.path.join(node.path, name), st)
+                        node.children.append(child)
+                        if child.children is not None:
+                            next_level.append(child)
+                level = next_level
+        finally:
+            if pool:
+                pool.shutdown()
+        return root
+
+    def build(self, root):
+        '''
+        :type root: MtpFsNode
+        :param root: result of the scan phase
+        :return: MtpObject of the root node, with objects for all nodes below it
+        '''
+        root_obj = MtpObject.from_stat(root.path, root.st)
+        stack = [(root, root_obj)]
+        while stack:
+            node, obj = stack.pop()
+            if not node.children:
+                continue
+            children = []
+            for child in node.children:
+                child_obj = MtpObject.from_stat(child.path, child.st)
+                obj.add_object(child_obj)
+                children.append((child, child_obj))
+            # reversed, so the first child is the first to be expanded
+            stack.extend(reversed(children))
+        return root_obj
+
+
+class MtpFsSync(object):
+    '''
+    Keeps a tree of objects that was imported from the file system in sync with it.
+
+    Objects are matched to directory entries by the name of their real_path.
+    Unchanged objects are left alone, so their handles stay valid;
+    a file whose size or mtime changed is updated in place,
+    a file whose inode or type changed is replaced, and new entries are imported.
+    Objects that are not entries of their parent's directory, i.e. objects without a real_path
+    or with a real_path elsewhere (e.g. sent by the initiator and kept in the storage root),
+    are never touched.
+
+    With a watcher (MtpInotifyWatcher), process_events only rescans
+    the directories that the kernel reported as changed.
+    '''
+
+    def __init__(self, root, watcher=None, workers=None):
+        '''
+        :type root: MtpObject
+        :param root: object of the root directory of the tree (with a real_path)
+        :type watcher: MtpInotifyWatcher
+        :param watcher: watcher to get the changed directories from (default: None)
+        :param workers: number of threads to import new directories with (default: None)
+        '''
+        self.root = root
+        self.watcher = watcher
+        # new directories are watched before they are listed
+        self.importer = MtpFsImporter(workers, watch=watcher.add_watch if watcher else None)
+        self.dirs = {}
+        self.reset_counts()
+        self.add_dirs(root)
+
+    def reset_counts(self):
+        self.counts = {'added': 0, 'removed': 0, 'updated': 0}
+        # objects that were added or whose fs_state changed, parents first, and objects that were removed
+        self.changed = []
+        self.removed = []
+
+    def sync(self):
+        '''
+        Rescan the whole tree
+
+        :return: dict with the number of objects that were added, removed and updated
+        '''
+        self.reset_counts()
+        self.sync_dir(self.root, recursive=True)
+        return self.counts
+
+    def sync_changed_dirs(self):
+        '''
+        Rescan only the directories whose inode, size or mtime changed since they were last synced.
+        This finds every entry that was added, removed or renamed, with a stat per directory
+        instead of per entry, but not files that were rewritten in place, which sync()
+        or the watcher find later.
+
+        :return: dict with the number of objects that were added, removed and updated
+        '''
+        self.reset_counts()
+        for path, obj in sorted(self.dirs.items()):
+            if self.dirs.get(path) is not obj:
+                # removed by the sync of its parent
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            state = (st.st_ino, st.st_size, st.st_mtime)
+            if obj.fs_state != state:
+                self.sync_dir(obj, recursive=False)
+                obj.fs_state = state
+                self.changed.append(obj)
+        return self.counts
+
+    def process_events(self, timeout=0):
+        '''
+        Rescan the directories that changed according to the watcher
+
+        :param timeout: seconds to wait for events (default: 0, don't wait)
+        :return: dict with the number of objects that were added, removed and updated
+        '''
+        self.reset_counts()
+        dirty, overflow = self.watcher.read_events(timeout)
+        if overflow:
+            self.sync_dir(self.root, recursive=True)
+            return self.counts
+        for path in sorted(dirty):
+            obj = self.dirs.get(path)
+            if obj is not None:
+                self.sync_dir(obj, recursive=False)
+        return self.counts
+
+    def sync_dir(self, obj, recursive):
+        '''
+        :type obj: MtpObject
+        :param obj: object of a directory
+        :param recursive: also sync the existing subdirectories
+        '''
+        try:
+            entries = dict(_scandir(obj.real_path))
+        except OSError:
+            # the directory itself is gone, its parent's sync removes it
+            return
+        children = {}
+        dir_path = os.path.normpath(obj.real_path)
+        for child in obj.objects:
+            if is_entry_of(child, dir_path):
+                children[os.path.basename(child.real_path)] = child
+        for name, child in children.items():
+            st = entries.get(name)
+            if (st is not None) and (child.fs_state is None):
+                # e.g. sent by the initiator into the tree, adopt it as is
+                child.fs_state = (st.st_ino, st.st_size, st.st_mtime)
+                self.changed.append(child)
+            if st is None:
+                self.remove(child)
+            elif self.is_replaced(child, st):
+                self.remove(child)
+                self.add(obj, child.real_path)
+            else:
+                if stat.S_ISREG(st.st_mode) and (child.fs_state != (st.st_ino, st.st_size, st.st_mtime)):
+                    self.update(child, st)
+                if recursive and stat.S_ISDIR(st.st_mode):
+                    self.sync_dir(child, recursive)
+                    if child.fs_state != (st.st_ino, st.st_size, st.st_mtime):
+                        child.fs_state = (st.st_ino, st.st_size, st.st_mtime)
+                        self.changed.append(child)
+        for name in sorted(entries):
+            if name not in children:
+                self.add(obj, os.path.join(obj.real_path, name))
+
+    def is_replaced(self, obj, st):
+        # an unknown inode (e.g. a stale catalog row) is revalidated, not replaced
+        return (
+            (obj.fs_state[0] not in (None, st.st_ino)) or
+            (stat.S_ISDIR(st.st_mode) != (obj.get_format() == Formats.Association))
+        )
+
+    def update(self, obj, st):
+        obj.set_data(MtpFileData(obj.real_path, st.st_size))
+        obj.info.set_field('mtime', int(st.st_mtime))
+        obj.fs_state = (st.st_ino, st.st_size, st.st_mtime)
+        self.changed.append(obj)
+        self.counts['updated'] += 1
+
+    def add(self, parent, path):
+        try:
+            obj = self.importer.import_tree(path)
+        except Exception:
+            # vanished since the directory was listed
+            return
+        parent.add_object(obj)
+        self.add_dirs(obj, watch=False)
+        added = [obj] + obj.get_objects()
+        self.changed.extend(added)
+        self.counts['added'] += len(added)
+
+    def remove(self, obj):
+        removed = [obj] + obj.get_objects()
+        for removed_obj in removed:
+            self.dirs.pop(removed_obj.real_path, None)
+        obj.delete_self(0xffffffff)
+        self.removed.extend(removed)
+        self.counts['removed'] += len(removed)
+
+    def add_dirs(self, obj, watch=True):
+        '''
+        :type obj: MtpObject
+        :param obj: object of a directory, whose subdirectories are added too
+        :param watch: add watches for the directories (default: True, False if the importer added them)
+        '''
+        for added in [obj] + obj.get_objects():
+            if added.real_path and (added.get_format() == Formats.Association):
+                self.dirs[added.real_path] = added
+                if watch and self.watcher:
+                    self.watcher.add_watch(added.real_path)
+
+
+class MtpInotifyWatcher(object):
+    '''
+    Watches directories with Linux inotify (through ctypes), to tell which directories changed.
+    Each directory needs its own watch, see /proc/sys/fs/inotify/max_user_watches.
+    '''
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = 0x00000800
+    IN_CLOEXEC = 0x00080000
+
+    mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    event_header = struct.Struct('iIII')
+
+    def __init__(self):
+        '''
+        :raises: OSError if inotify is not available
+        '''
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = self.libc.inotify_init1(MtpInotifyWatcher.IN_NONBLOCK | MtpInotifyWatcher.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+
+    def add_watch(self, path):
+        '''
+        :param path: path of a directory to watch
+        '''
+        import ctypes
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path) if hasattr(os, 'fsencode') else path, MtpInotifyWatcher.mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for %s' % path)
+        self.watches[wd] = path
+
+    def read_events(self, timeout=0):
+        '''
+        :param timeout: seconds to wait for the first event (default: 0, don't wait)
+        :return: tuple of (set of paths of directories that changed, True if events were lost)
+        '''
+        dirty = set()
+        overflow = False
+        ready = select.select([self.fd], [], [], timeout)[0]
+        while ready:
+            try:
+                buff = os.read(self.fd, 0x10000)
+            except OSError as ex:
+                if ex.errno == errno.EAGAIN:
+                    break
+                raise
+            offset = 0
+            header = MtpInotifyWatcher.event_header
+            while offset < len(buff):
+                wd, mask, cookie, length = header.unpack_from(buff, offset)
+                offset += header.size + length
+                if mask & MtpInotifyWatcher.IN_Q_OVERFLOW:
+                    overflow = True
+                elif mask & MtpInotifyWatcher.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                elif wd in self.watches:
+                    dirty.add(self.watches[wd])
+        return dirty, overflow
+
+    def close(self):
+        os.close(self.fd)
+        self.watches = {}
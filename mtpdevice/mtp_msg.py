@@ -1,9 +1,36 @@
 from __future__ import absolute_import
-from struct import pack, unpack
+from struct import Struct
 from .mtp_exception import MtpProtocolException
 from .mtp_proto import ResponseCodes, ContainerTypes
 
 
+header_struct = Struct('<IHHI')
+
+# structs of a parameters message, by number of parameters
+_message_structs = {}
+_params_structs = {}
+
+
+def message_struct(num_params):
+    '''
+    :return: struct of a message with a header and num_params 32 bit parameters
+    '''
+    res = _message_structs.get(num_params)
+    if res is None:
+        res = _message_structs[num_params] = Struct('<IHHI' + 'I' * num_params)
+    return res
+
+
+def params_struct(num_params):
+    '''
+    :return: struct of num_params 32 bit parameters
+    '''
+    res = _params_structs.get(num_params)
+    if res is None:
+        res = _params_structs[num_params] = Struct('<' + 'I' * num_params)
+    return res
+
+
 class MtpMessage(object):
 
     def __init__(self, length, ctype, code, tid, data):
@@ -12,15 +39,63 @@ class MtpMessage(object):
         self.code = code
         self.tid = tid
         self.data = data
+        self.chunks = None
+        self.sink = None
+        self.received = len(data)
+
+    def set_sink(self, sink):
+        '''
+        Write the data of the message to a sink as it arrives, instead of keeping it in memory.
+        Once all the data has arrived, self.data is what sink.close() returns.
+
+        :type sink: MtpFileSink
+        :param sink: the sink to write the data to
+        '''
+        self.sink = sink
+        sink.write(self.data)
+        self.data = b''
+        if self.has_got_all_data():
+            self.data = sink.close()
+
+    def add_data(self, payload):
+        '''
+        Add data that arrived in a later transfer.
+        The chunks are only joined once all the data has arrived,
+        so reassembling a long message takes linear time.
+
+        :param payload: the data to add
+        '''
+        self.received += len(payload)
+        complete = self.has_got_all_data()
+        if self.sink is not None:
+            self.sink.write(payload)
+            if complete:
+                self.data = self.sink.close()
+            return
+        if self.chunks is None:
+            self.chunks = [self.data]
+        self.chunks.append(payload)
+        if complete:
+            self.data = b''.join(self.chunks)
+            self.chunks = None
+
+    def discard(self):
+        '''
+        Drop the data of the message, removing anything that was written to its sink
+        '''
+        if self.sink is not None:
+            self.sink.abort()
+        self.data = b''
+        self.chunks = None
 
     def has_got_all_data(self):
-        if self.length < len(self.data) + 0xc:
-            raise MtpProtocolException('length(%#x) < actual data length(%#x) + 0xc' % (self.length, len(self.data) + 0xc))
-        return self.length == len(self.data) + 0xc
+        if self.length < self.received + 0xc:
+            raise MtpProtocolException('length(%#x) < actual data length(%#x) + 0xc' % (self.length, self.received + 0xc))
+        return self.length == self.received + 0xc
 
     def pack(self):
         self.length = len(self.data) + 0xc
-        return pack('<IHHI', self.length, self.ctype, self.code, self.tid) + self.data
+        return header_struct.pack(self.length, self.ctype, self.code, self.tid) + self.data
 
 
 class MtpParametersMessage(MtpMessage):
@@ -29,9 +104,23 @@ class MtpParametersMessage(MtpMessage):
         super(MtpParametersMessage, self).__init__(length, ctype, code, tid, data)
         if len(data) % 4 != 0:
             raise MtpProtocolException(ResponseCodes.INVALID_CODE_FORMAT, 'Command message length (%#x) is not a multiple of four' % (len(data)))
-        self.params = []
-        for i in range(0, len(data), 4):
-            self.params.append(unpack('<I', data[i:i + 4])[0])
+        self.params = list(params_struct(len(data) // 4).unpack_from(data))
+
+    def reuse(self, code, tid):
+        '''
+        Reinitialize the message as an empty message with the same container type
+
+        :param code: the new code
+        :param tid: the new transaction id
+        '''
+        self.length = 0xc
+        self.code = code
+        self.tid = tid
+        self.data = b''
+        self.chunks = None
+        self.sink = None
+        self.received = 0
+        del self.params[:]
 
     def num_params(self):
         return len(self.params)
@@ -45,20 +134,64 @@ class MtpParametersMessage(MtpMessage):
         self.params.append(param)
 
     def pack(self):
-        self.data = b''
-        for param in self.params:
-            self.data += pack('<I', param)
-        return super(MtpParametersMessage, self).pack()
+        packer = message_struct(len(self.params))
+        self.length = packer.size
+        packed = packer.pack(self.length, self.ctype, self.code, self.tid, *self.params)
+        self.data = packed[0xc:]
+        return packed
 
 
 def response_from_command(cmd, code):
     return MtpParametersMessage(0xc, ContainerTypes.Response, code, cmd.tid, b'')
 
 
+def event_from_params(code, tid, params=()):
+    '''
+    :param code: event code
+    :param tid: id of the transaction that the event relates to
+    :param params: up to three event parameters (default: no parameters)
+    :return: event message
+    '''
+    event = MtpParametersMessage(0xc, ContainerTypes.Event, code, tid, b'')
+    for param in params:
+        event.add_param(param)
+    return event
+
+
+class MtpResponsePool(object):
+    '''
+    Keeps response messages that were sent, to reuse them for later transactions
+    '''
+
+    def __init__(self, size=4):
+        '''
+        :param size: maximal number of responses to keep (default: 4)
+        '''
+        self.size = size
+        self.free = []
+
+    def get(self, cmd, code):
+        '''
+        :return: a response to the command, like response_from_command
+        '''
+        if self.free:
+            response = self.free.pop()
+            response.reuse(code, cmd.tid)
+            return response
+        return response_from_command(cmd, code)
+
+    def put(self, response):
+        '''
+        :param response: a response that was packed and will not be used anymore
+        '''
+        if len(self.free) < self.size:
+            self.free.append(response)
+
+
 def msg_from_buff(buff, permissive=False):
     if len(buff) < 0xc:
         raise MtpProtocolException(ResponseCodes.INVALID_CODE_FORMAT, 'request too short')
-    length, ctype, code, tid = unpack('<IHHI', buff[:0xc])
+    length, ctype, code, tid = header_struct.unpack_from(buff, 0)
     if not permissive:
         if len(buff) != length:
             raise MtpProtocolException(ResponseCodes.INVALID_CODE_FORMAT, 'request length (%#x) != actual length (%#x)' % (length, len(buff)))
@@ -4,8 +4,15 @@ Object Properties and Object References
 '''
 from __future__ import absolute_import
 import os
+import stat
+import struct
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 from .mtp_data_types import UInt32, UInt16, UInt64, UInt128, MStr, MDateTime
 from .mtp_base import MtpBaseObject
+from .mtp_object_data import MtpFileData
 from .mtp_proto import ResponseCodes
 from .mtp_exception import MtpProtocolException
 from .mtp_property import MtpObjectProperty as ObjProp
@@ -30,25 +37,36 @@ class MtpObject(MtpBaseObject):
         PropDescs.Name.get_code(): PropDescs.Name,
     }
 
-    def __init__(self, data, info):
-        super(MtpObject, self).__init__()
+    def __init__(self, data, info, uid=None):
+        '''
+        :param data: the object's binary data
+        :type info: MtpObjectInfo
+        :param info: the object's info
+        :param uid: handle to restore (default: None, get a new handle)
+        '''
+        super(MtpObject, self).__init__(uid)
         self.info = info
         self.set_data(data)
         self.real_path = None
+        # (inode, size, mtime) of real_path when the object was created or synced
+        self.fs_state = None
         self.objects = []
         self.storage = None
         self.parent = None
-        self.info.unique_id.value.set_value(self.get_uid())
+        self.info.set_field('unique_id', self.get_uid())
+        self.info.set_object(self)
 
     def copy(self):
         '''
         .. todo:: copy properties ...
         '''
-        new_data = None if self.data is None else self.data[:]
+        # data sources are never modified in place, so they can be shared
+        new_data = self.data
         new_info = self.info.copy()
         new_obj = MtpObject(new_data, new_info)
         for obj in self.objects:
             new_obj.add_object(obj.copy())
+        return new_obj
 
     def get_info(self):
         return self.info.pack()
@@ -58,6 +76,48 @@ class MtpObject(MtpBaseObject):
             return self.info.props[prop_code]
         raise MtpProtocolException(ResponseCodes.OBJECT_PROP_NOT_SUPPORTED)
 
+    def get_property_value(self, prop_code):
+        '''
+        :param prop_code: code of the property
+        :return: the packed value of the property, the property is not created if it was not accessed yet
+        '''
+        if prop_code in self.info.props:
+            return self.info.pack_field(MtpObjectInfo.prop_names[prop_code])
+        raise MtpProtocolException(ResponseCodes.OBJECT_PROP_NOT_SUPPORTED)
+
+    def get_property_size(self, prop_code):
+        '''
+        :param prop_code: code of the property
+        :return: size of the packed value of the property, without packing it
+        '''
+        if prop_code in self.info.props:
+            return self.info.field_size(MtpObjectInfo.prop_names[prop_code])
+        raise MtpProtocolException(ResponseCodes.OBJECT_PROP_NOT_SUPPORTED)
+
+    def pack_property_into(self, prop_code, buff, offset):
+        '''
+        :param prop_code: code of the property
+        :param buff: writable buffer to pack the value of the property into
+        :param offset: offset in the buffer
+        :return: offset after the value
+        '''
+        if prop_code in self.info.props:
+            return self.info.pack_field_into(MtpObjectInfo.prop_names[prop_code], buff, offset)
+        raise MtpProtocolException(ResponseCodes.OBJECT_PROP_NOT_SUPPORTED)
+
+    def property_changed(self, prop_code, old_value):
+        '''
+        Called by the object's info after the value of a property was set
+
+        :param prop_code: code of the property that was changed
+        :param old_value: the value of the property before the change
+        '''
+        if self.storage:
+            self.storage.property_changed(self, prop_code, old_value)
+
+    def get_format(self):
+        return self.info.get_field('object_format')
+
     def get_objects(self):
         objs = []
         for obj in self.objects:
@@ -73,13 +133,16 @@ class MtpObject(MtpBaseObject):
     def set_parent(self, parent):
         if parent in self.objects:
             raise Exception('Parent %s is also in %s objects' % (parent, self))
-        self.info.parent_object.value.set_value(0 if not parent else parent.get_uid())
+        self.info.set_field('parent_object', 0 if not parent else parent.get_uid())
         self.parent = parent
 
     def set_storage(self, storage):
+        if self.storage and (self.storage != storage):
+            self.storage.unregister_object(self)
         self.storage = storage
         if self.storage:
-            self.info.storage.value.set_value(storage.get_uid())
+            self.info.set_field('storage', storage.get_uid())
+            self.storage.register_object(self)
         # TODO: recursion loop??
         for obj in self.objects:
             obj.set_storage(storage)
@@ -97,11 +160,64 @@ class MtpObject(MtpBaseObject):
 
     def set_data(self, data, adhere_size=False):
         if adhere_size:
-            if len(data) > self.info.compressed_size.value.value:
+            if len(data) > self.info.get_field('compressed_size'):
                 raise MtpProtocolException(ResponseCodes.STORE_FULL)
         if self.info and (data is not None):
-            self.info.compressed_size.value.set_value(len(data))
+            self.info.set_field('compressed_size', len(data))
+        old_data = getattr(self, 'data', None)
+        if isinstance(data, MtpFileData) and (data is not old_data):
+            data.acquire()
         self.data = data
+        if isinstance(old_data, MtpFileData) and (old_data is not data):
+            old_data.release()
+
+    def get_data(self, offset=0, size=None):
+        '''
+        :param offset: offset in the object's data (default: 0)
+        :param size: maximum number of bytes to return (default: None, up to the end)
+        :return: the object's binary data (or part of it)
+        '''
+        if self.data is None:
+            return b''
+        if size is None:
+            return self.data[offset:]
+        return self.data[offset:offset + size]
+
+    def get_data_view(self, offset=0, size=None):
+        '''
+        Same as get_data, but avoids copying the data
+
+        :param offset: offset in the object's data (default: 0)
+        :param size: maximum number of bytes to return (default: None, up to the end)
+        :return: memoryview of the object's data (or part of it)
+        '''
+        if self.data is None:
+            return memoryview(b'')
+        if isinstance(self.data, MtpFileData):
+            return self.data.view(offset, size)
+        view = memoryview(self.data)
+        if size is None:
+            return view[offset:]
+        return view[offset:offset + size]
+
+    def get_data_payload(self, offset=0, size=None):
+        '''
+        Payload of an MtpDataPhase with the object's data (or part of it), that does not hold the data in memory:
+        a view of a mapped file, or, if the file can't be mapped, a producer that reads it in chunks
+
+        :param offset: offset in the object's data (default: 0)
+        :param size: maximum number of bytes (default: None, up to the end)
+        :return: tuple of (payload, length of the payload)
+        '''
+        data = self.data
+        if isinstance(data, MtpFileData):
+            view = data.map(offset, size)
+            if view is not None:
+                return view, len(view)
+            length = data.clamp(offset, size)
+            return (lambda chunk_size: data.chunks(offset, length, chunk_size)), length
+        view = self.get_data_view(offset, size)
+        return view, len(view)
 
     def get_thumb(self, obj):
         raise MtpProtocolException(ResponseCodes.NO_THUMBNAIL_PRESENT)
@@ -109,15 +225,15 @@ class MtpObject(MtpBaseObject):
     def format_matches(self, fmt):
         return (
             (not fmt) or
-            (fmt == self.info.object_format.value.value) or
+            (fmt == self.get_format()) or
             (fmt == 0xffffffff) or
-            (self.info.object_format.value.value) == 0x00000000
+            (self.get_format() == 0x00000000)
         )
 
     def set_protection_status(self, status):
         if (status > 0xffff) or (status < 0):
             raise MtpProtocolException(ResponseCodes.INVALID_PARAMETER)
-        self.info.protection.set_value(status)
+        self.info.set_field('protection', status)
 
     def delete_self(self, fmt):
         '''
@@ -129,6 +245,10 @@ class MtpObject(MtpBaseObject):
             self.parent.objects.remove(self)
         elif self.storage:
             self.storage.objects.remove(self)
+        if self.storage:
+            self.storage.unregister_object(self)
+            for obj in self.get_objects():
+                self.storage.unregister_object(obj)
 
     def delete_internal(self, fmt):
         objects = self.objects[:]
@@ -146,6 +266,9 @@ class MtpObject(MtpBaseObject):
             else:
                 raise MtpProtocolException(ResponseCodes.PARTIAL_DELETION)
         self.delete_self(fmt)
+        # unlike delete_self (which also detaches moved objects), this is a real deletion
+        if isinstance(self.data, MtpFileData):
+            self.data.release()
 
     def delete(self, fmt):
         if not self.storage.can_delete():
@@ -169,14 +292,19 @@ class MtpObject(MtpBaseObject):
         return list(MtpObject.props_descs.keys())
 
     @classmethod
-    def from_fs_recursive(cls, path):
-        # create object for current path
-        obj = MtpObject.from_file(path)
-        if os.path.isdir(path):
-            for filename in os.listdir(path):
-                new_path = os.path.join(path, filename)
-                new_obj = MtpObject.from_fs_recursive(new_path)
-                obj.add_object(new_obj)
+    def from_fs_recursive(cls, path, workers=None, timings=None):
+        '''
+        :param path: path of a file or a directory
+        :param workers: number of threads to list directories with (default: None, list them serially)
+        :param timings: dict to fill with the duration of each phase of the import,
+            see MtpFsImporter (default: None)
+        :return: MtpObject of the path, with objects for everything below it
+        '''
+        from .mtp_fs import MtpFsImporter
+        importer = MtpFsImporter(workers)
+        obj = importer.import_tree(path)
+        if timings is not None:
+            timings.update(importer.timings)
         return obj
 
     @classmethod
@@ -184,15 +312,22 @@ class MtpObject(MtpBaseObject):
         # TODO: handle cases othe than regular file here ...
         if not os.path.exists(path):
             raise Exception('there is no file/dir at %s' % os.path.abspath(path))
-        if os.path.isfile(path):
-            with open(path, 'rb') as f:
-                data = f.read()
+        return MtpObject.from_stat(path, os.stat(path))
+
+    @classmethod
+    def from_stat(cls, path, st):
+        '''
+        :param path: path of a file or a directory
+        :param st: stat result of the path
+        :return: MtpObject of the path (without objects for its children)
+        '''
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if stat.S_ISREG(st.st_mode):
+            data = MtpFileData(path, st.st_size)
         else:
             data = b''
         filename = os.path.split(path)[-1]
-        mtime = int(os.path.getmtime(path))
-        ctime = int(os.path.getctime(path))
-        object_format = Formats.guess(path)
+        object_format = Formats.guess_name(filename, is_dir)
         assoc_type = 1 if object_format == Formats.Association else 0
         info = MtpObjectInfo(
             storage=0,
@@ -211,8 +346,8 @@ class MtpObject(MtpBaseObject):
             assoc_desc=0,
             seq_num=0,
             filename=filename,
-            ctime=ctime,
-            mtime=mtime,
+            ctime=int(st.st_ctime),
+            mtime=int(st.st_mtime),
             keywords=''
         )
         obj = MtpObject(
@@ -220,11 +355,34 @@ class MtpObject(MtpBaseObject):
             info=info,
         )
         obj.real_path = path
+        obj.fs_state = (st.st_ino, st.st_size, st.st_mtime)
         return obj
 
 
 class MtpObjectInfo(object):
 
+    # the fixed size fields of the dataset, from StorageID to SequenceNumber
+    fixed_fields = struct.Struct('<IHHIHIIIIIIIHII')
+
+    # fields that are also object properties: (attribute, property description, data type)
+    prop_fields = [
+        ('storage', PropDescs.StorageID, UInt32),
+        ('object_format', PropDescs.ObjectFormat, UInt16),
+        ('protection', PropDescs.ProtectionStatus, UInt16),
+        ('compressed_size', PropDescs.ObjectSize, UInt64),
+        ('parent_object', PropDescs.ParentObject, UInt32),
+        ('assoc_type', PropDescs.AssociationType, UInt16),
+        ('assoc_desc', PropDescs.AssociationDesc, UInt32),
+        ('filename', PropDescs.ObjectFileName, MStr),
+        ('ctime', PropDescs.DateCreated, MDateTime),
+        ('mtime', PropDescs.DateModified, MDateTime),
+        ('keywords', PropDescs.Keywords, MStr),
+        ('name', PropDescs.Name, MStr),
+        ('unique_id', PropDescs.PersistantUniqueObjectIdentifier, UInt128),
+    ]
+    prop_types = dict((name, (desc, dtype)) for (name, desc, dtype) in prop_fields)
+    prop_names = dict((desc.get_code(), name) for (name, desc, dtype) in prop_fields)
+
     def __init__(
         self,
         storage, object_format, protection, compressed_size,
@@ -233,16 +391,24 @@ class MtpObjectInfo(object):
         parent_object, assoc_type, assoc_desc, seq_num,
         filename, ctime, mtime, keywords
     ):
-        self.props = {}
-        self.storage = ObjProp(PropDescs.StorageID, UInt32(storage))
-        self.props[self.storage.get_code()] = self.storage
-        self.object_format = ObjProp(PropDescs.ObjectFormat, UInt16(object_format))
-        self.props[self.object_format.get_code()] = self.object_format
-        self.protection = ObjProp(PropDescs.ProtectionStatus, UInt16(protection))
-        self.props[self.protection.get_code()] = self.protection
-        # need to cut out lower 32 bits, as in info it is only 32bit.
-        self.compressed_size = ObjProp(PropDescs.ObjectSize, UInt64(compressed_size))
-        self.props[self.compressed_size.get_code()] = self.compressed_size
+        # values of the properties that were not accessed yet,
+        # an MtpObjectProperty is created when a property is first accessed
+        self.raw = {
+            'storage': storage,
+            'object_format': object_format,
+            'protection': protection,
+            'compressed_size': compressed_size,
+            'parent_object': parent_object,
+            'assoc_type': assoc_type,
+            'assoc_desc': assoc_desc,
+            'filename': filename,
+            'ctime': ctime,
+            'mtime': mtime,
+            'keywords': keywords,
+            # The following should not be packed ....
+            'name': filename,
+            'unique_id': 0,
+        }
         self.thumb_format = UInt16(thumb_format)
         self.thumb_compressed_size = UInt32(thumb_compressed_size)
         self.thumb_pix_width = UInt32(thumb_pix_width)
@@ -250,129 +416,199 @@ class MtpObjectInfo(object):
         self.image_pix_width = UInt32(image_pix_width)
         self.image_pix_height = UInt32(image_pix_height)
         self.image_bit_depth = UInt32(image_bit_depth)
-        self.parent_object = ObjProp(PropDescs.ParentObject, UInt32(parent_object))
-        self.props[self.parent_object.get_code()] = self.parent_object
-        self.assoc_type = ObjProp(PropDescs.AssociationType, UInt16(assoc_type))
-        self.props[self.assoc_type.get_code()] = self.assoc_type
-        self.assoc_desc = ObjProp(PropDescs.AssociationDesc, UInt32(assoc_desc))
-        self.props[self.assoc_desc.get_code()] = self.assoc_desc
         self.seq_num = UInt32(seq_num)
-        self.filename = ObjProp(PropDescs.ObjectFileName, MStr(filename))
-        self.props[self.filename.get_code()] = self.filename
-        self.ctime = ObjProp(PropDescs.DateCreated, MDateTime(ctime))
-        self.props[self.ctime.get_code()] = self.ctime
-        self.mtime = ObjProp(PropDescs.DateModified, MDateTime(mtime))
-        self.props[self.mtime.get_code()] = self.mtime
-        self.keywords = ObjProp(PropDescs.Keywords, MStr(keywords))
-        self.props[self.keywords.get_code()] = self.keywords
-
-        # The following should not be packed ....
-        self.name = ObjProp(PropDescs.Name, MStr(filename))
-        self.props[self.name.get_code()] = self.name
-        self.unique_id = ObjProp(PropDescs.PersistantUniqueObjectIdentifier, UInt128(0))
-        self.props[self.unique_id.get_code()] = self.unique_id
+        self.obj = None
+        # the packed dataset, dropped whenever one of the fields changes
+        self.packed = None
+
+    def __getattr__(self, name):
+        # only called for attributes that were not set, i.e. properties that were not accessed yet
+        raw = self.__dict__.get('raw')
+        if (raw is None) or (name not in raw):
+            raise AttributeError(name)
+        desc, dtype = MtpObjectInfo.prop_types[name]
+        prop = ObjProp(desc, dtype(raw.pop(name)))
+        prop.set_owner(self)
+        setattr(self, name, prop)
+        return prop
+
+    @property
+    def props(self):
+        '''
+        :return: mapping of property code to MtpObjectProperty
+        '''
+        return MtpObjectInfoProps(self)
+
+    def get_field(self, name):
+        '''
+        :param name: attribute name of a property
+        :return: value of the property, without creating it
+        '''
+        prop = self.__dict__.get(name)
+        if prop is None:
+            return self.raw[name]
+        return prop.value.value
+
+    def pack_field(self, name):
+        '''
+        :param name: attribute name of a property
+        :return: packed value of the property, without creating it
+        '''
+        prop = self.__dict__.get(name)
+        if prop is None:
+            return MtpObjectInfo.prop_types[name][1](self.raw[name]).pack()
+        return prop.pack()
+
+    def field_size(self, name):
+        '''
+        :param name: attribute name of a property
+        :return: size of the packed value of the property, without packing or creating it
+        '''
+        prop = self.__dict__.get(name)
+        if prop is None:
+            return MtpObjectInfo.prop_types[name][1](self.raw[name]).packed_size()
+        return prop.value.packed_size()
+
+    def pack_field_into(self, name, buff, offset):
+        '''
+        :param name: attribute name of a property
+        :param buff: writable buffer to pack the value into
+        :param offset: offset in the buffer
+        :return: offset after the value
+        '''
+        prop = self.__dict__.get(name)
+        if prop is None:
+            return MtpObjectInfo.prop_types[name][1](self.raw[name]).pack_into(buff, offset)
+        return prop.value.pack_into(buff, offset)
+
+    def set_object(self, obj):
+        '''
+        :param obj: the object to notify (obj.property_changed) when a property is set
+        '''
+        self.obj = obj
+
+    def property_changed(self, prop, old_value):
+        self.field_changed(prop.get_code(), old_value)
+
+    def field_changed(self, prop_code, old_value):
+        self.packed = None
+        if self.obj:
+            self.obj.property_changed(prop_code, old_value)
+
+    def set_field(self, name, value):
+        '''
+        Set the value of a property internally, without permission checks
+
+        :param name: attribute name of the property
+        :param value: the new value
+        '''
+        old_value = self.get_field(name)
+        prop = self.__dict__.get(name)
+        if prop is None:
+            self.raw[name] = value
+        else:
+            prop.value.set_value(value)
+        desc = MtpObjectInfo.prop_types[name][0]
+        self.field_changed(desc.get_code(), old_value)
 
     def copy(self):
+        field = self.get_field
         return MtpObjectInfo(
-            self.storage.value.value,
-            self.object_format.value.value,
-            self.protection.value.value,
-            self.compressed_size.value.value,
-            self.thumb_format.value.value,
-            self.thumb_compressed_size.value.value,
-            self.thumb_pix_width.value.value,
-            self.thumb_pix_height.value.value,
-            self.image_pix_width.value.value,
-            self.image_pix_height.value.value,
-            self.image_bit_depth.value.value,
-            self.parent_object.value.value,
-            self.assoc_type.value.value,
-            self.assoc_desc.value.value,
-            self.seq_num.value.value,
-            self.filename.value.value,
-            self.ctime.value.value,
-            self.mtime.value.value,
-            self.keywords.value.value,
+            field('storage'),
+            field('object_format'),
+            field('protection'),
+            field('compressed_size'),
+            self.thumb_format.value,
+            self.thumb_compressed_size.value,
+            self.thumb_pix_width.value,
+            self.thumb_pix_height.value,
+            self.image_pix_width.value,
+            self.image_pix_height.value,
+            self.image_bit_depth.value,
+            field('parent_object'),
+            field('assoc_type'),
+            field('assoc_desc'),
+            self.seq_num.value,
+            field('filename'),
+            field('ctime'),
+            field('mtime'),
+            field('keywords'),
         )
 
     def pack(self):
-        res = b''
-        res += self.storage.pack()
-        res += self.object_format.pack()
-        res += self.protection.pack()
-        res += self.compressed_size.pack()
-        res += self.thumb_format.pack()
-        res += self.thumb_compressed_size.pack()[:4]
-        res += self.thumb_pix_width.pack()
-        res += self.thumb_pix_height.pack()
-        res += self.image_pix_width.pack()
-        res += self.image_pix_height.pack()
-        res += self.image_bit_depth.pack()
-        res += self.parent_object.pack()
-        res += self.assoc_type.pack()
-        # TODO (AssociationDesc)
-        res += self.assoc_desc.pack()
-        res += self.seq_num.pack()
-        res += self.filename.pack()
-        res += self.ctime.pack()
-        res += self.mtime.pack()
-        res += self.keywords.pack()
-        return res
+        if self.packed is None:
+            self.packed = self._pack()
+        return self.packed
+
+    def _pack(self):
+        field = self.get_field
+        return b''.join([
+            MtpObjectInfo.fixed_fields.pack(
+                field('storage'),
+                field('object_format'),
+                field('protection'),
+                # ObjectCompressedSize is only 32bit in the dataset
+                min(field('compressed_size'), 0xffffffff),
+                self.thumb_format.value,
+                self.thumb_compressed_size.value,
+                self.thumb_pix_width.value,
+                self.thumb_pix_height.value,
+                self.image_pix_width.value,
+                self.image_pix_height.value,
+                self.image_bit_depth.value,
+                field('parent_object'),
+                field('assoc_type'),
+                # TODO (AssociationDesc)
+                field('assoc_desc'),
+                self.seq_num.value,
+            ),
+            MStr(field('filename')).pack(),
+            MDateTime(field('ctime')).pack(),
+            MDateTime(field('mtime')).pack(),
+            MStr(field('keywords')).pack(),
+        ])
 
     @classmethod
     def from_buff(cls, buff):
         try:
-            ui32 = UInt32()
-            ui16 = UInt16()
+            values = list(MtpObjectInfo.fixed_fields.unpack_from(buff, 0))
+            offset = MtpObjectInfo.fixed_fields.size
             mstr = MStr()
             mdt = MDateTime()
-            rest = buff
-            (storage, rest) = ui32.unpack(rest)
-            (object_format, rest) = ui16.unpack(rest)
-            (protection, rest) = ui16.unpack(rest)
-            (compressed_size, rest) = ui32.unpack(rest)
-            (thumb_format, rest) = ui16.unpack(rest)
-            (thumb_compressed_size, rest) = ui32.unpack(rest)
-            (thumb_pix_width, rest) = ui32.unpack(rest)
-            (thumb_pix_height, rest) = ui32.unpack(rest)
-            (image_pix_width, rest) = ui32.unpack(rest)
-            (image_pix_height, rest) = ui32.unpack(rest)
-            (image_bit_depth, rest) = ui32.unpack(rest)
-            (parent_object, rest) = ui32.unpack(rest)
-            (assoc_type, rest) = ui16.unpack(rest)
-            (assoc_desc, rest) = ui32.unpack(rest)
-            (seq_num, rest) = ui32.unpack(rest)
-            (filename, rest) = mstr.unpack(rest)
-            (ctime, rest) = mdt.unpack(rest)
-            (mtime, rest) = mdt.unpack(rest)
-            (keywords, rest) = mstr.unpack(rest)
-            return MtpObjectInfo(
-                storage,
-                object_format,
-                protection,
-                compressed_size,
-                thumb_format,
-                thumb_compressed_size,
-                thumb_pix_width,
-                thumb_pix_height,
-                image_pix_width,
-                image_pix_height,
-                image_bit_depth,
-                parent_object,
-                assoc_type,
-                assoc_desc,
-                seq_num,
-                filename,
-                ctime,
-                mtime,
-                keywords,
-            )
+            (filename, offset) = mstr.unpack_from(buff, offset)
+            (ctime, offset) = mdt.unpack_from(buff, offset)
+            (mtime, offset) = mdt.unpack_from(buff, offset)
+            (keywords, offset) = mstr.unpack_from(buff, offset)
+            values.extend([filename, ctime, mtime, keywords])
+            return MtpObjectInfo(*values)
         except:
             import traceback
             traceback.print_exc()
             raise MtpProtocolException(ResponseCodes.INVALID_DATASET)
 
 
+class MtpObjectInfoProps(Mapping):
+    '''
+    Mapping of property code to the MtpObjectProperty of an MtpObjectInfo,
+    properties are created as they are accessed
+    '''
+
+    def __init__(self, info):
+        self.info = info
+
+    def __getitem__(self, prop_code):
+        return getattr(self.info, MtpObjectInfo.prop_names[prop_code])
+
+    def __contains__(self, prop_code):
+        return prop_code in MtpObjectInfo.prop_names
+
+    def __iter__(self):
+        return iter(MtpObjectInfo.prop_names)
+
+    def __len__(self):
+        return len(MtpObjectInfo.prop_names)
+
+
 class Formats(object):
     # ancillary formats
     Undefined = 0x3000
@@ -464,24 +700,32 @@ class Formats(object):
     MediaCast = 0xbe81
     Section = 0xbe82
 
+    ext_format = {
+        'mp3': MP3,
+        'avi': AVI,
+        'jpg': EXIF_JPEG,
+        'jpeg': EXIF_JPEG,
+        'png': PNG,
+        'bmp': BMP,
+        'wav': WAV,
+        'm3u': M3UPlaylist,
+        'html': HTML,
+        'mht': MHTCompiledHTMLDocument,
+        'wma': WMA,
+    }
+
     @classmethod
     def guess(cls, path):
-        ext_format = {
-            'mp3': Formats.MP3,
-            'avi': Formats.AVI,
-            'jpg': Formats.EXIF_JPEG,
-            'jpeg': Formats.EXIF_JPEG,
-            'png': Formats.PNG,
-            'bmp': Formats.BMP,
-            'wav': Formats.WAV,
-            'm3u': Formats.M3UPlaylist,
-            'html': Formats.HTML,
-            'mht': Formats.MHTCompiledHTMLDocument,
-            'wma': Formats.WMA,
-        }
-        if os.path.isdir(path):
+        return Formats.guess_name(path, os.path.isdir(path))
+
+    @classmethod
+    def guess_name(cls, name, is_dir=False):
+        '''
+        :param name: name (or path) of a file
+        :param is_dir: is it a directory (default: False)
+        :return: format code of the file, by its extension
+        '''
+        if is_dir:
             return Formats.Association
-        ext = path.split('.')[-1].lower()
-        if ext in ext_format:
-            return ext_format[ext]
-        return Formats.Undefined
+        ext = name.split('.')[-1].lower()
+        return Formats.ext_format.get(ext, Formats.Undefined)
@@ -0,0 +1,183 @@
+'''
+Sources for the binary data of objects
+'''
+import os
+import mmap
+
+
+class MtpFileData(object):
+    '''
+    Binary data of an object that is kept in a file.
+    Only the path and the size are stored,
+    the content is read from the file when it is needed.
+
+    An owned file (e.g. spooled by MtpFileSink) is removed when the last object
+    that uses it is deleted, other files are never removed.
+    '''
+
+    def __init__(self, path, size=None, owned=False):
+        '''
+        :param path: path of the file
+        :param size: size of the file (default: None, get it from the file system)
+        :param owned: remove the file once no object uses it (default: False)
+        '''
+        self.path = path
+        if size is None:
+            size = os.path.getsize(path)
+        self.size = size
+        self.owned = owned
+        self.users = 0
+
+    def acquire(self):
+        '''
+        Called when an object starts using the data
+        '''
+        self.users += 1
+
+    def release(self):
+        '''
+        Called when an object stops using the data, an owned file is removed after its last user
+        '''
+        self.users -= 1
+        if self.owned and (self.users <= 0) and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('%s only supports slicing' % type(self).__name__)
+        start, stop, step = key.indices(self.size)
+        if step != 1:
+            raise ValueError('%s does not support extended slicing' % type(self).__name__)
+        return self.read(start, max(stop - start, 0))
+
+    def read(self, offset=0, size=None):
+        '''
+        :param offset: offset in the file to read from (default: 0)
+        :param size: number of bytes to read (default: None, read to the end)
+        :return: the data that was read
+        '''
+        if size is None:
+            size = self.size - offset
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def clamp(self, offset=0, size=None):
+        '''
+        :param offset: offset in the file (default: 0)
+        :param size: maximum number of bytes (default: None, up to the end)
+        :return: the number of bytes in the requested range
+        '''
+        if size is None:
+            size = self.size - offset
+        return max(min(size, self.size - offset), 0)
+
+    def map(self, offset=0, size=None):
+        '''
+        :param offset: offset in the file (default: 0)
+        :param size: maximum number of bytes (default: None, up to the end)
+        :return: memoryview of the requested range, mapped from the file without copying,
+            or None if the file can't be mapped
+        '''
+        size = self.clamp(offset, size)
+        if not size:
+            return memoryview(b'')
+        # the mapping offset must be aligned to the allocation granularity
+        start = offset - (offset % mmap.ALLOCATIONGRANULARITY)
+        try:
+            with open(self.path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), offset + size - start, offset=start, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # e.g. the file changed since it was added
+            return None
+        try:
+            view = memoryview(mapped)
+        except TypeError:
+            # python 2 can't make a memoryview of a mapping
+            mapped.close()
+            return None
+        # the mapping is released when the last view of it is released
+        return view[offset - start:]
+
+    def view(self, offset=0, size=None):
+        '''
+        :param offset: offset in the file (default: 0)
+        :param size: maximum number of bytes (default: None, up to the end)
+        :return: memoryview of the requested range, mapped from the file without copying
+            if possible, otherwise read into memory
+        '''
+        view = self.map(offset, size)
+        if view is None:
+            view = memoryview(self.read(offset, self.clamp(offset, size)))
+        return view
+
+    def chunks(self, offset=0, size=None, chunk_size=0x10000):
+        '''
+        Read the requested range in chunks, holding a single chunk in memory at a time
+
+        :param offset: offset in the file (default: 0)
+        :param size: maximum number of bytes (default: None, up to the end)
+        :param chunk_size: maximal size of a chunk (default: 0x10000)
+        :return: iterator over the chunks, that stops early if the file got shorter
+        '''
+        size = self.clamp(offset, size)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while size:
+                chunk = f.read(min(size, chunk_size))
+                if not chunk:
+                    break
+                size -= len(chunk)
+                yield chunk
+
+
+class MtpFileSink(object):
+    '''
+    Writes the binary data of an object to a file as it arrives.
+
+    Once more than limit bytes arrived, the file is removed and the rest of the data
+    is only counted, so the data phase can still be received to its end.
+    '''
+
+    def __init__(self, path, f=None, limit=None):
+        '''
+        :param path: path of the file
+        :param f: the file, already open for writing (default: None, open path)
+        :param limit: maximal number of bytes to write (default: None, no limit)
+        '''
+        self.path = path
+        self.file = f if f else open(path, 'wb')
+        self.limit = limit
+        self.size = 0
+        self.exceeded = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.exceeded:
+            return
+        if (self.limit is not None) and (self.size > self.limit):
+            self.exceeded = True
+            self.abort()
+            return
+        self.file.write(data)
+
+    def close(self):
+        '''
+        :return: MtpFileData of the written file, which owns the file, or None if the limit was exceeded
+        '''
+        if self.exceeded:
+            return None
+        self.file.close()
+        return MtpFileData(self.path, self.size, owned=True)
+
+    def abort(self):
+        '''
+        Remove the file, the data will not be used
+        '''
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
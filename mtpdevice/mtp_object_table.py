@@ -0,0 +1,215 @@
+'''
+Columnar table of the object metadata that is used to list and count objects
+'''
+from __future__ import absolute_import
+from array import array
+
+
+def _array_64():
+    try:
+        return array('Q')
+    except ValueError:
+        # no 'Q' in python 2, 'L' is 64 bit on LP64 platforms
+        return array('L')
+
+
+class MtpObjectTable(object):
+    '''
+    Index of the objects of a storage, for listing and counting them by format.
+    It keeps the fields of the objects in arrays, one per field,
+    and the strings (filenames and keywords) as indices into a table of
+    interned, reference counted strings.
+    The objects themselves are still kept by the storage, so this is an index
+    in addition to the objects, not a replacement of them.
+
+    Rows of removed objects, and ids of strings that are no longer used,
+    are reused by objects that are added later.
+    '''
+
+    def __init__(self):
+        self.handle = array('I')
+        self.storage = array('I')
+        self.object_format = array('H')
+        self.protection = array('H')
+        self.compressed_size = _array_64()
+        self.parent_object = array('I')
+        self.assoc_type = array('H')
+        self.filename = array('I')
+        self.keywords = array('I')
+        self.strings = ['']
+        self.string_ids = {'': 0}
+        self.string_refs = [0]
+        self.free_strings = []
+        self.rows = {}
+        self.free_rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, handle):
+        return handle in self.rows
+
+    def intern(self, s):
+        '''
+        Add a reference to a string, release it once it is no longer used
+
+        :param s: a string
+        :return: index of the string in the string table
+        '''
+        sid = self.string_ids.get(s)
+        if sid is None:
+            if self.free_strings:
+                sid = self.free_strings.pop()
+                self.strings[sid] = s
+            else:
+                sid = len(self.strings)
+                self.strings.append(s)
+                self.string_refs.append(0)
+            self.string_ids[s] = sid
+        self.string_refs[sid] += 1
+        return sid
+
+    def release(self, sid):
+        '''
+        Drop a reference to a string, and the string itself with the last reference
+
+        :param sid: index of the string in the string table
+        '''
+        self.string_refs[sid] -= 1
+        if (self.string_refs[sid] == 0) and sid:
+            del self.string_ids[self.strings[sid]]
+            self.strings[sid] = None
+            self.free_strings.append(sid)
+
+    def set_row(self, obj):
+        '''
+        Add the row of an object, or update it if the object already has one
+
+        :type obj: MtpObject
+        :param obj: the object
+        '''
+        handle = obj.get_uid()
+        field = obj.info.get_field
+        values = (
+            handle,
+            field('storage'),
+            field('object_format'),
+            field('protection'),
+            field('compressed_size'),
+            field('parent_object'),
+            field('assoc_type'),
+            self.intern(field('filename')),
+            self.intern(field('keywords')),
+        )
+        columns = self.get_columns()
+        idx = self.rows.get(handle)
+        if idx is None:
+            if self.free_rows:
+                idx = self.free_rows.pop()
+            else:
+                idx = len(self.handle)
+                for column in columns:
+                    column.append(0)
+            self.rows[handle] = idx
+        else:
+            # interned above, so a string that did not change is not freed
+            self.release(self.filename[idx])
+            self.release(self.keywords[idx])
+        for column, value in zip(columns, values):
+            column[idx] = value
+
+    def remove(self, handle):
+        '''
+        :param handle: handle of the object whose row should be removed
+        '''
+        idx = self.rows.pop(handle, None)
+        if idx is not None:
+            self.handle[idx] = 0
+            self.release(self.filename[idx])
+            self.release(self.keywords[idx])
+            self.filename[idx] = 0
+            self.keywords[idx] = 0
+            self.free_rows.append(idx)
+
+    def get_columns(self):
+        return (
+            self.handle, self.storage, self.object_format, self.protection, self.compressed_size,
+            self.parent_object, self.assoc_type, self.filename, self.keywords,
+        )
+
+    def row(self, handle):
+        '''
+        :param handle: handle of an object
+        :return: MtpObjectRow, a view of the object's row, or None if there is no such row
+        '''
+        idx = self.rows.get(handle)
+        if idx is None:
+            return None
+        return MtpObjectRow(self, idx)
+
+    def find(self, obj_fmt_code=None):
+        '''
+        :param obj_fmt_code: only return objects that match this format (default: None)
+        :return: list of handles
+        '''
+        if (not obj_fmt_code) or (obj_fmt_code == 0xffffffff):
+            return [h for h in self.handle if h]
+        return [
+            h for (h, f) in zip(self.handle, self.object_format)
+            if h and ((f == obj_fmt_code) or (f == 0))
+        ]
+
+    def count(self, obj_fmt_code=None):
+        '''
+        :return: number of handles find would return, counted without building the list
+        '''
+        if (not obj_fmt_code) or (obj_fmt_code == 0xffffffff):
+            return len(self.rows)
+        return sum(1 for (h, f) in zip(self.handle, self.object_format) if h and ((f == obj_fmt_code) or (f == 0)))
+
+
+class MtpObjectRow(object):
+    '''
+    Read only view of a row in MtpObjectTable
+    '''
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def get_uid(self):
+        return self.table.handle[self.index]
+
+    @property
+    def storage(self):
+        return self.table.storage[self.index]
+
+    @property
+    def object_format(self):
+        return self.table.object_format[self.index]
+
+    @property
+    def protection(self):
+        return self.table.protection[self.index]
+
+    @property
+    def compressed_size(self):
+        return self.table.compressed_size[self.index]
+
+    @property
+    def parent_object(self):
+        return self.table.parent_object[self.index]
+
+    @property
+    def assoc_type(self):
+        return self.table.assoc_type[self.index]
+
+    @property
+    def filename(self):
+        return self.table.strings[self.table.filename[self.index]]
+
+    @property
+    def keywords(self):
+        return self.table.strings[self.table.keywords[self.index]]
@@ -302,9 +302,18 @@ class MtpObjectPropertyDescriptions(object):
 
 class MtpObjectProperty(object):
 
+    __slots__ = ('desc', 'value', 'owner')
+
     def __init__(self, desc, value):
         self.desc = desc
         self.value = value
+        self.owner = None
+
+    def set_owner(self, owner):
+        '''
+        :param owner: object to notify (owner.property_changed) when the value is set
+        '''
+        self.owner = owner
 
     def can_set(self):
         return self.desc.can_set()
@@ -314,7 +323,10 @@ class MtpObjectProperty(object):
 
     def set_value(self, new_value):
         if self.can_set():
+            old_value = self.value.value
             self.value.unpack(new_value)
+            if self.owner:
+                self.owner.property_changed(self, old_value)
         else:
             raise MtpProtocolException(ResponseCodes.ACCESS_DENIED)
 
@@ -1,5 +1,5 @@
 from __future__ import absolute_import
-from .mtp_data_types import UInt16, UInt32
+from struct import pack
 
 
 class DataCodeTypes(object):
@@ -149,4 +149,93 @@ class AssociationType(object):
 
 
 def mtp_data(container, data):
-    return UInt32(len(data) + 0xC).pack() + UInt16(ContainerTypes.Data).pack() + UInt16(container.code).pack() + UInt32(container.tid).pack() + data
+    return pack('<IHHI', len(data) + 0xC, ContainerTypes.Data, container.code, container.tid) + data
+
+
+class MtpDataPhase(object):
+    '''
+    R->I data phase that keeps the container header and the payload
+    as separate buffers, so the payload (e.g. a memoryview of a mapped file)
+    is never copied just to prepend the header.
+
+    The payload can also be produced on demand, by a callable that gets a chunk size
+    and returns an iterator over the payload chunks. In both cases, a transport
+    can stream the data phase with chunks(), using constant memory.
+    '''
+
+    default_chunk_size = 0x10000
+
+    def __init__(self, container, payload, length=None):
+        '''
+        :param container: the command that this data phase answers
+        :param payload: the payload, either an object that supports the buffer protocol,
+            or a callable that gets a chunk size and returns an iterator over the payload chunks
+        :param length: length of the payload (default: None, required if payload is a callable)
+        '''
+        self.payload = payload
+        self.streamed = callable(payload)
+        if length is None:
+            length = len(payload)
+        self.length = length
+        length += 0xC
+        if length > 0xffffffff:
+            # objects of 4GB and above are sent with the maximal length
+            length = 0xffffffff
+        self.header = pack('<IHHI', length, ContainerTypes.Data, container.code, container.tid)
+
+    def __len__(self):
+        return len(self.header) + self.length
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('%s only supports slicing' % type(self).__name__)
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError('%s does not support extended slicing' % type(self).__name__)
+        hlen = len(self.header)
+        return self.header[start:stop] + self.get_payload(max(start - hlen, 0), max(stop - hlen, 0))
+
+    def get_payload(self, start, stop):
+        '''
+        :return: copy of part of the payload, a streamed payload is only produced up to stop
+        '''
+        if not self.streamed:
+            return memoryview(self.payload)[start:stop].tobytes()
+        chunks = []
+        produced = 0
+        for chunk in self.payload(self.default_chunk_size):
+            if produced >= stop:
+                break
+            chunks.append(memoryview(chunk).tobytes())
+            produced += len(chunks[-1])
+        return b''.join(chunks)[start:stop]
+
+    def chunks(self, size=None):
+        '''
+        Iterate over the data phase, the header first, then the payload in chunks
+
+        :param size: maximal size of a payload chunk (default: None, the whole payload of a buffer,
+            default_chunk_size for a streamed payload)
+        '''
+        yield self.header
+        if self.streamed:
+            for chunk in self.payload(size or self.default_chunk_size):
+                yield chunk
+        elif size is None:
+            yield self.payload
+        else:
+            view = memoryview(self.payload)
+            for offset in range(0, len(view), size):
+                yield view[offset:offset + size]
+
+    def buffers(self):
+        '''
+        :return: list of the buffers to send, header first
+        '''
+        return list(self.chunks())
+
+    def pack(self):
+        '''
+        :return: the whole data phase in a single bytes object (copies the payload)
+        '''
+        return self.header + self.get_payload(0, self.length)
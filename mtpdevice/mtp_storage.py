@@ -1,41 +1,203 @@
 from __future__ import absolute_import
-from .mtp_base import MtpBaseObject
+import os
+import re
+import tempfile
+from .mtp_base import ID_FACTORY, MtpBaseObject
+from .mtp_object_data import MtpFileSink
 from .mtp_proto import AccessCaps
 from .mtp_data_types import UInt16, UInt32, UInt64, MStr
+from .mtp_property import MtpObjectPropertyCode
+
+
+# path separators (of any platform), NUL and other control characters
+_unsafe_filename_chars = re.compile(u'[\x00-\x1f/\\\\]')
 
 
 class MtpStorage(MtpBaseObject):
 
-    def __init__(self, info):
+    def __init__(self, info, root=None, table=None):
+        '''
+        :type info: MtpStorageInfo
+        :param info: storage info
+        :param root:
+            directory to store the data of objects sent by the initiator in.
+            (default: None, keep the data in memory)
+        :type table: MtpObjectTable
+        :param table:
+            table to keep the metadata of the storage's objects in, for listing and counting them by format
+            (default: None, index the objects by format in dicts).
+            Children of a parent are always listed from the parent's list of children.
+        '''
         super(MtpStorage, self).__init__()
         self.uid |= 0x00020000
         self.info = info
+        self.root = root
+        self.table = table
         self.dev = None
         self.objects = []
+        self.handles = {}
+        self.formats = {}
 
     def get_info(self):
         return self.info.pack()
 
     def get_object(self, handle):
-        for obj in self.objects:
-            res = obj.get_object(handle)
-            if res:
-                return res
-        return None
+        return self.handles.get(handle)
 
     def add_object(self, obj):
         self.objects.append(obj)
+        obj.set_parent(None)
         obj.set_storage(self)
 
-    def get_objects(self):
-        objs = []
-        for obj in self.objects:
-            objs.append(obj)
-            objs.extend(obj.get_objects())
+    def register_object(self, obj):
+        '''
+        Add an object to the handle registry of the storage (and device)
+
+        :type obj: MtpObject
+        :param obj: object that was placed in this storage
+        '''
+        self.handles[obj.get_uid()] = obj
+        ID_FACTORY.register(obj.get_uid())
+        if self.table is not None:
+            self.table.set_row(obj)
+        else:
+            self.formats.setdefault(obj.get_format(), {})[obj.get_uid()] = obj
+        if self.dev:
+            self.dev.register_object(obj)
+
+    def unregister_object(self, obj):
+        '''
+        Remove an object from the handle registry of the storage (and device)
+
+        :type obj: MtpObject
+        :param obj: object that was removed from this storage
+        '''
+        self.handles.pop(obj.get_uid(), None)
+        ID_FACTORY.unregister(obj.get_uid())
+        if self.table is not None:
+            self.table.remove(obj.get_uid())
+        else:
+            self.unindex_format(obj, obj.get_format())
+        if self.dev:
+            self.dev.unregister_object(obj)
+
+    def property_changed(self, obj, prop_code, old_value):
+        '''
+        Called after a property of one of the storage's objects was changed
+
+        :type obj: MtpObject
+        :param obj: object whose property was changed
+        :param prop_code: code of the property that was changed
+        :param old_value: the value of the property before the change
+        '''
+        if obj.get_uid() not in self.handles:
+            return
+        if self.table is not None:
+            self.table.set_row(obj)
+        elif prop_code == MtpObjectPropertyCode.ObjectFormat:
+            self.update_format(obj, old_value)
+
+    def update_format(self, obj, old_format):
+        '''
+        Move an object to the right place in the format index
+        after its ObjectFormat was changed
+
+        :type obj: MtpObject
+        :param obj: object whose format was changed
+        :param old_format: the format the object was indexed by
+        '''
+        if obj.get_uid() in self.handles:
+            self.unindex_format(obj, old_format)
+            self.formats.setdefault(obj.get_format(), {})[obj.get_uid()] = obj
+
+    def unindex_format(self, obj, fmt):
+        objs = self.formats.get(fmt)
+        if objs is not None:
+            objs.pop(obj.get_uid(), None)
+            if not objs:
+                del self.formats[fmt]
+
+    def get_objects(self, obj_fmt_code=None, parent=None):
+        '''
+        :param obj_fmt_code: only return objects that match this format (default: None)
+        :param parent: only return children of this handle, 0 for the storage root (default: None)
+        :return: list of all objects in the storage
+        '''
+        if parent is not None:
+            return self.get_children(obj_fmt_code, parent)
+        if self.table is not None:
+            return [self.handles[h] for h in self.table.find(obj_fmt_code)]
+        if (not obj_fmt_code) or (obj_fmt_code == 0xffffffff):
+            return list(self.handles.values())
+        objs = list(self.formats.get(obj_fmt_code, {}).values())
+        # objects with an undefined (0) format match any format
+        objs.extend(self.formats.get(0, {}).values())
         return objs
 
+    def get_children(self, obj_fmt_code, parent):
+        objs = self.children_of(parent)
+        if obj_fmt_code:
+            return [obj for obj in objs if obj.format_matches(obj_fmt_code)]
+        return list(objs)
+
+    def children_of(self, parent):
+        '''
+        :param parent: handle of the parent, 0 for the storage root
+        :return: the (live) list of the parent's children
+        '''
+        if parent:
+            parent_obj = self.handles.get(parent)
+            return parent_obj.objects if parent_obj else []
+        return self.objects
+
+    def num_objects(self, obj_fmt_code=None, parent=None):
+        if parent is not None:
+            objs = self.children_of(parent)
+            if obj_fmt_code:
+                return sum(1 for obj in objs if obj.format_matches(obj_fmt_code))
+            return len(objs)
+        if self.table is not None:
+            return self.table.count(obj_fmt_code)
+        if (not obj_fmt_code) or (obj_fmt_code == 0xffffffff):
+            return len(self.handles)
+        return len(self.formats.get(obj_fmt_code, {})) + len(self.formats.get(0, {}))
+
+    def new_data_sink(self, obj):
+        '''
+        The sink stops writing once the data is longer than the ObjectCompressedSize
+        that was declared in the object's info, or than the free space under the root.
+
+        :type obj: MtpObject
+        :param obj: object whose data is about to be sent by the initiator
+        :return: MtpFileSink in the storage root, or None if the storage has no root
+        '''
+        if not self.root:
+            return None
+        # the filename comes from the initiator, keep only the characters that are safe in a file name
+        filename = _unsafe_filename_chars.sub('_', obj.info.get_field('filename'))[-128:]
+        fd, path = tempfile.mkstemp(prefix='%08x_' % obj.get_uid(), suffix='_' + filename, dir=self.root)
+        return MtpFileSink(path, os.fdopen(fd, 'wb'), limit=self.data_limit(obj))
+
+    def data_limit(self, obj):
+        '''
+        :type obj: MtpObject
+        :param obj: object whose data is about to be sent by the initiator
+        :return: maximal size of the object's data, None if there is no limit
+        '''
+        limits = []
+        declared = obj.info.get_field('compressed_size')
+        if declared != 0xffffffff:
+            # 0xffffffff is declared for objects of 4GB and above
+            limits.append(declared)
+        if hasattr(os, 'statvfs'):
+            st = os.statvfs(self.root)
+            limits.append(st.f_bavail * st.f_frsize)
+        return min(limits) if limits else None
+
     def set_device(self, dev):
         self.dev = dev
+        for obj in self.handles.values():
+            dev.register_object(obj)
 
     def can_delete(self):
         return self.info.access.value in [AccessCaps.READ_WRITE, AccessCaps.READ_ONLY_WITH_DELETE]
@@ -0,0 +1,261 @@
+'''
+Transport that drives MtpApi over endpoint files, e.g. the ep files of a Linux FunctionFS gadget
+'''
+from __future__ import absolute_import
+import errno
+import os
+import struct
+from .mtp_exception import MtpProtocolException
+from .mtp_msg import event_from_params
+from .mtp_proto import MtpDataPhase
+
+
+def _writev(fd, buffers):
+    '''
+    Write all the buffers, with as few system calls as possible
+
+    :return: number of bytes written
+    '''
+    if not hasattr(os, 'writev'):
+        data = b''.join(memoryview(buff).tobytes() for buff in buffers)
+        return os.write(fd, data)
+    return os.writev(fd, buffers)
+
+
+def _write_all(fd, buffers):
+    '''
+    Write all the buffers, writing the rest again after a short write
+    (empty buffers are skipped, so this never writes a zero length packet)
+
+    :param fd: file descriptor to write to
+    :param buffers: the buffers to write, in order
+    '''
+    views = [memoryview(buff) for buff in buffers]
+    while views:
+        written = _writev(fd, views)
+        while views and (written >= len(views[0])):
+            written -= len(views[0])
+            views.pop(0)
+        if written:
+            views[0] = views[0][written:]
+
+
+class MtpFunctionFsEndpoint(object):
+    '''
+    Endpoint file of a FunctionFS gadget (e.g. /dev/ffs-mtp/ep1).
+    Each read returns (up to size bytes of) a single USB transfer,
+    and each write is sent as a single USB transfer.
+    The gadget must be set up (descriptors and strings written to ep0) before the endpoints are opened.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: path of the endpoint file
+        '''
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR)
+
+    def read(self, size):
+        '''
+        :param size: maximal number of bytes to read, should be a multiple of the max packet size
+        :return: the transfer, b'' for a zero length packet
+        '''
+        return os.read(self.fd, size)
+
+    def write(self, data):
+        '''
+        :param data: data to send as a single transfer, b'' for a zero length packet
+        '''
+        if not len(data):
+            os.write(self.fd, data)
+        else:
+            _write_all(self.fd, [data])
+
+    def writev(self, buffers):
+        '''
+        :param buffers: buffers to send as a single transfer
+        '''
+        _write_all(self.fd, buffers)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class MtpStreamEndpoint(object):
+    '''
+    Endpoint over a stream (a socket or a pipe), to test the transport without USB hardware.
+    Transfers are framed with a 32 bit length, so zero length packets and transfer boundaries
+    survive the stream. Both sides of a loopback use this class.
+    '''
+
+    frame_header = struct.Struct('<I')
+
+    def __init__(self, read_fd=None, write_fd=None):
+        '''
+        :param read_fd: file descriptor to read transfers from (default: None, write only)
+        :param write_fd: file descriptor to write transfers to (default: None, read only)
+        '''
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        # the part of the current transfer that was not read yet
+        self.remainder = None
+
+    def read_exactly(self, size):
+        chunks = []
+        while size:
+            chunk = os.read(self.read_fd, size)
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def read(self, size):
+        '''
+        :param size: maximal number of bytes to read, the rest of a longer transfer is returned by the next reads
+        :return: the transfer, b'' for a zero length packet, None once the stream was closed
+        '''
+        if self.remainder is None:
+            header = self.read_exactly(MtpStreamEndpoint.frame_header.size)
+            if header is None:
+                return None
+            length = MtpStreamEndpoint.frame_header.unpack(header)[0]
+            data = self.read_exactly(length) if length else b''
+            if data is None:
+                return None
+            self.remainder = data
+        data = self.remainder[:size]
+        self.remainder = self.remainder[size:] or None
+        return data
+
+    def write(self, data):
+        self.writev([data])
+
+    def writev(self, buffers):
+        '''
+        :param buffers: buffers to send as a single transfer
+        '''
+        length = sum(len(memoryview(buff)) for buff in buffers)
+        _write_all(self.write_fd, [MtpStreamEndpoint.frame_header.pack(length)] + list(buffers))
+
+    def close(self):
+        for fd in set([self.read_fd, self.write_fd]):
+            if fd is not None:
+                os.close(fd)
+
+
+class MtpTransport(object):
+    '''
+    Drives MtpApi over a bulk-out, a bulk-in and an optional interrupt endpoint.
+
+    Reads are large (read_size), so a long I->R data phase arrives in a few multi-packet transfers.
+    Each R->I container is sent in transfers of up to max_write bytes, each transfer is
+    a single writev of the buffers that it spans (the header and payload chunks are not joined).
+    All transfers but the last of a container are a multiple of the max packet size,
+    and a container whose length is a multiple of the max packet size
+    is followed by a zero length packet, so the host can tell where it ends.
+    '''
+
+    def __init__(
+        self, api, bulk_out, bulk_in, interrupt=None,
+        max_packet=512, read_size=0x100000, max_write=0x100000
+    ):
+        '''
+        :type api: MtpApi
+        :param api: the api to drive, switched to zero copy mode
+        :param bulk_out: endpoint to read commands and I->R data from
+        :param bulk_in: endpoint to write R->I data and responses to
+        :param interrupt: endpoint to write events to (default: None, no events)
+        :param max_packet: max packet size of the bulk-in endpoint (default: 512, high speed)
+        :param read_size: maximal size of a read from bulk-out (default: 1MB)
+        :param max_write: maximal size of a write to bulk-in, a multiple of max_packet (default: 1MB)
+        '''
+        if max_write % max_packet:
+            raise Exception('max_write (%#x) is not a multiple of max_packet (%#x)' % (max_write, max_packet))
+        self.api = api
+        self.api.zero_copy = True
+        self.bulk_out = bulk_out
+        self.bulk_in = bulk_in
+        self.interrupt = interrupt
+        self.max_packet = max_packet
+        self.read_size = read_size
+        self.max_write = max_write
+
+    def run(self):
+        '''
+        Handle transfers until the bulk-out endpoint is closed
+        '''
+        while self.process_one():
+            pass
+
+    def process_one(self):
+        '''
+        Read a single transfer from bulk-out, and send whatever MtpApi responds to it.
+        If an endpoint fails, the current transaction is dropped (along with any data
+        that was spooled for it) before the error is handled.
+
+        :raises: EnvironmentError if an endpoint fails, unless the host is gone (ESHUTDOWN)
+        :return: False if the bulk-out endpoint was closed or the host is gone, True otherwise
+        '''
+        try:
+            return self.transfer()
+        except EnvironmentError as ex:
+            self.api.device.logger.error('[MtpTransport] dropping transaction, endpoint failed: %s', ex)
+            self.api.reset()
+            if ex.errno == errno.ESHUTDOWN:
+                # the host disconnected, or the function was disabled
+                return False
+            raise
+
+    def transfer(self):
+        payload = self.bulk_out.read(self.read_size)
+        if payload is None:
+            return False
+        if not payload:
+            # zero length packet after an I->R data phase
+            return True
+        try:
+            messages = self.api.handle_payload(payload)
+        except MtpProtocolException as ex:
+            self.api.device.logger.error('[MtpTransport] dropping transaction: %s', ex)
+            self.api.reset()
+            return True
+        for message in messages:
+            if isinstance(message, MtpDataPhase):
+                self.send_container(message.chunks(self.max_write), len(message))
+            else:
+                self.send_container([message], len(message))
+        return True
+
+    def send_container(self, buffers, length):
+        '''
+        :param buffers: the buffers of the container
+        :param length: total length of the buffers
+        '''
+        batch = []
+        batch_len = 0
+        for buff in buffers:
+            view = memoryview(buff)
+            while len(view):
+                size = min(len(view), self.max_write - batch_len)
+                batch.append(view[:size])
+                batch_len += size
+                view = view[size:]
+                if batch_len == self.max_write:
+                    self.bulk_in.writev(batch)
+                    batch = []
+                    batch_len = 0
+        if batch:
+            self.bulk_in.writev(batch)
+        if length % self.max_packet == 0:
+            self.bulk_in.write(b'')
+
+    def send_event(self, code, params=(), tid=0):
+        '''
+        :param code: event code
+        :param params: up to three event parameters (default: no parameters)
+        :param tid: id of the transaction that the event relates to (default: 0)
+        '''
+        if self.interrupt is None:
+            raise Exception('no interrupt endpoint to send events on')
+        self.interrupt.write(event_from_params(code, tid, params).pack())
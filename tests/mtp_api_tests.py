@@ -1,5 +1,8 @@
 from struct import pack, unpack
 from binascii import unhexlify
+import os
+import shutil
+import tempfile
 from common import BaseTestCase
 from mtpdevice.mtp_device import MtpDevice, MtpDeviceInfo
 from mtpdevice.mtp_property import MtpDeviceProperty, MtpDevicePropertyCode
@@ -8,6 +11,12 @@ from mtpdevice.mtp_object import MtpObject
 from mtpdevice.mtp_proto import ContainerTypes, OperationDataCodes, ResponseCodes
 from mtpdevice.mtp_api import MtpApi
 from mtpdevice.mtp_data_types import UInt8
+from mtpdevice.mtp_object_data import MtpFileData
+from mtpdevice.mtp_exception import MtpProtocolException
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 
 class MtpApiTest(BaseTestCase):
@@ -136,3 +145,221 @@ class MtpApiTest(BaseTestCase):
         self.assertEqual(response_status, ResponseCodes.OK)
         # read object info
         # read object ?
+
+    def getObject(self, api, handle):
+        self.testApiOpenSession()
+        command = pack('<IHHII', 0x10, ContainerTypes.Command, OperationDataCodes.GetObject, 2, handle)
+        return api.handle_payload(command)
+
+    def testApiGetObjectPacked(self):
+        obj = MtpObject.from_file('runner.py')
+        self.object.add_object(obj)
+        with open('runner.py', 'rb') as f:
+            content = f.read()
+        resps = self.getObject(self.api, obj.get_uid())
+        self.assertEqual(len(resps), 2)
+        self.assertEqual(resps[0], pack('<IHHI', len(content) + 0xc, ContainerTypes.Data, OperationDataCodes.GetObject, 2) + content)
+
+    def testApiGetObjectZeroCopy(self):
+        obj = MtpObject.from_file('runner.py')
+        self.object.add_object(obj)
+        with open('runner.py', 'rb') as f:
+            content = f.read()
+        self.api = MtpApi(self.dev, zero_copy=True)
+        resps = self.getObject(self.api, obj.get_uid())
+        self.assertEqual(len(resps), 2)
+        buffers = resps[0].buffers()
+        self.assertEqual(buffers[0], pack('<IHHI', len(content) + 0xc, ContainerTypes.Data, OperationDataCodes.GetObject, 2))
+        if not resps[0].streamed:
+            # mapped, not possible in python 2
+            self.assertEqual(len(buffers), 2)
+            self.assertIsInstance(buffers[1], memoryview)
+        self.assertEqual(b''.join(memoryview(buff).tobytes() for buff in buffers[1:]), content)
+
+    def testApiGetObjectStreamedInBoundedMemory(self):
+        size = 0x400000
+        fd, path = tempfile.mkstemp()
+        try:
+            chunk = bytes(bytearray(i & 0xff for i in range(0x1000)))
+            for _ in range(size // len(chunk)):
+                os.write(fd, chunk)
+            os.close(fd)
+            obj = MtpObject.from_file(path)
+            # e.g. python 2, or a file system that can't map files
+            obj.data.map = lambda offset=0, size=None: None
+            self.object.add_object(obj)
+            self.api = MtpApi(self.dev, zero_copy=True)
+            data_phase = self.getObject(self.api, obj.get_uid())[0]
+            self.assertTrue(data_phase.streamed)
+            self.assertEqual(len(data_phase), size + 0xc)
+            if tracemalloc:
+                tracemalloc.start()
+            try:
+                total = 0
+                largest = 0
+                for buff in data_phase.chunks(0x10000):
+                    total += len(buff)
+                    largest = max(largest, len(buff))
+                peak = tracemalloc.get_traced_memory()[1] if tracemalloc else 0
+            finally:
+                if tracemalloc:
+                    tracemalloc.stop()
+            self.assertEqual(total, size + 0xc)
+            self.assertEqual(largest, 0x10000)
+            # a few chunks at most, never the whole object
+            self.assertLess(peak, 0x40000)
+        finally:
+            os.remove(path)
+
+    def testApiSendObjectToStorageRoot(self):
+        obj_data = b'0123456789' * 100
+        root = tempfile.mkdtemp()
+        try:
+            self.storage.root = root
+            self.testApiOpenSession()
+
+            send_obj_info_cmd = pack('<IHHII', 0x10, ContainerTypes.Command, OperationDataCodes.SendObjectInfo, 1, self.storage.get_uid())
+            self.api.handle_payload(send_obj_info_cmd)
+            obj_info_dataset = unhexlify('0100010001380000040000000000000000000000000000000000000000000000000000000000060000000000000000000000000011770061006c006c00700061007000650072005f0031002e006a007000650067000000000000')
+            obj_info_dataset = obj_info_dataset[:8] + pack('<I', len(obj_data)) + obj_info_dataset[12:]
+            send_obj_info_data = pack('<IHHI', len(obj_info_dataset) + 0xc, ContainerTypes.Data, OperationDataCodes.SendObjectInfo, 1) + obj_info_dataset
+            resps = self.api.handle_payload(send_obj_info_data)
+            handle = unpack('<I', resps[0][-4:])[0]
+
+            send_obj_cmd = pack('<IHHI', 0xc, ContainerTypes.Command, OperationDataCodes.SendObject, 2)
+            self.api.handle_payload(send_obj_cmd)
+            send_obj_data = pack('<IHHI', len(obj_data) + 0xc, ContainerTypes.Data, OperationDataCodes.SendObject, 2) + obj_data[:500]
+            self.assertEqual(self.api.handle_payload(send_obj_data), [])
+            resps = self.api.handle_payload(obj_data[500:])
+            self.assertEqual(unpack('<H', resps[0][6:8])[0], ResponseCodes.OK)
+
+            obj = self.dev.get_object(handle)
+            self.assertIsInstance(obj.data, MtpFileData)
+            self.assertEqual(os.path.dirname(obj.data.path), root)
+            with open(obj.data.path, 'rb') as f:
+                self.assertEqual(f.read(), obj_data)
+            self.assertEqual(obj.get_data(), obj_data)
+        finally:
+            shutil.rmtree(root)
+
+    def testApiResetAfterOverflowingData(self):
+        root = tempfile.mkdtemp()
+        try:
+            self.storage.root = root
+            self.testApiOpenSession()
+            send_obj_info_cmd = pack('<IHHII', 0x10, ContainerTypes.Command, OperationDataCodes.SendObjectInfo, 1, self.storage.get_uid())
+            self.api.handle_payload(send_obj_info_cmd)
+            obj_info_dataset = unhexlify('0100010001380000040000000000000000000000000000000000000000000000000000000000060000000000000000000000000011770061006c006c00700061007000650072005f0031002e006a007000650067000000000000')
+            send_obj_info_data = pack('<IHHI', len(obj_info_dataset) + 0xc, ContainerTypes.Data, OperationDataCodes.SendObjectInfo, 1) + obj_info_dataset
+            self.api.handle_payload(send_obj_info_data)
+
+            send_obj_cmd = pack('<IHHI', 0xc, ContainerTypes.Command, OperationDataCodes.SendObject, 2)
+            self.api.handle_payload(send_obj_cmd)
+            # the header declares 8 bytes of data, but 32 bytes follow it
+            send_obj_data = pack('<IHHI', 0x14, ContainerTypes.Data, OperationDataCodes.SendObject, 2) + b'\x00' * 32
+            with self.assertRaises(MtpProtocolException):
+                self.api.handle_payload(send_obj_data)
+            self.api.reset()
+            self.assertEqual(self.api.state, MtpApi.STATE_WAIT_CMD)
+            self.assertEqual(os.listdir(root), [])
+            command = pack('<IHHI', 0x0c, ContainerTypes.Command, OperationDataCodes.GetDeviceInfo, 3)
+            self.assertEqual(len(self.api.handle_payload(command)), 2)
+        finally:
+            shutil.rmtree(root)
+
+    def sendObjectInfoToRoot(self, root, obj_info_dataset):
+        self.storage.root = root
+        self.testApiOpenSession()
+        send_obj_info_cmd = pack('<IHHII', 0x10, ContainerTypes.Command, OperationDataCodes.SendObjectInfo, 1, self.storage.get_uid())
+        self.api.handle_payload(send_obj_info_cmd)
+        send_obj_info_data = pack('<IHHI', len(obj_info_dataset) + 0xc, ContainerTypes.Data, OperationDataCodes.SendObjectInfo, 1) + obj_info_dataset
+        resps = self.api.handle_payload(send_obj_info_data)
+        send_obj_cmd = pack('<IHHI', 0xc, ContainerTypes.Command, OperationDataCodes.SendObject, 2)
+        self.api.handle_payload(send_obj_cmd)
+        return unpack('<I', resps[0][-4:])[0]
+
+    def sendObjectToRoot(self, root, obj_data):
+        obj_info_dataset = unhexlify('0100010001380000040000000000000000000000000000000000000000000000000000000000060000000000000000000000000011770061006c006c00700061007000650072005f0031002e006a007000650067000000000000')
+        obj_info_dataset = obj_info_dataset[:8] + pack('<I', len(obj_data)) + obj_info_dataset[12:]
+        handle = self.sendObjectInfoToRoot(root, obj_info_dataset)
+        send_obj_data = pack('<IHHI', len(obj_data) + 0xc, ContainerTypes.Data, OperationDataCodes.SendObject, 2) + obj_data
+        self.api.handle_payload(send_obj_data)
+        return self.dev.get_object(handle)
+
+    def testApiSendObjectLargerThanDeclared(self):
+        root = tempfile.mkdtemp()
+        try:
+            obj_info_dataset = unhexlify('0100010001380000040000000000000000000000000000000000000000000000000000000000060000000000000000000000000011770061006c006c00700061007000650072005f0031002e006a007000650067000000000000')
+            self.sendObjectInfoToRoot(root, obj_info_dataset)
+            # 4 bytes were declared in the info, the container has 1000
+            send_obj_data = pack('<IHHI', 1000 + 0xc, ContainerTypes.Data, OperationDataCodes.SendObject, 2) + b'\x00' * 100
+            self.assertEqual(self.api.handle_payload(send_obj_data), [])
+            # nothing more is written once the declared size was passed
+            self.assertEqual(os.listdir(root), [])
+            self.assertEqual(self.api.handle_payload(b'\x00' * 500), [])
+            resps = self.api.handle_payload(b'\x00' * 400)
+            self.assertEqual(unpack('<H', resps[0][6:8])[0], ResponseCodes.STORE_FULL)
+            self.assertEqual(os.listdir(root), [])
+        finally:
+            shutil.rmtree(root)
+
+    def testApiSendObjectWithUnsafeFilename(self):
+        root = tempfile.mkdtemp()
+        try:
+            info = MtpObject.from_file(__file__).info.copy()
+            info.set_field('compressed_size', 4)
+            info.set_field('filename', u'../a/b\\c\x00d.txt')
+            handle = self.sendObjectInfoToRoot(root, info.pack())
+            send_obj_data = pack('<IHHI', 4 + 0xc, ContainerTypes.Data, OperationDataCodes.SendObject, 2) + b'data'
+            resps = self.api.handle_payload(send_obj_data)
+            self.assertEqual(unpack('<H', resps[0][6:8])[0], ResponseCodes.OK)
+            path = self.dev.get_object(handle).data.path
+            self.assertEqual(os.listdir(root), [os.path.basename(path)])
+            self.assertTrue(path.endswith('_.._a_b_c_d.txt'))
+        finally:
+            shutil.rmtree(root)
+
+    def transact(self, code, tid, *params):
+        command = pack('<IHHI' + 'I' * len(params), 0xc + 4 * len(params), ContainerTypes.Command, code, tid, *params)
+        resps = self.api.handle_payload(command)
+        return unpack('<H', resps[-1][6:8])[0]
+
+    def testApiDeleteSentObjectRemovesFile(self):
+        root = tempfile.mkdtemp()
+        try:
+            obj = self.sendObjectToRoot(root, b'data')
+            path = obj.data.path
+            self.assertEqual(self.transact(OperationDataCodes.DeleteObject, 3, obj.get_uid()), ResponseCodes.OK)
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(os.listdir(root), [])
+        finally:
+            shutil.rmtree(root)
+
+    def testApiMoveAndCopySentObjectKeepFile(self):
+        root = tempfile.mkdtemp()
+        try:
+            obj = self.sendObjectToRoot(root, b'data')
+            path = obj.data.path
+            uid = self.object.get_uid()
+            self.assertEqual(self.transact(OperationDataCodes.MoveObject, 3, obj.get_uid(), self.storage.get_uid(), uid), ResponseCodes.OK)
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(self.transact(OperationDataCodes.CopyObject, 4, obj.get_uid(), self.storage.get_uid(), uid), ResponseCodes.OK)
+            self.assertEqual(self.transact(OperationDataCodes.DeleteObject, 5, obj.get_uid()), ResponseCodes.OK)
+            # the copy still uses the file
+            self.assertTrue(os.path.exists(path))
+        finally:
+            shutil.rmtree(root)
+
+    def testApiDeleteImportedObjectKeepsFile(self):
+        root = tempfile.mkdtemp()
+        try:
+            path = os.path.join(root, 'imported.txt')
+            with open(path, 'wb') as f:
+                f.write(b'data')
+            obj = MtpObject.from_file(path)
+            self.object.add_object(obj)
+            self.testApiOpenSession()
+            self.assertEqual(self.transact(OperationDataCodes.DeleteObject, 2, obj.get_uid()), ResponseCodes.OK)
+            self.assertTrue(os.path.exists(path))
+        finally:
+            shutil.rmtree(root)
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from struct import pack
+from common import BaseTestCase
+from mtpdevice.mtp_api import MtpApi
+from mtpdevice.mtp_async import MtpAsyncDriver, MtpAsyncQueueEndpoint
+from mtpdevice.mtp_device import MtpDevice, MtpDeviceInfo
+from mtpdevice.mtp_msg import msg_from_buff
+from mtpdevice.mtp_object import MtpObject
+from mtpdevice.mtp_proto import ContainerTypes, OperationDataCodes, ResponseCodes, MtpDataPhase
+from mtpdevice.mtp_storage import MtpStorage, MtpStorageInfo
+
+
+class MtpAsyncDriverTests(BaseTestCase):
+
+    def setUp(self):
+        super(MtpAsyncDriverTests, self).setUp()
+        self.storage = MtpStorage(MtpStorageInfo(0, 0, 0, 0, 0, 0, 'desc', 'vol'))
+        self.obj = MtpObject.from_file('runner.py')
+        self.storage.add_object(self.obj)
+        info = MtpDeviceInfo(0x0102, 0, 0, '', 0, [], [], 'manufacturer', 'model', '1.0', '0123')
+        self.dev = MtpDevice(info, logger=self.logger)
+        self.dev.add_storage(self.storage)
+        self.api = MtpApi(self.dev)
+        with open('runner.py', 'rb') as f:
+            self.content = f.read()
+
+    def command(self, code, tid, *params):
+        return pack('<IHHI' + 'I' * len(params), 0xc + 4 * len(params), ContainerTypes.Command, code, tid, *params)
+
+    def response(self, code, tid):
+        return pack('<IHHI', 0xc, ContainerTypes.Response, code, tid)
+
+    def run_driver(self, commands, **kwargs):
+        async def run():
+            bulk_out = MtpAsyncQueueEndpoint()
+            bulk_in = MtpAsyncQueueEndpoint()
+            driver = MtpAsyncDriver(self.api, bulk_out, bulk_in, **kwargs)
+            for command in commands:
+                await bulk_out.write(command)
+            bulk_out.close()
+            await driver.run()
+            transfers = []
+            while not bulk_in.queue.empty():
+                transfers.append(bulk_in.queue.get_nowait())
+            return transfers
+        return asyncio.run(run())
+
+    def testResponses(self):
+        transfers = self.run_driver([
+            self.command(OperationDataCodes.OpenSession, 1, 1),
+            self.command(0, 2),
+        ])
+        self.assertEqual(transfers, [
+            self.response(ResponseCodes.OK, 1),
+            self.response(ResponseCodes.OPERATION_NOT_SUPPORTED, 2),
+        ])
+
+    def testDataPhaseInChunks(self):
+        executor = ThreadPoolExecutor(1)
+        try:
+            transfers = self.run_driver([
+                self.command(OperationDataCodes.OpenSession, 1, 1),
+                self.command(OperationDataCodes.GetObject, 2, self.obj.get_uid()),
+            ], executor=executor, chunk_size=100)
+        finally:
+            executor.shutdown()
+        self.assertEqual(transfers[0], self.response(ResponseCodes.OK, 1))
+        self.assertEqual(transfers[-1], self.response(ResponseCodes.OK, 2))
+        data = transfers[1:-1]
+        self.assertEqual(len(data), 1 + (len(self.content) + 99) // 100)
+        self.assertEqual(data[0], pack('<IHHI', len(self.content) + 0xc, ContainerTypes.Data, OperationDataCodes.GetObject, 2))
+        self.assertEqual(b''.join(data[1:]), self.content)
+
+    def testStreamedDataPhase(self):
+        def producer(size):
+            for i in range(3):
+                yield b'%d' % i * size
+
+        async def run():
+            bulk_in = MtpAsyncQueueEndpoint()
+            driver = MtpAsyncDriver(self.api, MtpAsyncQueueEndpoint(), bulk_in, chunk_size=10)
+            command = msg_from_buff(self.command(OperationDataCodes.GetObject, 1, 0))
+            await driver.write_data_phase(MtpDataPhase(command, producer, 30))
+            return [bulk_in.queue.get_nowait() for _ in range(bulk_in.queue.qsize())]
+        transfers = asyncio.run(run())
+        self.assertEqual(len(transfers), 4)
+        self.assertEqual(b''.join(transfers[1:]), b'0' * 10 + b'1' * 10 + b'2' * 10)
+
+    def testSlowHandlerDoesNotBlockTheLoop(self):
+        handle_payload = self.api.handle_payload
+        ticked = threading.Event()
+        waits = []
+
+        def slow_handle_payload(payload):
+            # like a handler waiting for the storage, the loop keeps running meanwhile
+            waits.append(ticked.wait(2))
+            return handle_payload(payload)
+        self.api.handle_payload = slow_handle_payload
+
+        async def tick():
+            await asyncio.sleep(0.01)
+            ticked.set()
+
+        async def run():
+            bulk_out = MtpAsyncQueueEndpoint()
+            bulk_in = MtpAsyncQueueEndpoint()
+            driver = MtpAsyncDriver(self.api, bulk_out, bulk_in)
+            await bulk_out.write(self.command(OperationDataCodes.OpenSession, 1, 1))
+            bulk_out.close()
+            ticker = asyncio.ensure_future(tick())
+            await asyncio.wait_for(driver.run(), 10)
+            await ticker
+            return await bulk_in.read()
+        response = asyncio.run(run())
+        self.assertEqual(waits, [True])
+        self.assertEqual(response, self.response(ResponseCodes.OK, 1))
+
+    def testProtocolErrorResets(self):
+        transfers = self.run_driver([
+            b'\x00' * 4,
+            self.command(OperationDataCodes.OpenSession, 1, 1),
+        ])
+        self.assertEqual(transfers, [self.response(ResponseCodes.OK, 1)])
+
+    def testBackpressure(self):
+        async def run():
+            bulk_out = MtpAsyncQueueEndpoint()
+            bulk_in = MtpAsyncQueueEndpoint(maxsize=1)
+            driver = MtpAsyncDriver(self.api, bulk_out, bulk_in, max_pending=1)
+            await bulk_out.write(self.command(OperationDataCodes.OpenSession, 1, 1))
+            for tid in range(2, 12):
+                await bulk_out.write(self.command(OperationDataCodes.GetNumObjects, tid, 0xffffffff))
+            bulk_out.close()
+            task = asyncio.ensure_future(driver.run())
+            for _ in range(20):
+                await asyncio.sleep(0)
+            # nobody reads bulk-in, so the reader stopped reading bulk-out
+            stalled = bulk_out.queue.qsize()
+            transfers = []
+            while len(transfers) < 21:
+                transfers.append(await bulk_in.read())
+            await task
+            return stalled, transfers
+        stalled, transfers = asyncio.run(run())
+        self.assertGreater(stalled, 5)
+        self.assertEqual(transfers[-1], self.response(ResponseCodes.OK, 11))
+
+    def testEventDuringTransaction(self):
+        async def run():
+            bulk_out = MtpAsyncQueueEndpoint()
+            bulk_in = MtpAsyncQueueEndpoint(maxsize=1)
+            interrupt = MtpAsyncQueueEndpoint()
+            driver = MtpAsyncDriver(self.api, bulk_out, bulk_in, interrupt, chunk_size=10)
+            await bulk_out.write(self.command(OperationDataCodes.OpenSession, 1, 1))
+            await bulk_out.write(self.command(OperationDataCodes.GetObject, 2, self.obj.get_uid()))
+            bulk_out.close()
+            task = asyncio.ensure_future(driver.run())
+            await bulk_in.read()
+            # the data phase of GetObject is stuck on bulk-in
+            await bulk_in.read()
+            driver.send_event(0x4002, [self.obj.get_uid()], 2)
+            event = await interrupt.read()
+            for _ in range((len(self.content) + 9) // 10 + 1):
+                await bulk_in.read()
+            await task
+            return event
+        event = asyncio.run(run())
+        self.assertEqual(event, pack('<IHHII', 0x10, ContainerTypes.Event, 0x4002, 2, self.obj.get_uid()))
+
+    def testEventWithoutInterrupt(self):
+        async def run():
+            driver = MtpAsyncDriver(self.api, MtpAsyncQueueEndpoint(), MtpAsyncQueueEndpoint())
+            driver.send_event(0x4002)
+        with self.assertRaises(Exception):
+            asyncio.run(run())
+
+    def testBulkInFailure(self):
+        class FailingEndpoint(object):
+            async def write(self, data):
+                raise IOError('host is gone')
+
+        async def run():
+            bulk_out = MtpAsyncQueueEndpoint()
+            driver = MtpAsyncDriver(self.api, bulk_out, FailingEndpoint(), max_pending=2)
+            await bulk_out.write(self.command(OperationDataCodes.OpenSession, 1, 1))
+            for tid in range(2, 12):
+                await bulk_out.write(self.command(OperationDataCodes.GetNumObjects, tid, 0xffffffff))
+            await asyncio.wait_for(driver.run(), 5)
+        with self.assertRaises(IOError):
+            asyncio.run(run())
+
+    def testBulkInFailureDuringDataPhase(self):
+        class FailingEndpoint(object):
+            async def write(self, data):
+                raise IOError('host is gone')
+
+        async def run():
+            bulk_out = MtpAsyncQueueEndpoint()
+            driver = MtpAsyncDriver(self.api, bulk_out, FailingEndpoint(), chunk_size=10)
+            await bulk_out.write(self.command(OperationDataCodes.OpenSession, 1, 1))
+            await bulk_out.write(self.command(OperationDataCodes.GetObject, 2, self.obj.get_uid()))
+            await asyncio.wait_for(driver.run(), 5)
+        with self.assertRaises(IOError):
+            asyncio.run(run())
@@ -0,0 +1,186 @@
+import os
+import tempfile
+from mtp_fs_tests import FsTestCase
+from mtpdevice.mtp_base import ID_FACTORY
+from mtpdevice.mtp_catalog import MtpCatalog
+from mtpdevice.mtp_fs import MtpFsImporter
+from mtpdevice.mtp_storage import MtpStorage, MtpStorageInfo
+
+
+class MtpCatalogTests(FsTestCase):
+
+    def setUp(self):
+        super(MtpCatalogTests, self).setUp()
+        self.db_path = self.root + '.db'
+
+    def tearDown(self):
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)
+        super(MtpCatalogTests, self).tearDown()
+
+    def state(self, obj):
+        return dict(
+            (o.real_path, (o.get_uid(), o.parent.get_uid(), o.fs_state, o.get_info(), o.info.get_field('unique_id')))
+            for o in obj.get_objects()
+        )
+
+    def testSaveAndLoad(self):
+        obj = MtpFsImporter().import_tree(self.root)
+        obj.objects[0].info.set_field('unique_id', 0x1234567890abcdef1234567890abcdef)
+        uut = MtpCatalog(self.db_path)
+        uut.save(obj)
+        uut.close()
+        uut = MtpCatalog(self.db_path)
+        self.assertTrue(uut.has_tree(self.root))
+        loaded = uut.load(self.root)
+        uut.close()
+        self.assertEqual(loaded.get_uid(), obj.get_uid())
+        self.assertEqual(self.state(loaded), self.state(obj))
+        mp3 = loaded.objects[0].objects[1]
+        self.assertEqual(mp3.get_data(), b'\x00' * 10)
+        self.assertEqual(loaded.objects[0].info.get_field('unique_id'), 0x1234567890abcdef1234567890abcdef)
+
+    def testLoadMissingTree(self):
+        uut = MtpCatalog(self.db_path)
+        self.assertFalse(uut.has_tree(self.root))
+        self.assertIsNone(uut.load(self.root))
+        uut.close()
+
+    def testLoadTakenHandles(self):
+        obj = MtpFsImporter().import_tree(self.root)
+        uut = MtpCatalog(self.db_path)
+        uut.save(obj)
+        storage = MtpStorage(MtpStorageInfo(0, 0, 0, 0, 0, 0, 'desc', 'vol'))
+        storage.add_object(obj)
+        loaded = uut.load(self.root, storage.handles)
+        uut.close()
+        self.assertNotEqual(loaded.get_uid(), obj.get_uid())
+        storage.add_object(loaded)
+        self.assertEqual(len(storage.handles), 2 * (1 + len(obj.get_objects())))
+
+    def testLoadRegisteredHandles(self):
+        obj = MtpFsImporter().import_tree(self.root)
+        uut = MtpCatalog(self.db_path)
+        uut.save(obj)
+        storage = MtpStorage(MtpStorageInfo(0, 0, 0, 0, 0, 0, 'desc', 'vol'))
+        storage.add_object(obj)
+        # by default, the handles of objects registered in any storage are taken
+        loaded = uut.load(self.root)
+        handles = set(o.get_uid() for o in [loaded] + loaded.get_objects())
+        self.assertFalse(handles & set(storage.handles))
+        # the rows and the parents of their children follow the new handles
+        self.assertEqual(self.state(uut.load(self.root, {})), self.state(loaded))
+        self.assertEqual(uut.load(self.root, {}).get_uid(), loaded.get_uid())
+        storage.add_object(loaded)
+        self.assertEqual(len(storage.handles), 2 * (1 + len(obj.get_objects())))
+        uut.close()
+
+    def make_stale(self, uut, *parts):
+        with uut.db:
+            uut.db.execute(
+                'UPDATE objects SET ino = NULL, size = NULL, st_mtime = NULL WHERE real_path = ?',
+                (os.path.join(self.root, *parts),)
+            )
+
+    def testLoadTreeStaleRowOfMissingFile(self):
+        uut = MtpCatalog(self.db_path)
+        uut.load_tree(self.root)
+        self.make_stale(uut, 'a', 'x.mp3')
+        os.remove(os.path.join(self.root, 'a', 'x.mp3'))
+        loaded, counts = uut.load_tree(self.root)
+        self.assertEqual(counts, {'added': 0, 'removed': 1, 'updated': 0})
+        self.assertNotIn(os.path.join(self.root, 'a', 'x.mp3'), [o.real_path for o in loaded.get_objects()])
+        uut.close()
+
+    def testLoadTreeStaleRow(self):
+        uut = MtpCatalog(self.db_path)
+        obj, _ = uut.load_tree(self.root)
+        path = os.path.join(self.root, 'a', 'x.mp3')
+        handle = [o for o in obj.get_objects() if o.real_path == path][0].get_uid()
+        self.make_stale(uut, 'a', 'x.mp3')
+        # rewritten in place, only the stale row makes its directory rescanned
+        self.write(os.path.join('a', 'x.mp3'), b'\x01' * 20)
+        loaded, counts = uut.load_tree(self.root)
+        self.assertEqual(counts, {'added': 0, 'removed': 0, 'updated': 1})
+        mp3 = [o for o in loaded.get_objects() if o.real_path == path][0]
+        self.assertEqual(mp3.get_uid(), handle)
+        self.assertEqual(mp3.get_data(), b'\x01' * 20)
+        self.assertEqual(self.state(uut.load(self.root)), self.state(loaded))
+        uut.close()
+
+    def testLoadTreeKeepsHandles(self):
+        uut = MtpCatalog(self.db_path)
+        obj, counts = uut.load_tree(self.root)
+        self.assertIsNone(counts)
+        state = self.state(obj)
+        uut.close()
+        ID_FACTORY.reset()
+        uut = MtpCatalog(self.db_path)
+        loaded, counts = uut.load_tree(self.root)
+        self.assertEqual(counts, {'added': 0, 'removed': 0, 'updated': 0})
+        self.assertEqual(self.state(loaded), state)
+        # new handles do not clash with the restored ones
+        self.assertGreater(ID_FACTORY.uid(), max(o.get_uid() for o in loaded.get_objects()))
+        uut.close()
+
+    def testLoadTreeRevalidates(self):
+        uut = MtpCatalog(self.db_path)
+        obj, counts = uut.load_tree(self.root)
+        handles = dict((o.real_path, o.get_uid()) for o in obj.get_objects())
+        self.write(os.path.join('a', 'x.mp3'), b'\x01' * 20)
+        self.write(os.path.join('a', 'new.mp3'), b'new')
+        os.remove(os.path.join(self.root, 'b.png'))
+        loaded, counts = uut.load_tree(self.root)
+        self.assertEqual(counts, {'added': 1, 'removed': 1, 'updated': 1})
+        mp3 = loaded.objects[0].objects[1]
+        self.assertEqual(mp3.get_uid(), handles[mp3.real_path])
+        self.assertEqual(mp3.get_data(), b'\x01' * 20)
+        # the catalog was updated with the result of the sync
+        self.assertEqual(self.state(uut.load(self.root, dict.fromkeys(handles))), self.state(loaded))
+        uut.close()
+
+    def testLoadTreeWithoutChangesDoesNotWrite(self):
+        uut = MtpCatalog(self.db_path)
+        uut.load_tree(self.root)
+        changes = uut.db.total_changes
+        loaded, counts = uut.load_tree(self.root)
+        self.assertEqual(counts, {'added': 0, 'removed': 0, 'updated': 0})
+        self.assertEqual(uut.db.total_changes, changes)
+        uut.close()
+
+    def testLoadTreeWritesChangedRows(self):
+        uut = MtpCatalog(self.db_path)
+        uut.load_tree(self.root)
+        changes = uut.db.total_changes
+        self.write(os.path.join('a', 'c', 'new.wma'), b'')
+        loaded, counts = uut.load_tree(self.root)
+        self.assertEqual(counts['added'], 1)
+        # the new row and the row of its directory
+        self.assertEqual(uut.db.total_changes - changes, 2)
+        self.assertEqual(self.state(uut.load(self.root)), self.state(loaded))
+        uut.close()
+
+    def testLoadTreeFull(self):
+        uut = MtpCatalog(self.db_path)
+        uut.load_tree(self.root)
+        path = os.path.join(self.root, 'a', 'x.mp3')
+        # rewritten in place, the directory does not change
+        self.write(os.path.join('a', 'x.mp3'), b'\x01' * 20)
+        loaded, counts = uut.load_tree(self.root)
+        self.assertEqual(counts['updated'], 0)
+        loaded, counts = uut.load_tree(self.root, full=True)
+        self.assertEqual(counts['updated'], 1)
+        mp3 = [o for o in loaded.get_objects() if o.real_path == path][0]
+        self.assertEqual(mp3.get_data(), b'\x01' * 20)
+        uut.close()
+
+    def testSentObjectsAreNotSaved(self):
+        obj = MtpFsImporter().import_tree(self.root)
+        sent = MtpFsImporter().import_tree(os.path.join(self.root, 'b.png'))
+        sent.real_path = os.path.join(tempfile.gettempdir(), 'spooled_b.png')
+        obj.objects[0].add_object(sent)
+        uut = MtpCatalog(self.db_path)
+        uut.save(obj)
+        loaded = uut.load(self.root)
+        uut.close()
+        self.assertEqual(len(loaded.get_objects()), len(obj.get_objects()) - 1)
@@ -0,0 +1,100 @@
+from common import BaseTestCase
+from struct import pack
+from array import array
+import unittest
+from mtpdevice.mtp_data_types import UInt8, UInt16, UInt32, Int64, UInt128, MArray, MEnum, MStr, MDateTime
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class MArrayTest(BaseTestCase):
+
+    def testPackUInt32(self):
+        uut = MArray(UInt32, [1, 2, 0xffffffff])
+        self.assertEqual(uut.pack(), pack('<IIII', 3, 1, 2, 0xffffffff))
+
+    def testPackEmpty(self):
+        self.assertEqual(MArray(UInt16, []).pack(), pack('<I', 0))
+
+    def testPackEnum(self):
+        uut = MEnum(UInt8, [0, 1])
+        self.assertEqual(uut.pack(), pack('<HBB', 2, 0, 1))
+
+    def testPackSigned(self):
+        uut = MArray(Int64, [-1, 2])
+        self.assertEqual(uut.pack(), pack('<Iqq', 2, -1, 2))
+
+    def testPack128(self):
+        uut = MArray(UInt128, [1 << 64])
+        self.assertEqual(uut.pack(), pack('<IQQ', 1, 0, 1))
+
+    def testAddValue(self):
+        uut = MArray(UInt16, [1])
+        uut.pack()
+        uut.add_value(UInt16(2))
+        uut.add_value(3)
+        self.assertEqual(uut.pack(), pack('<IHHH', 3, 1, 2, 3))
+
+    def testUnpack(self):
+        buff = pack('<IHHH', 3, 1, 2, 3) + b'\xff'
+        uut = MArray(UInt16, [])
+        (value, offset) = uut.unpack_from(buff, 0)
+        self.assertEqual(list(value), [1, 2, 3])
+        self.assertEqual(list(uut.value), [1, 2, 3])
+        self.assertEqual(offset, 10)
+
+    def testUnpack128(self):
+        uut = MArray(UInt128, [])
+        (value, offset) = uut.unpack_from(pack('<IQQ', 1, 0, 1), 0)
+        self.assertEqual(value, [1 << 64])
+        self.assertEqual(offset, 20)
+
+    def testUnpackTruncated(self):
+        with self.assertRaises(ValueError):
+            MArray(UInt32, []).unpack(pack('<II', 2, 1))
+
+    def testFromArray(self):
+        values = array('I', [4, 5])
+        uut = MArray(UInt32, values)
+        self.assertIs(uut.value, values)
+        self.assertEqual(uut.pack(), pack('<III', 2, 4, 5))
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def testFromNumpy(self):
+        uut = MArray(UInt32, numpy.arange(3))
+        self.assertEqual(uut.pack(), pack('<IIII', 3, 0, 1, 2))
+
+
+class PackIntoTest(BaseTestCase):
+
+    def check(self, uut):
+        expected = uut.pack()
+        uut.packed = None
+        self.assertEqual(uut.packed_size(), len(expected))
+        buff = bytearray(b'\xee' * (len(expected) + 3))
+        self.assertEqual(uut.pack_into(buff, 2), 2 + len(expected))
+        self.assertEqual(bytes(buff[2:-1]), expected)
+        self.assertEqual(bytes(buff[:2] + buff[-1:]), b'\xee' * 3)
+
+    def testInts(self):
+        self.check(UInt8(0xfe))
+        self.check(UInt32(0x12345678))
+        self.check(Int64(-2))
+        self.check(UInt128((1 << 100) | 5))
+
+    def testStrings(self):
+        self.check(MStr(''))
+        self.check(MStr(u'file name.mp3'))
+        self.check(MDateTime(1500000000))
+
+    def testArray(self):
+        self.check(MArray(UInt16, [1, 2, 3]))
+
+    def testPacked(self):
+        uut = MStr(u'abc')
+        packed = uut.pack()
+        buff = bytearray(len(packed))
+        uut.pack_into(buff, 0)
+        self.assertEqual(bytes(buff), packed)
@@ -1,13 +1,14 @@
 from common import BaseTestCase
-from mtpdevice.mtp_device import MtpDevice, MtpDeviceInfo
+from mtpdevice.mtp_device import MtpDevice, MtpDeviceInfo, Operation
 from mtpdevice.mtp_storage import MtpStorage, MtpStorageInfo
-from mtpdevice.mtp_object import MtpObject
+from mtpdevice.mtp_object import MtpObject, Formats
 from mtpdevice.mtp_proto import OperationDataCodes, ResponseCodes, AccessCaps, ContainerTypes
 from mtpdevice.mtp_msg import MtpParametersMessage, response_from_command, MtpMessage
 from mtpdevice.mtp_property import MtpDeviceProperty, MtpObjectPropertyCode
 from mtpdevice.mtp_data_types import UInt8
-from struct import pack
+from struct import pack, unpack_from
 from binascii import unhexlify, hexlify
+import logging
 
 
 def command_message(tid, code, params=None):
@@ -28,6 +29,33 @@ def response_message(cmd):
     return response_from_command(cmd, ResponseCodes.OK)
 
 
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class StaticFuzzer(object):
+
+    def __init__(self, mutation):
+        self.mutation = mutation
+        self.stages = []
+
+    def get_mutation(self, stage, data):
+        self.stages.append(stage)
+        return self.mutation
+
+
+class SilentLogger(logging.Logger):
+
+    def info(self, *args, **kwargs):
+        raise AssertionError('info should not be called')
+
+
 class MtpDeviceTests(BaseTestCase):
 
     def setUp(self):
@@ -113,6 +141,61 @@ class MtpDeviceTests(BaseTestCase):
         self.dev.CloseSession(request, response, None)
         self.assertEqual(response.code, ResponseCodes.SESSION_NOT_OPEN)
 
+    def test_LoggingEnabled(self):
+        logger = logging.getLogger('MtpDeviceTests.info')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = ListHandler()
+        logger.addHandler(handler)
+        self.dev.logger = logger
+        request = command_message(self.new_transaction(), OperationDataCodes.GetDeviceInfo, [])
+        response = response_message(request)
+        self.dev.GetDeviceInfo(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+        self.assertIn('[MtpDevice] handling command: 0x1001 (GetDeviceInfo)', handler.messages)
+        self.assertIn('[MtpDevice] response: 0x2001', handler.messages)
+
+    def test_LoggingDisabled(self):
+        logger = SilentLogger('MtpDeviceTests.quiet')
+        logger.setLevel(logging.WARNING)
+        self.dev.logger = logger
+        request = command_message(self.new_transaction(), OperationDataCodes.GetDeviceInfo, [])
+        response = response_message(request)
+        self.dev.GetDeviceInfo(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+
+    def test_DispatchTableHasAllOperations(self):
+        self.assertEqual(set(self.dev.dispatch.keys()), set(self.dev.operations.keys()))
+
+    def test_SetFuzzerRebindsOperations(self):
+        fuzzer = StaticFuzzer(b'mutation')
+        self.dev.set_fuzzer(fuzzer)
+        request = command_message(self.new_transaction(), OperationDataCodes.GetDeviceInfo, [])
+        response = response_message(request)
+        self.assertEqual(self.dev.handle_transaction(request, response, None), b'mutation')
+        self.assertEqual(fuzzer.stages, ['GetDeviceInfo'])
+        self.dev.set_fuzzer(None)
+        self.assertNotEqual(self.dev.handle_transaction(request, response, None), b'mutation')
+        self.assertEqual(fuzzer.stages, ['GetDeviceInfo'])
+
+    def test_OperationInvalidNumParams(self):
+        with self.assertRaises(Exception):
+            Operation(None, 0x9999, 'Invalid', num_params=6)
+
+    def test_DeviceInfoIsCached(self):
+        self.assertIs(self.dev.get_info(), self.dev.get_info())
+
+    def test_DeviceInfoAfterAddProperty(self):
+        packed = self.dev.get_info()
+        self.dev.add_property(MtpDeviceProperty(0x5001, 0, UInt8(1), UInt8(0)))
+        self.assertNotEqual(self.dev.get_info(), packed)
+        self.assertIn(pack('<IH', 1, 0x5001), self.dev.get_info())
+
+    def test_DevicesShareOperationsArray(self):
+        other = MtpDevice(MtpDeviceInfo(0x0102, 0, 0x0708, '', 0, [], [], 'm', 'm', '1', '0'))
+        self.assertIs(other.info.operations_supported, self.dev.info.operations_supported)
+        self.assertEqual(len(self.dev.info.operations_supported.value), len(self.dev.operations))
+
     def test_GetDeviceInfoBeforeOpenSession(self):
         request = command_message(self.new_transaction(), OperationDataCodes.GetDeviceInfo, [])
         response = response_message(request)
@@ -635,6 +718,118 @@ class MtpDeviceTests(BaseTestCase):
         self.logger.debug('data: %s' % hexlify(data))
         self.assertEqual(data[12:], unhexlify('44dcffff00000000000000'))
 
+    def test_GetObjectPropDescCached(self):
+        self.successful_open_session()
+        first = command_message(self.new_transaction(), OperationDataCodes.GetObjectPropDesc, [MtpObjectPropertyCode.Name, 0x3009])
+        first_data = self.dev.GetObjectPropDesc(first, response_message(first), None)
+        self.assertIn((MtpObjectPropertyCode.Name, 0x3009), self.dev.prop_desc_cache)
+        second = command_message(self.new_transaction(), OperationDataCodes.GetObjectPropDesc, [MtpObjectPropertyCode.Name, 0x3009])
+        response = response_message(second)
+        second_data = self.dev.GetObjectPropDesc(second, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+        self.assertEqual(second_data[12:], first_data[12:])
+        self.assertEqual(second_data[8:12], pack('<I', second.tid))
+
+    def test_GetObjectPropsSupportedCached(self):
+        self.successful_open_session()
+        self.dev.max_cached_payloads = 2
+        for fmt in [0x3000, 0x3001, 0x3000, 0x3002]:
+            request = command_message(self.new_transaction(), OperationDataCodes.GetObjectPropsSupported, [fmt])
+            response = response_message(request)
+            data = self.dev.GetObjectPropsSupported(request, response, None)
+            self.assertEqual(response.code, ResponseCodes.OK)
+            self.assertEqual(data[12:16], pack('<I', len(MtpObject.props_descs)))
+        self.assertLessEqual(len(self.dev.props_supported_cache), 2)
+
+    def get_prop_list(self, params, expected_response=ResponseCodes.OK):
+        request = command_message(self.new_transaction(), OperationDataCodes.GetObjectPropList, params)
+        response = response_message(request)
+        data = self.dev.GetObjectPropList(request, response, None)
+        self.assertEqual(response.code, expected_response)
+        if data is None:
+            return None
+        data = data.pack()
+        self.assertEqual(unpack_from('<I', data, 0)[0], len(data))
+        return data[12:]
+
+    def parse_format_prop_list(self, data):
+        count = unpack_from('<I', data, 0)[0]
+        self.assertEqual(len(data), 4 + count * 10)
+        return [unpack_from('<IHHH', data, 4 + i * 10) for i in range(count)]
+
+    def test_GetObjectPropListSingleObject(self):
+        self.successful_open_session()
+        handle = self.object.get_uid()
+        data = self.get_prop_list([handle, 0, MtpObjectPropertyCode.ObjectFileName, 0, 0])
+        filename = self.object.info.get_field('filename')
+        self.assertEqual(data, pack('<IIHH', 1, handle, MtpObjectPropertyCode.ObjectFileName, 0xffff) + self.object.get_property_value(MtpObjectPropertyCode.ObjectFileName))
+        self.assertEqual(data[13:], (filename + '\x00').encode('utf-16le'))
+
+    def test_GetObjectPropListAllProperties(self):
+        self.successful_open_session()
+        handle = self.object.get_uid()
+        data = self.get_prop_list([handle, 0, 0xffffffff, 0, 0])
+        self.assertEqual(unpack_from('<I', data, 0)[0], len(MtpObject.props_descs))
+
+    def test_GetObjectPropListAllObjects(self):
+        self.successful_open_session()
+        data = self.get_prop_list([0xffffffff, 0, MtpObjectPropertyCode.ObjectFormat, 0, 0])
+        elements = self.parse_format_prop_list(data)
+        self.assertEqual(set(e[0] for e in elements), set(self.dev.handles.keys()))
+        for (handle, code, dtype, fmt) in elements:
+            self.assertEqual(code, MtpObjectPropertyCode.ObjectFormat)
+            self.assertEqual(dtype, 0x0004)
+            self.assertEqual(fmt, self.dev.handles[handle].get_format())
+
+    def test_GetObjectPropListChildren(self):
+        self.successful_open_session()
+        data = self.get_prop_list([self.object.get_uid(), 0, MtpObjectPropertyCode.ObjectFormat, 0, 1])
+        handles = [e[0] for e in self.parse_format_prop_list(data)]
+        self.assertEqual(handles, [obj.get_uid() for obj in self.object.objects])
+        data = self.get_prop_list([0, 0, MtpObjectPropertyCode.ObjectFormat, 0, 1])
+        handles = [e[0] for e in self.parse_format_prop_list(data)]
+        self.assertEqual(handles, [self.object.get_uid()])
+
+    def test_GetObjectPropListSubtreeByFormat(self):
+        self.successful_open_session()
+        data = self.get_prop_list([self.object.get_uid(), Formats.Association, MtpObjectPropertyCode.ObjectFormat, 0, 0xffffffff])
+        handles = set(e[0] for e in self.parse_format_prop_list(data))
+        expected = set(obj.get_uid() for obj in self.object.get_objects() if obj.format_matches(Formats.Association))
+        self.assertEqual(handles, expected)
+        self.assertNotIn(self.object.get_uid(), handles)
+
+    def test_GetObjectPropListByGroup(self):
+        self.successful_open_session()
+        data = self.get_prop_list([self.object.get_uid(), 0, 0, 0, 0])
+        self.assertEqual(unpack_from('<I', data, 0)[0], len(MtpObject.props_descs))
+        data = self.get_prop_list([self.object.get_uid(), 0, 0, 5, 0])
+        self.assertEqual(data, pack('<I', 0))
+
+    def test_GetObjectPropListMatchesPropValues(self):
+        self.successful_open_session()
+        self.object.objects[0].info.set_field('keywords', u'some keywords')
+        data = self.get_prop_list([self.object.get_uid(), 0, 0xffffffff, 0, 0xffffffff])
+        expected = b''
+        count = 0
+        for obj in self.object.get_objects():
+            for code in MtpObject.get_supported_props(0):
+                dtype = MtpObject.get_obj_prop_desc(code, 0).dtype.value
+                expected += pack('<IHH', obj.get_uid(), code, dtype) + obj.get_property_value(code)
+                count += 1
+        self.assertEqual(data, pack('<I', count) + expected)
+
+    def test_GetObjectPropListUnsupportedDepth(self):
+        self.successful_open_session()
+        self.get_prop_list([self.object.get_uid(), 0, 0xffffffff, 0, 2], ResponseCodes.SPECIFICATION_BY_DEPTH_UNSUPPORTED)
+
+    def test_GetObjectPropListUnsupportedProperty(self):
+        self.successful_open_session()
+        self.get_prop_list([self.object.get_uid(), 0, 0xdcff, 0, 0], ResponseCodes.OBJECT_PROP_NOT_SUPPORTED)
+
+    def test_GetObjectPropListInvalidHandle(self):
+        self.successful_open_session()
+        self.get_prop_list([0x7fffffff, 0, 0xffffffff, 0, 0], ResponseCodes.INVALID_OBJECT_HANDLE)
+
     def test_GetObjectPropDescWithoutParams(self):
         self.successful_open_session()
         request = command_message(self.new_transaction(), OperationDataCodes.GetObjectPropDesc, [])
@@ -669,3 +864,101 @@ class MtpDeviceTests(BaseTestCase):
         data = self.dev.GetObjectPropValue(request, response, None)
         self.assertEqual(response.code, ResponseCodes.OK)
         self.logger.debug('data: %s' % hexlify(data))
+
+    def test_GetObjectInfoAfterDeleteObject(self):
+        self.successful_open_session()
+        handle = self.object.objects[0].get_uid()
+
+        request = command_message(self.new_transaction(), OperationDataCodes.DeleteObject, [handle])
+        response = response_message(request)
+        self.dev.DeleteObject(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+
+        request = command_message(self.new_transaction(), OperationDataCodes.GetObjectInfo, [handle])
+        response = response_message(request)
+        self.dev.GetObjectInfo(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.INVALID_OBJECT_HANDLE)
+
+    def test_GetObjectInfoOfObjectAddedAfterStorage(self):
+        self.successful_open_session()
+        new_obj = MtpObject.from_file('.')
+        self.object.add_object(new_obj)
+
+        request = command_message(self.new_transaction(), OperationDataCodes.GetObjectInfo, [new_obj.get_uid()])
+        response = response_message(request)
+        self.dev.GetObjectInfo(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+
+    def test_MoveObjectToStorageRoot(self):
+        self.successful_open_session()
+        obj = self.object.objects[0]
+
+        request = command_message(self.new_transaction(), OperationDataCodes.MoveObject, [obj.get_uid(), self.storage.get_uid(), 0])
+        response = response_message(request)
+        self.dev.MoveObject(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+        self.assertIsNone(obj.parent)
+        self.assertIn(obj, self.storage.objects)
+        self.assertNotIn(obj, self.object.objects)
+        self.assertEqual(self.dev.get_object(obj.get_uid()), obj)
+
+    def test_MoveObjectInvalidParent(self):
+        self.successful_open_session()
+        obj = self.object.objects[0]
+
+        request = command_message(self.new_transaction(), OperationDataCodes.MoveObject, [obj.get_uid(), self.storage.get_uid(), 0xfffffffe])
+        response = response_message(request)
+        self.dev.MoveObject(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.INVALID_PARENT_OBJECT)
+        self.assertIn(obj, self.object.objects)
+
+    def test_GetObjectHandlesWithAssociation(self):
+        self.successful_open_session()
+
+        request = command_message(self.new_transaction(), OperationDataCodes.GetObjectHandles, [self.storage.get_uid(), 0, self.object.get_uid()])
+        response = response_message(request)
+        data = self.dev.GetObjectHandles(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+        handles = [obj.get_uid() for obj in self.object.objects]
+        self.assertEqual(data[12:], pack('<I', len(handles)) + b''.join(pack('<I', h) for h in handles))
+
+    def test_GetObjectHandlesRootAssociation(self):
+        self.successful_open_session()
+
+        request = command_message(self.new_transaction(), OperationDataCodes.GetObjectHandles, [self.storage.get_uid(), 0, 0xffffffff])
+        response = response_message(request)
+        data = self.dev.GetObjectHandles(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+        self.assertEqual(data[12:], pack('<II', 1, self.object.get_uid()))
+
+    def test_GetNumObjectsWithAssociation(self):
+        self.successful_open_session()
+
+        request = command_message(self.new_transaction(), OperationDataCodes.GetNumObjects, [self.storage.get_uid(), 0, self.object.get_uid()])
+        response = response_message(request)
+        data = self.dev.GetNumObjects(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+        self.assertEqual(data[12:], pack('<I', len(self.object.objects)))
+
+    def test_GetNumObjectsAllObjects(self):
+        self.successful_open_session()
+
+        request = command_message(self.new_transaction(), OperationDataCodes.GetNumObjects, [0xffffffff])
+        response = response_message(request)
+        data = self.dev.GetNumObjects(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+        self.assertEqual(data[12:], pack('<I', len(self.object.get_objects()) + 1))
+
+    def test_GetPartialObjectAfterOpenSession(self):
+        self.successful_open_session()
+        obj = MtpObject.from_file('runner.py')
+        self.object.add_object(obj)
+        with open('runner.py', 'rb') as f:
+            content = f.read()
+
+        request = command_message(self.new_transaction(), OperationDataCodes.GetPartialObject, [obj.get_uid(), 10, 20])
+        response = response_message(request)
+        data = self.dev.GetPartialObject(request, response, None)
+        self.assertEqual(response.code, ResponseCodes.OK)
+        self.assertEqual(data[12:], content[10:30])
+        self.assertEqual(response.params, [20])
@@ -0,0 +1,214 @@
+import os
+import shutil
+import tempfile
+from common import BaseTestCase
+import unittest
+from mtpdevice import mtp_fs
+from mtpdevice.mtp_fs import MtpFsImporter, MtpFsSync, MtpInotifyWatcher
+from mtpdevice.mtp_object import MtpObject, Formats
+from mtpdevice.mtp_storage import MtpStorage, MtpStorageInfo
+
+
+def has_inotify():
+    try:
+        MtpInotifyWatcher().close()
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+class FsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(FsTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.write('b.png', b'png')
+        self.write(os.path.join('a', 'y.txt'), b'text')
+        self.write(os.path.join('a', 'x.mp3'), b'\x00' * 10)
+        self.write(os.path.join('a', 'c', 'z.wma'), b'')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(FsTestCase, self).tearDown()
+
+    def write(self, relpath, content):
+        path = os.path.join(self.root, relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(content)
+
+
+
+class MtpFsImporterTests(FsTestCase):
+
+    def tree(self, obj):
+        return (obj.info.get_field('filename'), obj.get_format(), [self.tree(o) for o in obj.objects])
+
+    def testImportTree(self):
+        uut = MtpFsImporter()
+        obj = uut.import_tree(self.root)
+        name = os.path.basename(self.root)
+        self.assertEqual(self.tree(obj), (name, Formats.Association, [
+            ('a', Formats.Association, [
+                ('c', Formats.Association, [('z.wma', Formats.WMA, [])]),
+                ('x.mp3', Formats.MP3, []),
+                ('y.txt', Formats.Undefined, []),
+            ]),
+            ('b.png', Formats.PNG, []),
+        ]))
+        self.assertEqual(set(uut.timings.keys()), set(['scan', 'build', 'total']))
+
+    def testImportedObjects(self):
+        obj = MtpFsImporter().import_tree(self.root)
+        mp3 = obj.objects[0].objects[1]
+        self.assertEqual(mp3.real_path, os.path.join(self.root, 'a', 'x.mp3'))
+        self.assertEqual(mp3.info.get_field('compressed_size'), 10)
+        self.assertEqual(mp3.get_data(), b'\x00' * 10)
+        self.assertEqual(mp3.parent, obj.objects[0])
+
+    def testParallelImportIsDeterministic(self):
+        serial = MtpFsImporter().import_tree(self.root)
+        parallel = MtpFsImporter(workers=4).import_tree(self.root)
+        self.assertEqual(self.tree(parallel), self.tree(serial))
+        serial_uids = [o.get_uid() - serial.get_uid() for o in serial.get_objects()]
+        parallel_uids = [o.get_uid() - parallel.get_uid() for o in parallel.get_objects()]
+        self.assertEqual(parallel_uids, serial_uids)
+
+    def testImportSingleFile(self):
+        obj = MtpObject.from_fs_recursive(os.path.join(self.root, 'b.png'))
+        self.assertEqual(self.tree(obj), ('b.png', Formats.PNG, []))
+
+    def testImportTimingsFromFsRecursive(self):
+        timings = {}
+        obj = MtpObject.from_fs_recursive(self.root, workers=2, timings=timings)
+        self.assertEqual(len(obj.get_objects()), 6)
+        self.assertEqual(set(timings.keys()), set(['scan', 'build', 'total']))
+        self.assertTrue(all(value >= 0 for value in timings.values()))
+
+    def testImportMissingPath(self):
+        with self.assertRaises(Exception):
+            MtpFsImporter().import_tree(os.path.join(self.root, 'missing'))
+
+
+class MtpFsSyncTests(FsTestCase):
+
+    def setUp(self):
+        super(MtpFsSyncTests, self).setUp()
+        self.storage = MtpStorage(MtpStorageInfo(0, 0, 0, 0, 0, 0, 'desc', 'vol'))
+        self.obj = MtpObject.from_fs_recursive(self.root)
+        self.storage.add_object(self.obj)
+        self.handles = dict((o.real_path, o.get_uid()) for o in self.obj.get_objects())
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def current_handles(self):
+        return dict((o.real_path, o.get_uid()) for o in self.obj.get_objects())
+
+    def testSyncNoChanges(self):
+        counts = MtpFsSync(self.obj).sync()
+        self.assertEqual(counts, {'added': 0, 'removed': 0, 'updated': 0})
+        self.assertEqual(self.current_handles(), self.handles)
+
+    def testSyncAddedFiles(self):
+        self.write(os.path.join('a', 'new.mp3'), b'new')
+        self.write(os.path.join('d', 'e.png'), b'')
+        counts = MtpFsSync(self.obj).sync()
+        self.assertEqual(counts['added'], 3)
+        handles = self.current_handles()
+        for path, handle in self.handles.items():
+            self.assertEqual(handles[path], handle)
+        new = self.storage.get_object(handles[self.path('a', 'new.mp3')])
+        self.assertEqual(new.parent.real_path, self.path('a'))
+        self.assertEqual(new.get_data(), b'new')
+
+    def testSyncRemovedFiles(self):
+        removed = self.handles[self.path('a', 'c')]
+        shutil.rmtree(self.path('a', 'c'))
+        os.remove(self.path('b.png'))
+        counts = MtpFsSync(self.obj).sync()
+        self.assertEqual(counts['removed'], 3)
+        self.assertIsNone(self.storage.get_object(removed))
+        self.assertEqual(len(self.current_handles()), len(self.handles) - 3)
+
+    def testSyncModifiedFile(self):
+        self.write(os.path.join('a', 'x.mp3'), b'\x01' * 20)
+        counts = MtpFsSync(self.obj).sync()
+        self.assertEqual(counts, {'added': 0, 'removed': 0, 'updated': 1})
+        self.assertEqual(self.current_handles(), self.handles)
+        obj = self.storage.get_object(self.handles[self.path('a', 'x.mp3')])
+        self.assertEqual(obj.info.get_field('compressed_size'), 20)
+        self.assertEqual(obj.get_data(), b'\x01' * 20)
+
+    def testSyncReplacedByDirectory(self):
+        os.remove(self.path('b.png'))
+        self.write(os.path.join('b.png', 'f.mp3'), b'')
+        counts = MtpFsSync(self.obj).sync()
+        self.assertEqual(counts, {'added': 2, 'removed': 1, 'updated': 0})
+        handles = self.current_handles()
+        self.assertNotEqual(handles[self.path('b.png')], self.handles[self.path('b.png')])
+        self.assertEqual(self.storage.get_object(handles[self.path('b.png')]).get_format(), Formats.Association)
+
+    def testSyncKeepsSentObjects(self):
+        spool = tempfile.mkdtemp()
+        try:
+            self.storage.root = spool
+            parent = self.storage.get_object(self.handles[self.path('a')])
+            obj = MtpObject.from_file(self.path('b.png'))
+            obj.real_path = None
+            parent.add_object(obj)
+            # like SendObject, the data is spooled to a file in the storage root
+            obj.info.set_field('compressed_size', 4)
+            sink = self.storage.new_data_sink(obj)
+            sink.write(b'sent')
+            obj.set_data(sink.close())
+            obj.real_path = sink.path
+            counts = MtpFsSync(self.obj).sync()
+            self.assertEqual(counts, {'added': 0, 'removed': 0, 'updated': 0})
+            self.assertIs(self.storage.get_object(obj.get_uid()), obj)
+            self.assertEqual(obj.get_data(), b'sent')
+        finally:
+            shutil.rmtree(spool)
+
+    @unittest.skipIf(not has_inotify(), 'inotify is not available')
+    def testSyncWithWatcher(self):
+        watcher = MtpInotifyWatcher()
+        try:
+            uut = MtpFsSync(self.obj, watcher)
+            self.assertEqual(uut.process_events(), {'added': 0, 'removed': 0, 'updated': 0})
+            self.write(os.path.join('a', 'c', 'new.wma'), b'')
+            os.remove(self.path('a', 'y.txt'))
+            counts = uut.process_events(timeout=1)
+            self.assertEqual(counts['added'], 1)
+            self.assertEqual(counts['removed'], 1)
+            self.assertIn(self.path('a', 'c', 'new.wma'), self.current_handles())
+        finally:
+            watcher.close()
+
+    @unittest.skipIf(not has_inotify(), 'inotify is not available')
+    def testSyncWatchesNewDirectoryBeforeListingIt(self):
+        watcher = MtpInotifyWatcher()
+        scandir = mtp_fs._scandir
+
+        def scandir_then_create(path):
+            entries = scandir(path)
+            if path == self.path('d'):
+                # created right after the new directory was listed
+                self.write(os.path.join('d', 'late.mp3'), b'')
+            return entries
+
+        try:
+            uut = MtpFsSync(self.obj, watcher)
+            self.write(os.path.join('d', 'e.png'), b'')
+            mtp_fs._scandir = scandir_then_create
+            try:
+                counts = uut.process_events(timeout=1)
+            finally:
+                mtp_fs._scandir = scandir
+            self.assertEqual(counts['added'], 2)
+            counts = uut.process_events(timeout=1)
+            self.assertEqual(counts['added'], 1)
+            self.assertIn(self.path('d', 'late.mp3'), self.current_handles())
+        finally:
+            watcher.close()
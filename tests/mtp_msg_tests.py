@@ -1,9 +1,9 @@
 from common import BaseTestCase
 from struct import pack
 from binascii import unhexlify
-from mtpdevice.mtp_proto import ContainerTypes, ResponseCodes
+from mtpdevice.mtp_proto import ContainerTypes, ResponseCodes, MtpDataPhase
 from mtpdevice.mtp_exception import MtpProtocolException
-from mtpdevice.mtp_msg import msg_from_buff
+from mtpdevice.mtp_msg import msg_from_buff, MtpParametersMessage, MtpResponsePool, response_from_command
 
 
 class CommandMessageTest(BaseTestCase):
@@ -37,6 +37,27 @@ class CommandMessageTest(BaseTestCase):
     def testCorrectValuesFromBufferMultipleParams(self):
         self.vanillaTest(1, 2, [0x01020304, 0x11121314, 0x21222324, 0x31323334, 0x41424344])
 
+    def testPackRoundTrip(self):
+        params = [0x01020304, 0x11121314, 0x21222324]
+        buff = self.buildVanillabuffer(0x1007, 7, params)
+        self.assertEqual(msg_from_buff(buff).pack(), buff)
+
+    def testPackAfterAddParam(self):
+        response = response_from_command(msg_from_buff(self.buildVanillabuffer(1, 2, [])), ResponseCodes.OK)
+        response.add_param(0x12345678)
+        self.assertEqual(response.pack(), pack('<IHHII', 0x10, ContainerTypes.Response, ResponseCodes.OK, 2, 0x12345678))
+        self.assertEqual(response.length, 0x10)
+
+    def testResponsePoolReuse(self):
+        uut = MtpResponsePool()
+        first = uut.get(msg_from_buff(self.buildVanillabuffer(1, 2, [])), ResponseCodes.OK)
+        first.add_param(5)
+        first.pack()
+        uut.put(first)
+        second = uut.get(msg_from_buff(self.buildVanillabuffer(1, 3, [])), ResponseCodes.GENERAL_ERROR)
+        self.assertIs(second, first)
+        self.assertEqual(second.pack(), pack('<IHHI', 0xc, ContainerTypes.Response, ResponseCodes.GENERAL_ERROR, 3))
+
     def invalidBufferTest(self, buff, expected_response=ResponseCodes.INVALID_CODE_FORMAT):
         with self.assertRaises(MtpProtocolException) as cm:
             msg_from_buff(buff)
@@ -66,3 +87,56 @@ class CommandMessageTest(BaseTestCase):
     def testInvalidRequestTooshort(self):
         buff = unhexlify('0800000001000100')
         self.invalidBufferTest(buff)
+
+
+class DataMessageTest(BaseTestCase):
+
+    def testAddDataReassembles(self):
+        data = b''.join(pack('<I', i) for i in range(1000))
+        buff = pack('<IHHI', len(data) + 0xc, ContainerTypes.Data, 0x100d, 2) + data[:100]
+        uut = msg_from_buff(buff, permissive=True)
+        self.assertFalse(uut.has_got_all_data())
+        for i in range(100, len(data), 512):
+            uut.add_data(data[i:i + 512])
+        self.assertTrue(uut.has_got_all_data())
+        self.assertEqual(uut.data, data)
+
+    def testAddDataTooMuch(self):
+        buff = pack('<IHHI', 0x10, ContainerTypes.Data, 0x100d, 2) + b'\x01\x02'
+        uut = msg_from_buff(buff, permissive=True)
+        with self.assertRaises(MtpProtocolException):
+            uut.add_data(b'\x03\x04\x05')
+
+
+class DataPhaseTest(BaseTestCase):
+
+    def setUp(self):
+        super(DataPhaseTest, self).setUp()
+        self.command = MtpParametersMessage(0xc, ContainerTypes.Command, 0x1009, 5, b'')
+        self.payload = b'0123456789' * 3
+        self.header = pack('<IHHI', len(self.payload) + 0xc, ContainerTypes.Data, 0x1009, 5)
+
+    def producer(self, chunk_size):
+        for offset in range(0, len(self.payload), chunk_size):
+            yield self.payload[offset:offset + chunk_size]
+
+    def testPackBuffer(self):
+        uut = MtpDataPhase(self.command, memoryview(self.payload))
+        self.assertEqual(len(uut), len(self.payload) + 0xc)
+        self.assertEqual(uut.pack(), self.header + self.payload)
+        self.assertEqual(uut[4:20], (self.header + self.payload)[4:20])
+
+    def testChunksBuffer(self):
+        uut = MtpDataPhase(self.command, self.payload)
+        chunks = [memoryview(c).tobytes() for c in uut.chunks(8)]
+        self.assertEqual(chunks[0], self.header)
+        self.assertEqual([len(c) for c in chunks[1:]], [8, 8, 8, 6])
+        self.assertEqual(b''.join(chunks), self.header + self.payload)
+
+    def testChunksStreamed(self):
+        uut = MtpDataPhase(self.command, self.producer, len(self.payload))
+        chunks = list(uut.chunks(8))
+        self.assertEqual(chunks[0], self.header)
+        self.assertEqual([len(c) for c in chunks[1:]], [8, 8, 8, 6])
+        self.assertEqual(uut.pack(), self.header + self.payload)
+        self.assertEqual(uut[12:20], self.payload[:8])
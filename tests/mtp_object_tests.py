@@ -2,10 +2,19 @@ from common import BaseTestCase
 from mtpdevice.mtp_storage import MtpStorage, MtpStorageInfo
 from mtpdevice.mtp_object import MtpObject, MtpObjectInfo, Formats
 from mtpdevice.mtp_proto import OperationDataCodes, ResponseCodes, AccessCaps, ContainerTypes
-from mtpdevice.mtp_property import MtpObjectPropertyCode
+from mtpdevice.mtp_property import MtpObjectPropertyCode, MtpObjectPropertyDesc
+from mtpdevice.mtp_data_types import UInt16
 from mtpdevice.mtp_exception import MtpProtocolException
+from mtpdevice.mtp_object_data import MtpFileData
+from mtpdevice.mtp_object_table import MtpObjectTable
 from struct import pack
 from binascii import unhexlify, hexlify
+import tempfile
+import unittest
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 
 class MtpObjectTests(BaseTestCase):
@@ -16,7 +25,7 @@ class MtpObjectTests(BaseTestCase):
         self.default_data = b'\x01\x02\x03\x04\x05\x06\x07\x08'
         self.default_format = Formats.MP3
 
-    def get_default_storage(self):
+    def get_default_storage(self, table=None):
         storage_info = MtpStorageInfo(
             st_type=0,
             fs_type=0,
@@ -27,7 +36,7 @@ class MtpObjectTests(BaseTestCase):
             desc='150MB Storage',
             vol_id='Test Storage',
         )
-        storage = MtpStorage(storage_info)
+        storage = MtpStorage(storage_info, table=table)
         return storage
 
     def get_default_info(self, **kwargs):
@@ -72,6 +81,66 @@ class MtpObjectTests(BaseTestCase):
         uut = MtpObject(self.default_data, info)
         self.assertEqual(uut.get_info(), info.pack())
 
+    def testGetInfoIsCached(self):
+        uut = MtpObject(self.default_data, self.get_default_info())
+        self.assertIs(uut.get_info(), uut.get_info())
+
+    def testGetInfoAfterSetParent(self):
+        uut = MtpObject(self.default_data, self.get_default_info())
+        parent = MtpObject(self.default_data, self.get_default_info())
+        packed = uut.get_info()
+        parent.add_object(uut)
+        self.assertNotEqual(uut.get_info(), packed)
+        self.assertEqual(uut.get_info()[38:42], pack('<I', parent.get_uid()))
+
+    def testGetInfoAfterSetData(self):
+        uut = MtpObject(self.default_data, self.get_default_info())
+        uut.get_info()
+        uut.set_data(b'\x00' * 50)
+        self.assertEqual(uut.get_info()[8:12], pack('<I', 50))
+
+    def testGetInfoAfterSetStorageAndProtection(self):
+        uut = MtpObject(self.default_data, self.get_default_info())
+        uut.get_info()
+        storage = self.get_default_storage()
+        storage.add_object(uut)
+        uut.set_protection_status(1)
+        self.assertEqual(uut.get_info()[0:4], pack('<I', storage.get_uid()))
+        self.assertEqual(uut.get_info()[6:8], pack('<H', 1))
+
+    def testGetInfoAfterSetValue(self):
+        uut = MtpObject(self.default_data, self.get_default_info())
+        uut.get_info()
+        prop = uut.get_property(MtpObjectPropertyCode.ObjectFormat)
+        prop.desc = MtpObjectPropertyDesc(MtpObjectPropertyCode.ObjectFormat, 1, UInt16(0), 0)
+        prop.set_value(pack('<H', Formats.WMA))
+        self.assertEqual(uut.get_info()[4:6], pack('<H', Formats.WMA))
+
+    def testPropertiesCreatedOnAccess(self):
+        uut = MtpObject(self.default_data, self.get_default_info())
+        uut.get_info()
+        self.assertNotIn('filename', vars(uut.info))
+        prop = uut.get_property(MtpObjectPropertyCode.ObjectFileName)
+        self.assertIs(vars(uut.info)['filename'], prop)
+        self.assertIs(uut.get_property(MtpObjectPropertyCode.ObjectFileName), prop)
+        self.assertEqual(prop.value.value, self.default_filename)
+        self.assertNotIn('keywords', vars(uut.info))
+
+    def testPropsMapping(self):
+        uut = MtpObject(self.default_data, self.get_default_info())
+        self.assertIn(MtpObjectPropertyCode.ObjectSize, uut.info.props)
+        self.assertEqual(len(uut.info.props), len(MtpObject.props_descs))
+        self.assertEqual(set(uut.info.props.keys()), set(MtpObject.props_descs.keys()))
+        self.assertEqual(uut.info.props[MtpObjectPropertyCode.ObjectSize].value.value, len(self.default_data))
+
+    def testSetFieldAfterPropertyCreated(self):
+        uut = MtpObject(self.default_data, self.get_default_info())
+        prop = uut.get_property(MtpObjectPropertyCode.ObjectSize)
+        uut.set_data(b'\x00' * 50)
+        self.assertEqual(prop.value.value, 50)
+        self.assertEqual(uut.info.get_field('compressed_size'), 50)
+        self.assertEqual(uut.get_info()[8:12], pack('<I', 50))
+
     def testGetObjectsEmpty(self):
         uut = MtpObject(self.default_data, self.get_default_info())
         self.assertEqual(uut.get_objects(), [])
@@ -214,6 +283,236 @@ class MtpObjectTests(BaseTestCase):
             uut.get_property(MtpObjectPropertyCode.StorageID - 1)
         self.assertEqual(cm.exception.response, ResponseCodes.OBJECT_PROP_NOT_SUPPORTED)
 
+    def testInfoFromBuffRoundTrip(self):
+        info = self.get_default_info(
+            storage=0x00010001, compressed_size=0x1234, parent_object=7,
+            ctime=1500000000, mtime=1500000100, keywords='some words'
+        )
+        buff = info.pack()
+        uut = MtpObjectInfo.from_buff(buff)
+        self.assertEqual(uut.pack(), buff)
+        self.assertEqual(uut.storage.value.value, 0x00010001)
+        self.assertEqual(uut.compressed_size.value.value, 0x1234)
+        self.assertEqual(uut.parent_object.value.value, 7)
+        self.assertEqual(uut.filename.value.value, self.default_filename)
+        self.assertEqual(uut.ctime.value.value, 1500000000)
+        self.assertEqual(uut.mtime.value.value, 1500000100)
+        self.assertEqual(uut.keywords.value.value, 'some words')
+
+    def testInfoFromBuffTruncated(self):
+        buff = self.get_default_info().pack()
+        with self.assertRaises(MtpProtocolException) as cm:
+            MtpObjectInfo.from_buff(buff[:60])
+        self.assertEqual(cm.exception.response, ResponseCodes.INVALID_DATASET)
+
+    def testInfoPackLargeSize(self):
+        info = self.get_default_info(compressed_size=0x100000000)
+        self.assertEqual(info.pack()[8:12], b'\xff\xff\xff\xff')
+        self.assertEqual(info.pack()[52:53], pack('B', len(self.default_filename) + 1))
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def testInfoMemoryFootprint(self):
+        def traced(eager):
+            tracemalloc.start()
+            try:
+                infos = [self.get_default_info(filename='file%d.mp3' % i) for i in range(1000)]
+                if eager:
+                    for info in infos:
+                        for name, desc, dtype in MtpObjectInfo.prop_fields:
+                            getattr(info, name)
+                return tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+        # the absolute size depends on the interpreter, the properties that are not created do not
+        self.assertLess(traced(eager=False) * 2, traced(eager=True))
+
+    def testStorageGetObjectsByFormat(self):
+        storage = self.get_default_storage()
+        mp3 = MtpObject(self.default_data, self.get_default_info(object_format=Formats.MP3))
+        png = MtpObject(self.default_data, self.get_default_info(object_format=Formats.PNG))
+        undefined = MtpObject(self.default_data, self.get_default_info(object_format=0))
+        for obj in [mp3, png, undefined]:
+            storage.add_object(obj)
+        self.assertEqual(set(storage.get_objects(Formats.MP3)), set([mp3, undefined]))
+        self.assertEqual(storage.num_objects(Formats.PNG), 2)
+        self.assertEqual(storage.num_objects(0xffffffff), 3)
+        self.assertEqual(storage.get_objects(Formats.WMA), [undefined])
+
+    def testStorageFormatIndexAfterDelete(self):
+        storage = self.get_default_storage()
+        uut = MtpObject(self.default_data, self.get_default_info(object_format=Formats.MP3))
+        storage.add_object(uut)
+        uut.delete(0xffffffff)
+        self.assertEqual(storage.get_objects(Formats.MP3), [])
+        self.assertEqual(storage.num_objects(Formats.MP3), 0)
+
+    def testStorageFormatIndexAfterSetFormat(self):
+        storage = self.get_default_storage()
+        uut = MtpObject(self.default_data, self.get_default_info(object_format=Formats.MP3))
+        storage.add_object(uut)
+        prop = uut.get_property(MtpObjectPropertyCode.ObjectFormat)
+        prop.desc = MtpObjectPropertyDesc(MtpObjectPropertyCode.ObjectFormat, 1, UInt16(0), 0)
+        prop.set_value(pack('<H', Formats.WMA))
+        self.assertEqual(storage.get_objects(Formats.MP3), [])
+        self.assertEqual(storage.get_objects(Formats.WMA), [uut])
+
+    def testTableGetObjectsByFormat(self):
+        storage = self.get_default_storage(MtpObjectTable())
+        mp3 = MtpObject(self.default_data, self.get_default_info(object_format=Formats.MP3))
+        png = MtpObject(self.default_data, self.get_default_info(object_format=Formats.PNG))
+        undefined = MtpObject(self.default_data, self.get_default_info(object_format=0))
+        for obj in [mp3, png, undefined]:
+            storage.add_object(obj)
+        self.assertEqual(set(storage.get_objects(Formats.MP3)), set([mp3, undefined]))
+        self.assertEqual(storage.num_objects(Formats.PNG), 2)
+        self.assertEqual(storage.num_objects(0xffffffff), 3)
+        self.assertEqual(storage.get_objects(Formats.WMA), [undefined])
+
+    def testTableGetObjectsByParent(self):
+        storage = self.get_default_storage(MtpObjectTable())
+        folder = MtpObject(self.default_data, self.get_default_info(object_format=Formats.Association))
+        other = MtpObject(self.default_data, self.get_default_info(object_format=Formats.Association))
+        child = MtpObject(self.default_data, self.get_default_info())
+        storage.add_object(folder)
+        storage.add_object(other)
+        folder.add_object(child)
+        self.assertEqual(set(storage.get_objects(parent=0)), set([folder, other]))
+        self.assertEqual(storage.get_objects(Formats.MP3, folder.get_uid()), [child])
+        other.objects.append(child)
+        folder.objects.remove(child)
+        child.set_parent(other)
+        self.assertEqual(storage.num_objects(parent=folder.get_uid()), 0)
+        self.assertEqual(storage.get_objects(parent=other.get_uid()), [child])
+
+    def testNumObjectsMatchesGetObjects(self):
+        for table in [None, MtpObjectTable()]:
+            storage = self.get_default_storage(table)
+            folder = MtpObject(self.default_data, self.get_default_info(object_format=Formats.Association))
+            storage.add_object(folder)
+            children = [MtpObject(self.default_data, self.get_default_info(object_format=fmt)) for fmt in [Formats.MP3, Formats.PNG, 0]]
+            for child in children:
+                folder.add_object(child)
+            # a removed row of the root is not counted as a child of the root
+            removed = MtpObject(self.default_data, self.get_default_info())
+            storage.add_object(removed)
+            removed.delete(0xffffffff)
+            for parent in [None, 0, folder.get_uid()]:
+                for fmt in [None, 0xffffffff, Formats.MP3, Formats.WMA]:
+                    self.assertEqual(storage.num_objects(fmt, parent), len(storage.get_objects(fmt, parent)))
+
+    def testTableRowFollowsObject(self):
+        table = MtpObjectTable()
+        storage = self.get_default_storage(table)
+        uut = MtpObject(self.default_data, self.get_default_info(keywords='a b'))
+        storage.add_object(uut)
+        uut.set_data(b'\x00' * 50)
+        uut.set_protection_status(1)
+        row = table.row(uut.get_uid())
+        self.assertEqual(row.storage, storage.get_uid())
+        self.assertEqual(row.object_format, self.default_format)
+        self.assertEqual(row.compressed_size, 50)
+        self.assertEqual(row.protection, 1)
+        self.assertEqual(row.filename, self.default_filename)
+        self.assertEqual(row.keywords, 'a b')
+
+    def testTableReusesRemovedRows(self):
+        table = MtpObjectTable()
+        storage = self.get_default_storage(table)
+        first = MtpObject(self.default_data, self.get_default_info())
+        storage.add_object(first)
+        first.delete(0xffffffff)
+        self.assertIsNone(table.row(first.get_uid()))
+        self.assertEqual(storage.get_objects(), [])
+        second = MtpObject(self.default_data, self.get_default_info())
+        storage.add_object(second)
+        self.assertEqual(len(table.handle), 1)
+        self.assertEqual(storage.get_objects(), [second])
+
+    def testTableReleasesStrings(self):
+        table = MtpObjectTable()
+        storage = self.get_default_storage(table)
+        first = MtpObject(self.default_data, self.get_default_info(keywords='a b'))
+        second = MtpObject(self.default_data, self.get_default_info(keywords='a b'))
+        storage.add_object(first)
+        storage.add_object(second)
+        first.info.set_field('filename', 'renamed')
+        storage.property_changed(first, MtpObjectPropertyCode.ObjectFileName, self.default_filename)
+        self.assertIn(self.default_filename, table.string_ids)
+        second.delete(0xffffffff)
+        self.assertNotIn(self.default_filename, table.string_ids)
+        self.assertEqual(table.row(first.get_uid()).keywords, 'a b')
+        first.delete(0xffffffff)
+        self.assertEqual(table.string_ids, {'': 0})
+        # ids of freed strings are reused
+        third = MtpObject(self.default_data, self.get_default_info(keywords='c'))
+        storage.add_object(third)
+        self.assertEqual(len(table.strings), 4)
+        self.assertEqual(table.row(third.get_uid()).keywords, 'c')
+
+    def testTableListsChildrenFromTheParent(self):
+        table = MtpObjectTable()
+        storage = self.get_default_storage(table)
+        folder = MtpObject(self.default_data, self.get_default_info(object_format=Formats.Association))
+        storage.add_object(folder)
+        child = MtpObject(self.default_data, self.get_default_info())
+        folder.add_object(child)
+
+        def fail(*args):
+            raise AssertionError('children are listed by a scan of the table')
+        table.find = table.count = fail
+        self.assertEqual(storage.get_objects(parent=folder.get_uid()), [child])
+        self.assertEqual(storage.num_objects(Formats.MP3, folder.get_uid()), 1)
+        self.assertEqual(storage.get_objects(parent=0), [folder])
+
+    def testFromFileReadsDataOnDemand(self):
+        content = b'0123456789' * 10
+        with tempfile.NamedTemporaryFile(suffix='.mp3') as f:
+            f.write(content)
+            f.flush()
+            uut = MtpObject.from_file(f.name)
+            self.assertIsInstance(uut.data, MtpFileData)
+            self.assertEqual(uut.info.compressed_size.value.value, len(content))
+            self.assertEqual(uut.get_data(), content)
+            self.assertEqual(uut.get_data(95, 10), content[95:])
+
+    def testFromFileDataView(self):
+        content = bytes(bytearray(i & 0xff for i in range(10000)))
+        with tempfile.NamedTemporaryFile(suffix='.mp3') as f:
+            f.write(content)
+            f.flush()
+            uut = MtpObject.from_file(f.name)
+            view = uut.get_data_view(5000, 20)
+            self.assertIsInstance(view, memoryview)
+            self.assertEqual(view.tobytes(), content[5000:5020])
+            self.assertEqual(uut.get_data_view(9990).tobytes(), content[9990:])
+            self.assertEqual(len(uut.get_data_view(20000)), 0)
+
+    def testGetDataPayload(self):
+        content = bytes(bytearray(i & 0xff for i in range(10000)))
+        with tempfile.NamedTemporaryFile(suffix='.mp3') as f:
+            f.write(content)
+            f.flush()
+            uut = MtpObject.from_file(f.name)
+            payload, length = uut.get_data_payload(5000, 3000)
+            self.assertEqual(length, 3000)
+            if callable(payload):
+                # python 2 can't map files
+                payload = b''.join(payload(0x800))
+            self.assertEqual(memoryview(payload).tobytes(), content[5000:8000])
+            # a file that can't be mapped is read in chunks
+            uut.data.map = lambda offset=0, size=None: None
+            payload, length = uut.get_data_payload(5000, 6000)
+            self.assertEqual(length, 5000)
+            chunks = list(payload(0x800))
+            self.assertEqual([len(chunk) for chunk in chunks], [0x800, 0x800, 5000 - 0x1000])
+            self.assertEqual(b''.join(chunks), content[5000:])
+        payload, length = MtpObject(self.default_data, self.get_default_info()).get_data_payload(2)
+        self.assertEqual((memoryview(payload).tobytes(), length), (self.default_data[2:], 6))
+
+    def testGetDataPartial(self):
+        uut = MtpObject(self.default_data, self.get_default_info())
+        self.assertEqual(uut.get_data(2, 3), self.default_data[2:5])
+
     # copy
     # set_protection_status
     # delete_self
@@ -1,8 +1,11 @@
 # from struct import pack, unpack
 from binascii import unhexlify
+from struct import calcsize
+import sys
 from common import BaseTestCase
 from mtpdevice.mtp_property import MtpDeviceProperty, MtpDevicePropertyCode
-from mtpdevice.mtp_data_types import UInt8, UInt16, UInt32
+from mtpdevice.mtp_property import MtpObjectProperty, MtpObjectPropertyDescriptions
+from mtpdevice.mtp_data_types import UInt8, UInt16, UInt32, UInt128, MArray, MStr, MDateTime
 
 
 class MtpDevicePropertyTest(BaseTestCase):
@@ -36,3 +39,24 @@ class MtpDevicePropertyTest(BaseTestCase):
         expected = unhexlify('44332211')
         uut = MtpDeviceProperty(MtpDevicePropertyCode.BatteryLevel, 0, UInt32(0x11223344), UInt32(0x55667788))
         self.assertEqual(uut.get_value(), expected)
+
+
+class MtpObjectPropertyTest(BaseTestCase):
+
+    def testDataTypesHaveNoDict(self):
+        for value in [UInt8(1), UInt128(1), MArray(UInt16, [1, 2]), MStr('a'), MDateTime(0)]:
+            self.assertFalse(hasattr(value, '__dict__'))
+
+    def testPropertyHasNoDict(self):
+        uut = MtpObjectProperty(MtpObjectPropertyDescriptions.ObjectFileName, MStr('a'))
+        self.assertFalse(hasattr(uut, '__dict__'))
+        self.assertEqual(uut.pack(), MStr('a').pack())
+
+    def testMemoryPerObject(self):
+        # the types that every object has a few of, without a __dict__ each costs
+        # the object header and a pointer per slot
+        pointer = calcsize('P')
+        for value in [UInt8(1), UInt32(1), UInt128(1 << 100), MStr('a'), MDateTime(0)]:
+            self.assertLessEqual(sys.getsizeof(value), 12 * pointer)
+        uut = MtpObjectProperty(MtpObjectPropertyDescriptions.ObjectFileName, MStr('a'))
+        self.assertLessEqual(sys.getsizeof(uut), 10 * pointer)
@@ -0,0 +1,207 @@
+import errno
+import os
+import socket
+import tempfile
+from struct import pack
+from common import BaseTestCase
+from mtpdevice.mtp_api import MtpApi
+from mtpdevice.mtp_device import MtpDevice, MtpDeviceInfo
+from mtpdevice.mtp_object import MtpObject
+from mtpdevice.mtp_proto import ContainerTypes, OperationDataCodes, ResponseCodes
+from mtpdevice.mtp_storage import MtpStorage, MtpStorageInfo
+from mtpdevice import mtp_transport
+from mtpdevice.mtp_transport import MtpTransport, MtpStreamEndpoint, MtpFunctionFsEndpoint
+
+
+class MtpStreamEndpointTests(BaseTestCase):
+
+    def setUp(self):
+        super(MtpStreamEndpointTests, self).setUp()
+        read_fd, write_fd = os.pipe()
+        self.reader = MtpStreamEndpoint(read_fd=read_fd)
+        self.writer = MtpStreamEndpoint(write_fd=write_fd)
+
+    def tearDown(self):
+        self.reader.close()
+        if self.writer.write_fd is not None:
+            self.writer.close()
+        super(MtpStreamEndpointTests, self).tearDown()
+
+    def testTransferBoundaries(self):
+        self.writer.writev([b'abc', memoryview(b'defg')])
+        self.writer.write(b'')
+        self.writer.write(b'h')
+        self.assertEqual(self.reader.read(100), b'abcdefg')
+        self.assertEqual(self.reader.read(100), b'')
+        self.assertEqual(self.reader.read(100), b'h')
+
+    def testLongTransfer(self):
+        self.writer.write(b'x' * 100)
+        self.assertEqual([len(self.reader.read(40)) for _ in range(3)], [40, 40, 20])
+
+    def testClosed(self):
+        self.writer.close()
+        self.writer.write_fd = None
+        self.assertIsNone(self.reader.read(100))
+
+
+class MtpFunctionFsEndpointTests(BaseTestCase):
+
+    def setUp(self):
+        super(MtpFunctionFsEndpointTests, self).setUp()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.uut = MtpFunctionFsEndpoint(self.path)
+        self.writev = mtp_transport._writev
+        self.sizes = []
+
+        def short_writev(fd, buffers):
+            # write at most 5 bytes at a time, like an endpoint that takes part of a transfer
+            data = b''.join(memoryview(buff).tobytes() for buff in buffers)[:5]
+            self.sizes.append(len(data))
+            return os.write(fd, data)
+        mtp_transport._writev = short_writev
+
+    def tearDown(self):
+        mtp_transport._writev = self.writev
+        self.uut.close()
+        os.remove(self.path)
+        super(MtpFunctionFsEndpointTests, self).tearDown()
+
+    def content(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def testShortWrites(self):
+        self.uut.write(b'0123456789ab')
+        self.assertEqual(self.content(), b'0123456789ab')
+        self.assertEqual(self.sizes, [5, 5, 2])
+
+    def testShortWritesAcrossBuffers(self):
+        self.uut.writev([b'abc', memoryview(b'defghij'), b'', b'klmnopq'])
+        self.assertEqual(self.content(), b'abcdefghijklmnopq')
+
+
+class FailingEndpoint(object):
+
+    def __init__(self, err):
+        self.err = err
+
+    def read(self, size):
+        raise OSError(self.err, os.strerror(self.err))
+
+
+class MtpTransportTests(BaseTestCase):
+
+    def setUp(self):
+        super(MtpTransportTests, self).setUp()
+        self.storage = MtpStorage(MtpStorageInfo(0, 0, 0, 0, 0, 0, 'desc', 'vol'))
+        info = MtpDeviceInfo(0x0102, 0, 0, '', 0, [], [], 'manufacturer', 'model', '1.0', '0123')
+        self.dev = MtpDevice(info, logger=self.logger)
+        self.dev.add_storage(self.storage)
+        self.files = []
+        # the host side of the loopback, bulk-out and bulk-in over a socket pair
+        device_sock, host_sock = socket.socketpair()
+        self.socks = [device_sock, host_sock]
+        self.host = MtpStreamEndpoint(host_sock.fileno(), host_sock.fileno())
+        device = MtpStreamEndpoint(device_sock.fileno(), device_sock.fileno())
+        read_fd, write_fd = os.pipe()
+        self.host_interrupt = MtpStreamEndpoint(read_fd=read_fd)
+        self.interrupt = MtpStreamEndpoint(write_fd=write_fd)
+        self.uut = MtpTransport(MtpApi(self.dev), device, device, self.interrupt, max_packet=64, max_write=256)
+
+    def tearDown(self):
+        for sock in self.socks:
+            sock.close()
+        self.host_interrupt.close()
+        self.interrupt.close()
+        for path in self.files:
+            os.remove(path)
+        super(MtpTransportTests, self).tearDown()
+
+    def add_file(self, size):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, bytes(bytearray(i % 251 for i in range(size))))
+        os.close(fd)
+        self.files.append(path)
+        obj = MtpObject.from_file(path)
+        self.storage.add_object(obj)
+        return obj
+
+    def transact(self, code, tid, *params):
+        self.host.write(pack('<IHHI' + 'I' * len(params), 0xc + 4 * len(params), ContainerTypes.Command, code, tid, *params))
+        self.assertTrue(self.uut.process_one())
+
+    def read_transfers(self, count):
+        return [self.host.read(0x10000) for _ in range(count)]
+
+    def testResponse(self):
+        self.transact(OperationDataCodes.OpenSession, 1, 1)
+        self.assertEqual(self.read_transfers(1), [pack('<IHHI', 0xc, ContainerTypes.Response, ResponseCodes.OK, 1)])
+
+    def testBatchedDataPhase(self):
+        obj = self.add_file(1000)
+        self.transact(OperationDataCodes.OpenSession, 1, 1)
+        self.read_transfers(1)
+        self.transact(OperationDataCodes.GetObject, 2, obj.get_uid())
+        transfers = self.read_transfers(5)
+        # 1012 bytes in transfers of up to max_write, all but the last a multiple of max_packet
+        self.assertEqual([len(t) for t in transfers[:4]], [256, 256, 256, 244])
+        with open(obj.real_path, 'rb') as f:
+            self.assertEqual(b''.join(transfers[:4])[0xc:], f.read())
+        self.assertEqual(transfers[4], pack('<IHHI', 0xc, ContainerTypes.Response, ResponseCodes.OK, 2))
+
+    def testZeroLengthPacket(self):
+        obj = self.add_file(64 * 5 - 0xc)
+        self.transact(OperationDataCodes.OpenSession, 1, 1)
+        self.read_transfers(1)
+        self.transact(OperationDataCodes.GetObject, 2, obj.get_uid())
+        transfers = self.read_transfers(4)
+        self.assertEqual([len(t) for t in transfers], [256, 64, 0, 0xc])
+
+    def testIncomingZeroLengthPacket(self):
+        self.host.write(b'')
+        self.assertTrue(self.uut.process_one())
+        self.transact(OperationDataCodes.OpenSession, 1, 1)
+        self.assertEqual(len(self.read_transfers(1)[0]), 0xc)
+
+    def testProtocolError(self):
+        self.host.write(b'\x00' * 4)
+        self.assertTrue(self.uut.process_one())
+        self.transact(OperationDataCodes.OpenSession, 1, 1)
+        self.assertEqual(len(self.read_transfers(1)[0]), 0xc)
+
+    def testClosed(self):
+        self.socks[1].shutdown(socket.SHUT_WR)
+        self.assertFalse(self.uut.process_one())
+
+    def start_data_phase(self):
+        self.transact(OperationDataCodes.OpenSession, 1, 1)
+        self.read_transfers(1)
+        self.transact(OperationDataCodes.SendObjectInfo, 2, 0, 0)
+        # only the start of the data phase arrives
+        self.host.write(pack('<IHHI', 0x100, ContainerTypes.Data, OperationDataCodes.SendObjectInfo, 2) + b'\x00' * 0x20)
+        self.assertTrue(self.uut.process_one())
+        self.assertEqual(self.uut.api.state, MtpApi.STATE_WAIT_MORE_DATA)
+
+    def testHostGone(self):
+        self.start_data_phase()
+        self.uut.bulk_out = FailingEndpoint(errno.ESHUTDOWN)
+        self.assertFalse(self.uut.process_one())
+        self.assertEqual(self.uut.api.state, MtpApi.STATE_WAIT_CMD)
+        self.assertIsNone(self.uut.api.transaction.ir_data)
+
+    def testEndpointError(self):
+        self.start_data_phase()
+        self.uut.bulk_out = FailingEndpoint(errno.EIO)
+        with self.assertRaises(EnvironmentError):
+            self.uut.process_one()
+        self.assertEqual(self.uut.api.state, MtpApi.STATE_WAIT_CMD)
+
+    def testEvent(self):
+        self.uut.send_event(0x4002, [5], 3)
+        self.assertEqual(self.host_interrupt.read(64), pack('<IHHII', 0x10, ContainerTypes.Event, 0x4002, 3, 5))
+
+    def testInvalidMaxWrite(self):
+        with self.assertRaises(Exception):
+            MtpTransport(MtpApi(self.dev), None, None, max_packet=512, max_write=1000)
@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 import os
+import sys
 import unittest
 from mtp_device_tests import *
 from mtp_api_tests import *
 from mtp_msg_tests import *
 from mtp_property_tests import *
 from mtp_object_tests import *
+from mtp_data_types_tests import *
+from mtp_fs_tests import *
+from mtp_catalog_tests import *
+from mtp_transport_tests import *
+if sys.version_info >= (3, 7):
+    from mtp_async_tests import *
 
 
 if __name__ == '__main__':